@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the /api/chat proxy path
+Runs server.py against the stub LLM server, drives it at fixed concurrency levels and
+reports throughput, latency percentiles, time-to-first-byte and proxy overhead per provider
+
+    python benchmarks/bench_chat.py --concurrency 1,8,32 --requests 200 --output bench.json
+    python benchmarks/bench_chat.py --stream --compare bench.json
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_llm_server import StubConfig, start_stub_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROVIDERS = ['openai', 'anthropic', 'gemini', 'nvidia-nim']
+MODELS = {
+    'openai': 'gpt-4o-mini',
+    'anthropic': 'claude-3-haiku',
+    'gemini': 'gemini-pro',
+    'nvidia-nim': 'meta/llama3-8b-instruct',
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def start_proxy(port, stub_url, proxy_args):
+    """Start server.py sending provider calls to ``stub_url`` (None: the real providers)"""
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    if stub_url:
+        env.update(ECM_GEMINI_BASE_URL=stub_url, ECM_OPENAI_BASE_URL=stub_url, ECM_ANTHROPIC_BASE_URL=stub_url,
+                   ECM_NIM_BASE_URL=stub_url)
+    process = subprocess.Popen([sys.executable, 'server.py', '--port', str(port)] + proxy_args,
+                               cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+def timed_post(port, path, payload, headers=None):
+    """POST and return (status, seconds to first body byte, total seconds, response bytes)"""
+    body = json.dumps(payload).encode('utf-8')
+    headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        conn.request('POST', path, body=body, headers=headers)
+        response = conn.getresponse()
+        first = response.read(1)
+        ttfb = time.perf_counter() - start
+        rest = response.read()
+        return response.status, ttfb, time.perf_counter() - start, len(first) + len(rest)
+    finally:
+        conn.close()
+
+
+def proxy_request(port, provider, message, stream):
+    payload = {
+        'provider': provider,
+        'apiKey': 'bench-key',
+        'message': message,
+        'model': MODELS[provider],
+        'temperature': 0.7,
+        'stream': stream,
+        'cache': False,
+    }
+    return timed_post(port, '/api/chat', payload)
+
+
+def direct_request(port, provider, message, stream):
+    """The same call sent straight to the stub: the baseline the proxy overhead is measured against"""
+    model = MODELS[provider]
+    if provider == 'gemini':
+        method = 'streamGenerateContent?alt=sse&key=bench-key' if stream else 'generateContent?key=bench-key'
+        return timed_post(port, f"/v1beta/models/{model}:{method}",
+                          {'contents': [{'parts': [{'text': message}]}]})
+    path = '/v1/messages' if provider == 'anthropic' else '/v1/chat/completions'
+    payload = {'model': model, 'messages': [{'role': 'user', 'content': message}], 'stream': stream,
+               'max_tokens': 1024}
+    return timed_post(port, path, payload)
+
+
+def run_load(send, total, concurrency):
+    """Issue ``total`` requests from ``concurrency`` threads; returns (samples, wall seconds)"""
+    counter = itertools.count()
+    lock = threading.Lock()
+    samples = []
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter)
+            if i >= total:
+                return
+            try:
+                samples.append(send(f"Benchmark question {i}: what is provenance tracking?"))
+            except OSError as e:
+                samples.append((0, None, None, 0, str(e)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return samples, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def distribution_ms(values):
+    return {
+        'p50': round(percentile(values, 0.50) * 1000, 3) if values else None,
+        'p95': round(percentile(values, 0.95) * 1000, 3) if values else None,
+        'p99': round(percentile(values, 0.99) * 1000, 3) if values else None,
+        'mean': round(sum(values) / len(values) * 1000, 3) if values else None,
+    }
+
+
+def summarize(samples, wall):
+    ok = [s for s in samples if s[0] == 200]
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'throughput_rps': round(len(ok) / wall, 2) if wall else None,
+        'latency_ms': distribution_ms([s[2] for s in ok]),
+        'ttfb_ms': distribution_ms([s[1] for s in ok]),
+        'mean_response_bytes': round(sum(s[3] for s in ok) / len(ok), 1) if ok else None,
+    }
+
+
+def overhead(proxy, direct):
+    return {key: (round(proxy[key] - direct[key], 3) if proxy[key] is not None and direct[key] is not None else None)
+            for key in ('p50', 'p95', 'p99', 'mean')}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Print p50/p99 latency and throughput changes against an earlier results file"""
+    def key(result):
+        return (result['provider'], result['concurrency'], result['stream'])
+
+    old = {key(result): result for result in previous['results']}
+    print(f"\n📊 Compared with {previous.get('revision') or 'previous run'}:")
+    for result in current['results']:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        changes = []
+        for label, path in (('p50', ('latency_ms', 'p50')), ('p99', ('latency_ms', 'p99')),
+                            ('overhead p50', ('overhead_ms', 'p50'))):
+            a, b = before[path[0]][path[1]], result[path[0]][path[1]]
+            if a is not None and b is not None:
+                changes.append(f"{label} {a:.1f}→{b:.1f}ms")
+        a, b = before['throughput_rps'], result['throughput_rps']
+        if a and b:
+            changes.append(f"rps {a:.1f}→{b:.1f} ({(b - a) / a * 100:+.1f}%)")
+        print(f"  {result['provider']:<11} c={result['concurrency']:<4} " + ', '.join(changes))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the /api/chat proxy against a stub provider")
+    parser.add_argument('--providers', default=','.join(PROVIDERS))
+    parser.add_argument('--concurrency', default='1,8,32', help="comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=100, help="requests per provider and level")
+    parser.add_argument('--stream', action='store_true', help="use SSE streaming requests")
+    parser.add_argument('--latency', type=float, default=0.2, help="stub seconds to first token")
+    parser.add_argument('--token-rate', type=float, default=500.0, help="stub tokens per second")
+    parser.add_argument('--tokens', type=int, default=64, help="stub tokens per answer")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="stub failure fraction")
+    parser.add_argument('--proxy-arg', action='append', default=[],
+                        help="extra server.py argument (repeatable), e.g. --proxy-arg=--workers=4")
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    providers = [p for p in args.providers.split(',') if p]
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+
+    stub = start_stub_server(0, StubConfig(args.latency, args.token_rate, args.tokens, args.error_rate))
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    proxy_port = free_port()
+    proxy = start_proxy(proxy_port, stub_url, args.proxy_arg)
+    print(f"🤖 Stub provider at {stub_url}, proxy on port {proxy_port}")
+
+    results = []
+    try:
+        for provider in providers:
+            for level in levels:
+                # Warm up connections (and the proxy's pool) before measuring
+                run_load(lambda m: proxy_request(proxy_port, provider, m, args.stream), level, level)
+                samples, wall = run_load(lambda m: proxy_request(proxy_port, provider, m, args.stream),
+                                         args.requests, level)
+                direct_samples, direct_wall = run_load(
+                    lambda m: direct_request(stub.server_port, provider, m, args.stream), args.requests, level)
+                result = dict(provider=provider, concurrency=level, stream=args.stream, **summarize(samples, wall))
+                direct = summarize(direct_samples, direct_wall)
+                result['direct_latency_ms'] = direct['latency_ms']
+                result['overhead_ms'] = overhead(result['latency_ms'], direct['latency_ms'])
+                result['ttfb_overhead_ms'] = overhead(result['ttfb_ms'], direct['ttfb_ms'])
+                results.append(result)
+                print(f"  {provider:<11} c={level:<4} {result['throughput_rps']:>8} rps  "
+                      f"p50 {result['latency_ms']['p50']}ms  p99 {result['latency_ms']['p99']}ms  "
+                      f"ttfb p50 {result['ttfb_ms']['p50']}ms  overhead p50 {result['overhead_ms']['p50']}ms  "
+                      f"errors {result['errors']}")
+    finally:
+        proxy.terminate()
+        proxy.wait(timeout=30)
+        stub.shutdown()
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Replay a captured request log against the proxy
+Re-issues the chat requests recorded with --request-log at their original pacing (or sped up) against the stub
+provider or the real ones, and reports latency, throughput and how far the schedule slipped
+
+    python benchmarks/replay.py requests.jsonl --speed 10
+    python benchmarks/replay.py 'requests*.jsonl*' --speed 0 --max-concurrency 64 --output replay.json
+    python benchmarks/replay.py requests.jsonl --real --api-key openai=sk-... --api-key gemini=...
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from bench_chat import REPO_ROOT, distribution_ms, free_port, start_proxy, summarize, timed_post
+from stub_llm_server import StubConfig, start_stub_server
+
+sys.path.insert(0, REPO_ROOT)
+from data_dir import DATA_DIR
+
+REPLAYED_ENDPOINTS = ('/api/chat', '/api/chat/batch')
+# Words for stand-in prompts when the log holds only a prompt hash
+FILLER_WORDS = ('evidence', 'chain', 'provenance', 'tracking', 'method', 'data', 'analysis', 'claim', 'source',
+                'version', 'control', 'reproducible', 'workflow', 'student', 'explain', 'why', 'how', 'what',
+                'step', 'example', 'research', 'result', 'figure', 'model', 'question', 'the', 'of', 'and', 'in')
+
+
+def load_records(patterns):
+    """Chat records from the given log files (globs allowed, rotated and per-worker files merged), oldest first.
+
+    Relative names are matched both here and in the server's data directory.
+    """
+    records = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) + glob.glob(os.path.join(DATA_DIR, pattern))
+        paths = sorted({os.path.realpath(path) for path in matches}) or [pattern]
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+                    if record.get('endpoint') in REPLAYED_ENDPOINTS and record.get('provider'):
+                        records.append(record)
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def stand_in_prompt(digest, chars):
+    """Deterministic text of the logged length: repeated prompts stay repeated, so cache behaviour replays too"""
+    rng = random.Random(digest)
+    words = []
+    length = -1
+    while length < chars:
+        word = rng.choice(FILLER_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:max(chars, 1)]
+
+
+def replay_payload(record, api_keys):
+    message = record.get('prompt')
+    if message is None:
+        message = stand_in_prompt(record.get('prompt_sha256', ''), record.get('prompt_chars', 0))
+    return {
+        'provider': record['provider'],
+        'model': record.get('model'),
+        'apiKey': api_keys.get(record['provider'], 'replay-key'),
+        'message': message,
+        'temperature': record.get('temperature', 0.7),
+        'stream': bool(record.get('stream')),
+    }
+
+
+def replay(records, port, speed, max_concurrency, api_keys):
+    """Send each record at its logged offset divided by ``speed`` (0: as fast as possible)"""
+    samples = []
+    lags = []
+    lock = threading.Lock()
+    first_ts = records[0]['ts']
+
+    def send(record, scheduled):
+        lag = time.perf_counter() - scheduled
+        try:
+            sample = timed_post(port, '/api/chat', replay_payload(record, api_keys))
+        except OSError as e:
+            sample = (0, None, None, 0, str(e))
+        with lock:
+            samples.append((record,) + sample)
+            lags.append(lag)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        for record in records:
+            scheduled = start + ((record['ts'] - first_ts) / speed if speed > 0 else 0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, record, scheduled)
+    return samples, lags, time.perf_counter() - start
+
+
+def report(records, samples, lags, wall, speed):
+    span = records[-1]['ts'] - records[0]['ts']
+    results = {
+        'requests': len(records),
+        'original_span_s': round(span, 3),
+        'original_rps': round(len(records) / span, 2) if span else None,
+        'speed': speed,
+        'wall_s': round(wall, 3),
+        'schedule_lag_ms': distribution_ms(lags),
+        'overall': summarize([sample[1:] for sample in samples], wall),
+        'providers': {},
+        'status_changes': {},
+    }
+    for provider in sorted({record['provider'] for record in records}):
+        provider_samples = [sample[1:] for sample in samples if sample[0]['provider'] == provider]
+        results['providers'][provider] = summarize(provider_samples, wall)
+        original = [record['total_ms'] / 1000 for record in records
+                    if record['provider'] == provider and record.get('status') == 200 and 'total_ms' in record]
+        results['providers'][provider]['original_latency_ms'] = distribution_ms(original)
+    for record, status, *_ in samples:
+        if record.get('status') != status:
+            change = f"{record.get('status')}->{status}"
+            results['status_changes'][change] = results['status_changes'].get(change, 0) + 1
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a --request-log capture against the proxy")
+    parser.add_argument('logs', nargs='+', help="request log files or globs (e.g. 'requests*.jsonl*')")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="pacing multiplier: 1 = original timing, 10 = ten times faster, 0 = no pacing")
+    parser.add_argument('--limit', type=int, default=None, help="replay only the first N requests")
+    parser.add_argument('--max-concurrency', type=int, default=256, help="client threads sending requests")
+    parser.add_argument('--url', help="replay against an already running proxy instead of starting one")
+    parser.add_argument('--real', action='store_true',
+                        help="start the proxy against the real providers instead of the stub (needs --api-key)")
+    parser.add_argument('--api-key', action='append', default=[], metavar='PROVIDER=KEY',
+                        help="API key to send for a provider (logged keys are redacted)")
+    parser.add_argument('--latency', type=float, default=0.2, help="stub seconds to first token")
+    parser.add_argument('--token-rate', type=float, default=500.0, help="stub tokens per second")
+    parser.add_argument('--tokens', type=int, default=64, help="stub tokens per answer")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="stub failure fraction")
+    parser.add_argument('--proxy-arg', action='append', default=[],
+                        help="extra server.py argument (repeatable), e.g. --proxy-arg=--workers=4")
+    parser.add_argument('--output', help="write results JSON here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    records = load_records(args.logs)[:args.limit]
+    if not records:
+        raise SystemExit("❌ No chat requests found in the log")
+    api_keys = dict(entry.split('=', 1) for entry in args.api_key)
+
+    stub = proxy = None
+    if args.url:
+        port = urlparse(args.url).port
+        print(f"🎯 Replaying {len(records)} requests against {args.url}")
+    else:
+        port = free_port()
+        if args.real:
+            proxy = start_proxy(port, None, args.proxy_arg)
+            print(f"🌐 Proxy on port {port} calling the real providers")
+        else:
+            stub = start_stub_server(0, StubConfig(args.latency, args.token_rate, args.tokens, args.error_rate))
+            proxy = start_proxy(port, f"http://127.0.0.1:{stub.server_port}", args.proxy_arg)
+            print(f"🤖 Stub provider on port {stub.server_port}, proxy on port {port}")
+    try:
+        samples, lags, wall = replay(records, port, args.speed, args.max_concurrency, api_keys)
+    finally:
+        if proxy is not None:
+            proxy.terminate()
+            proxy.wait(timeout=30)
+        if stub is not None:
+            stub.shutdown()
+
+    results = report(records, samples, lags, wall, args.speed)
+    overall = results['overall']
+    print(f"✅ {results['requests']} requests in {results['wall_s']}s (originally {results['original_span_s']}s), "
+          f"{overall['throughput_rps']} rps, p50 {overall['latency_ms']['p50']}ms, "
+          f"p99 {overall['latency_ms']['p99']}ms, errors {overall['errors']}, "
+          f"schedule lag p99 {results['schedule_lag_ms']['p99']}ms")
+    for provider, summary in results['providers'].items():
+        print(f"  {provider:<11} p50 {summary['latency_ms']['p50']}ms "
+              f"(originally {summary['original_latency_ms']['p50']}ms)  errors {summary['errors']}")
+    if results['status_changes']:
+        print(f"  status changes vs. the log: {results['status_changes']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
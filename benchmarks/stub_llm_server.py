@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Stand-in LLM provider for benchmarking the proxy
+Speaks the OpenAI/NIM, Anthropic and Gemini request/response shapes (plain and streaming)
+with configurable first-token latency, token rate and error rate
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+GEMINI_PATH = re.compile(r'^/v1beta/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)')
+
+
+class StubConfig:
+    def __init__(self, latency=0.2, token_rate=200.0, tokens=64, error_rate=0.0, seed=None):
+        self.latency = latency  # Seconds until the first token
+        self.token_rate = token_rate  # Tokens per second after the first one (0 = instant)
+        self.tokens = tokens  # Tokens per answer
+        self.error_rate = error_rate  # Fraction of requests answered with an error
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Keep-alive clients otherwise see a delayed-ACK stall between headers and body
+    disable_nagle_algorithm = True
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self.send_json(400, {'error': {'message': 'invalid JSON'}})
+
+        path = self.path.split('?', 1)[0]
+        gemini = GEMINI_PATH.match(path)
+        if path == '/v1/chat/completions':
+            shape, stream = 'openai', bool(request.get('stream'))
+        elif path == '/v1/messages':
+            shape, stream = 'anthropic', bool(request.get('stream'))
+        elif gemini:
+            shape, stream = 'gemini', gemini.group('method') == 'streamGenerateContent'
+        else:
+            return self.send_json(404, {'error': {'message': f'unknown path {path}'}})
+
+        if self.config.should_fail():
+            status = self.config.random.choice([429, 500, 503])
+            headers = {'Retry-After': '1'} if status != 500 else {}
+            return self.send_json(status, {'error': {'message': 'stub failure', 'code': status}}, headers)
+
+        words = [f"tok{i}" for i in range(self.config.tokens)]
+        time.sleep(self.config.latency)
+        if stream:
+            self.stream_tokens(shape, words)
+        else:
+            if self.config.token_rate:
+                time.sleep(max(len(words) - 1, 0) / self.config.token_rate)
+            self.send_json(200, self.full_response(shape, ' '.join(words)))
+
+    def full_response(self, shape, text):
+        if shape == 'gemini':
+            return {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}]}
+        if shape == 'anthropic':
+            return {'type': 'message', 'role': 'assistant', 'content': [{'type': 'text', 'text': text}]}
+        return {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}}]}
+
+    def delta_event(self, shape, text):
+        if shape == 'gemini':
+            return f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': text}]}}]})}\r\n\r\n"
+        if shape == 'anthropic':
+            payload = {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': text}}
+            return f"event: content_block_delta\ndata: {json.dumps(payload)}\n\n"
+        return f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': text}}]})}\n\n"
+
+    def stream_tokens(self, shape, words):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            if shape == 'anthropic':
+                self.write_chunk('event: message_start\ndata: {"type": "message_start"}\n\n')
+            for i, word in enumerate(words):
+                if i and self.config.token_rate:
+                    time.sleep(1 / self.config.token_rate)
+                self.write_chunk(self.delta_event(shape, word if i == 0 else ' ' + word))
+            if shape == 'anthropic':
+                self.write_chunk('event: message_stop\ndata: {"type": "message_stop"}\n\n')
+            elif shape == 'openai':
+                self.write_chunk('data: [DONE]\n\n')
+            self.write_chunk('')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_server(port=0, config=None):
+    """Start the stub in a background thread and return the server (port in ``server_port``)"""
+    handler = type('ConfiguredStubLLMHandler', (StubLLMHandler,), {'config': config or StubConfig()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in LLM provider for benchmarks")
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds to the first token")
+    parser.add_argument('--token-rate', type=float, default=200.0, help="tokens per second (0 = instant)")
+    parser.add_argument('--tokens', type=int, default=64, help="tokens per answer")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail")
+    args = parser.parse_args()
+    config = StubConfig(args.latency, args.token_rate, args.tokens, args.error_rate)
+    server = start_stub_server(args.port, config)
+    print(f"🤖 Stub LLM server on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Keep-alive connection pool for upstream LLM provider calls
+Reuses TCP/TLS connections per host so chat requests skip the handshake
+"""
+
+import http.client
+import os
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from tracing import span
+
+DEFAULT_POOL_SIZE = int(os.environ.get('ECM_POOL_SIZE', '8'))
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get('ECM_POOL_IDLE_TIMEOUT', '60'))
+DEFAULT_REQUEST_TIMEOUT = float(os.environ.get('ECM_UPSTREAM_TIMEOUT', '120'))
+
+# Errors that mean a reused keep-alive connection was closed by the peer
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class RequestCancelled(Exception):
+    """The request was cancelled from another thread (e.g. it lost a hedged race)"""
+
+
+class CancelToken:
+    """Lets another thread abort an upstream request by shutting down its socket"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def register(self, conn: http.client.HTTPConnection):
+        with self._lock:
+            if self.cancelled:
+                raise RequestCancelled("Request was cancelled")
+            self._connections.append(conn)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            sock = conn.sock
+            if sock is not None:
+                try:
+                    # shutdown (not close) is safe while another thread is blocked reading
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def create_ssl_context() -> ssl.SSLContext:
+    """SSL context shared by every pooled connection (no verification, for development)"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class PooledResponse:
+    """Wraps an ``http.client.HTTPResponse`` and returns its connection to the pool on close"""
+
+    def __init__(self, pool: 'ConnectionPool', key: Tuple[str, str, int],
+                 conn: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self._response.read(amt)
+
+    def readline(self) -> bytes:
+        return self._response.readline()
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        # Only a fully consumed response leaves the connection in a reusable state
+        reusable = self._response.isclosed() and not self._response.will_close
+        if not reusable:
+            self._response.close()
+        self._pool._release(self._key, conn, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """Process-wide pool of keep-alive HTTP(S) connections, keyed by (scheme, host, port)"""
+
+    def __init__(self, max_per_host: int = DEFAULT_POOL_SIZE,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 ssl_context: Optional[ssl.SSLContext] = None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context or create_ssl_context()
+        self._idle: Dict[Tuple[str, str, int], deque] = {}
+        self._lock = threading.Lock()
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.discarded_connections = 0
+
+    def configure(self, max_per_host: Optional[int] = None, idle_timeout: Optional[float] = None,
+                  timeout: Optional[float] = None):
+        """Adjust pool limits at startup"""
+        if max_per_host is not None:
+            self.max_per_host = max_per_host
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        if timeout is not None:
+            self.timeout = timeout
+
+    def request(self, method: str, url: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None,
+                timeout: Optional[float] = None,
+                cancel_token: Optional[CancelToken] = None) -> PooledResponse:
+        """Send a request over a pooled connection and return the (unread) response"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        headers = dict(headers or {})
+        headers.setdefault('Connection', 'keep-alive')
+
+        conn, reused = self._acquire(key, timeout)
+        try:
+            response = self._send(conn, method, path, body, headers, cancel_token)
+            if reused:
+                # Counted only once it carried a request; a stale one is a discard and its retry a new connection
+                with self._lock:
+                    self.reused_connections += 1
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            if reused:
+                with self._lock:
+                    self.discarded_connections += 1
+            if not reused or (cancel_token is not None and cancel_token.cancelled):
+                raise
+            # The idle connection was closed by the server; retry once on a fresh one
+            conn = self._connect(key, timeout)
+            try:
+                response = self._send(conn, method, path, body, headers, cancel_token)
+            except BaseException:
+                conn.close()
+                raise
+        except BaseException:
+            conn.close()
+            raise
+        return PooledResponse(self, key, conn, response)
+
+    def _send(self, conn, method, path, body, headers, cancel_token):
+        if conn.sock is None:
+            # Connect up front, so a cancel has a socket to shut down and traces see the (TLS) handshake
+            with span('connect', host=conn.host, tls=isinstance(conn, http.client.HTTPSConnection)):
+                conn.connect()
+        if cancel_token is not None:
+            cancel_token.register(conn)
+        with span('send', bytes=len(body or b'')):
+            conn.request(method, path, body=body, headers=headers)
+        with span('wait'):
+            return conn.getresponse()
+
+    def _acquire(self, key: Tuple[str, str, int], timeout: Optional[float]):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    conn.timeout = timeout or self.timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(conn.timeout)
+                    return conn, True
+                self.discarded_connections += 1
+                conn.close()
+        return self._connect(key, timeout), False
+
+    def _connect(self, key: Tuple[str, str, int], timeout: Optional[float]):
+        scheme, host, port = key
+        with self._lock:
+            self.new_connections += 1
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=timeout or self.timeout,
+                                               context=self.ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=timeout or self.timeout)
+
+    def _release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection, reusable: bool):
+        if reusable and conn.sock is not None:
+            with self._lock:
+                idle = self._idle.setdefault(key, deque())
+                if len(idle) < self.max_per_host:
+                    idle.append((conn, time.monotonic()))
+                    return
+                self.discarded_connections += 1
+        conn.close()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of new vs reused connections"""
+        with self._lock:
+            return {
+                'new_connections': self.new_connections,
+                'reused_connections': self.reused_connections,
+                'discarded_connections': self.discarded_connections,
+                'idle_connections': sum(len(idle) for idle in self._idle.values()),
+                'max_per_host': self.max_per_host,
+            }
+
+# Global instance
+upstream_pool = ConnectionPool()
@@ -0,0 +1,22 @@
+"""
+Private data directory for the proxy server
+Session and cache databases, request logs, traces and profiles are kept here, outside the directory the server
+serves static files from
+"""
+
+import os
+
+DATA_DIR = os.path.expanduser(os.environ.get('ECM_DATA_DIR') or os.path.join(
+    os.environ.get('XDG_STATE_HOME') or os.path.join('~', '.local', 'state'), 'ecm-agent'))
+
+
+def data_path(path: str) -> str:
+    """``path`` itself if it is absolute (or starts with ~), otherwise the same name under the data directory.
+
+    The parent directory is created, so callers can open the file straight away.
+    """
+    path = os.path.expanduser(path)
+    if not os.path.isabs(path):
+        path = os.path.join(DATA_DIR, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
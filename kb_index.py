@@ -0,0 +1,443 @@
+"""
+Persisted binary knowledge base index
+Versioned on-disk format (array-backed postings, chunk text arena, contiguous vector block) opened with mmap
+
+Build it offline with ``python kb_index.py build``; ``KnowledgeBase`` opens the
+file at startup when its corpus hash matches the embedded documents, so no
+indexing work happens at import time and forked workers share the mapped pages.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # The vector block is skipped without NumPy
+    np = None
+
+MAGIC = b'ECMKBIDX'
+FORMAT_VERSION = 1
+# magic, format version, corpus sha256, section count
+HEADER = struct.Struct('<8sI32sI')
+# section name, offset, length
+SECTION = struct.Struct('<24sQQ')
+ALIGNMENT = 8
+
+
+class IndexFormatError(Exception):
+    """The file is not a knowledge base index this version can read"""
+
+
+def _to_bytes(values: array) -> bytes:
+    # The format is little-endian so files can be copied between machines
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _string_sections(name: str, strings: List[str]) -> Dict[str, Any]:
+    """A string table: concatenated UTF-8 plus an offsets array with one extra entry"""
+    offsets = array('Q', [0])
+    data = bytearray()
+    for string in strings:
+        data += string.encode('utf-8')
+        offsets.append(len(data))
+    return {f'{name}.off': offsets, name: bytes(data)}
+
+
+def _postings_sections(prefix: str, index, ids: List[str]) -> Dict[str, Any]:
+    """Flatten an ``InvertedIndex`` into term-sorted arrays over document rows"""
+    rows = {doc_id: row for row, doc_id in enumerate(ids)}
+    # Code point order equals UTF-8 byte order, so readers can binary search the raw bytes
+    terms = sorted(index.postings)
+    term_postings = array('Q', [0])
+    posting_docs = array('I')
+    posting_positions = array('Q', [0])
+    positions = array('I')
+    for term in terms:
+        for doc_id, token_positions in sorted(index.postings[term].items(), key=lambda item: rows[item[0]]):
+            posting_docs.append(rows[doc_id])
+            positions.extend(token_positions)
+            posting_positions.append(len(positions))
+        term_postings.append(len(posting_docs))
+    sections = _string_sections(f'{prefix}.terms', terms)
+    sections.update({
+        f'{prefix}.postings': term_postings,
+        f'{prefix}.docs': posting_docs,
+        f'{prefix}.pos.off': posting_positions,
+        f'{prefix}.pos': positions,
+        f'{prefix}.lengths': array('I', (index.doc_lengths[doc_id] for doc_id in ids)),
+    })
+    return sections
+
+
+def write_index(path: str, corpus_hash: str, index, chunk_index, chunks: Dict[str, Dict[str, Any]],
+                vectors: Optional[Tuple[List[str], Any, Any]] = None) -> int:
+    """Write the document index, chunk index, chunks and (optionally) chunk vectors to ``path``.
+
+    The file is written next to ``path`` and renamed into place, so processes
+    that have the previous version mapped keep reading it undisturbed.
+    Returns the file size in bytes.
+    """
+    doc_ids = list(index.doc_lengths)
+    chunk_ids = list(chunks)
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'built_at': time.time(),
+        'documents': len(doc_ids),
+        'chunks': len(chunk_ids),
+        'doc_total_length': index.total_length,
+        'chunk_total_length': chunk_index.total_length,
+        'dimensions': None,
+    }
+    sections: Dict[str, Any] = {}
+    sections.update(_string_sections('doc.ids', doc_ids))
+    sections.update(_postings_sections('doc', index, doc_ids))
+    sections.update(_string_sections('chunk.ids', chunk_ids))
+    sections.update(_postings_sections('chunk', chunk_index, chunk_ids))
+    sections.update(_string_sections('chunk.text', [chunks[chunk_id]['text'] for chunk_id in chunk_ids]))
+    sections.update(_string_sections('chunk.meta', [
+        json.dumps({key: chunks[chunk_id][key] for key in ('doc_id', 'section', 'section_path', 'start', 'end')})
+        for chunk_id in chunk_ids]))
+    if vectors is not None and vectors[1] is not None:
+        ids, matrix, idf = vectors
+        rows = {item_id: row for row, item_id in enumerate(ids)}
+        # Rows in chunk order so the vector block shares the chunk id table
+        ordered = np.ascontiguousarray(matrix[[rows[chunk_id] for chunk_id in chunk_ids]], dtype='<f4')
+        sections['vectors'] = ordered.tobytes()
+        sections['vectors.idf'] = np.ascontiguousarray(idf, dtype='<f4').tobytes()
+        meta['dimensions'] = int(ordered.shape[1])
+    sections['meta'] = json.dumps(meta).encode('utf-8')
+
+    blobs = [(name, value if isinstance(value, bytes) else _to_bytes(value)) for name, value in sections.items()]
+    offset = HEADER.size + SECTION.size * len(blobs)
+    table = []
+    for name, blob in blobs:
+        offset += -offset % ALIGNMENT  # Keep every array aligned for zero-copy casts
+        table.append((name, offset, len(blob)))
+        offset += len(blob)
+
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, bytes.fromhex(corpus_hash), len(table)))
+        for name, section_offset, length in table:
+            f.write(SECTION.pack(name.encode('ascii'), section_offset, length))
+        for (_, blob), (_, section_offset, _) in zip(blobs, table):
+            f.write(b'\0' * (section_offset - f.tell()))
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return offset
+
+
+class StringTable(Sequence):
+    """Read-only list of strings stored as a UTF-8 arena plus offsets"""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+        self._rows: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._data[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]])
+
+    def index(self, value, start=0, stop=None) -> int:
+        """Row of ``value`` through a dict built on first use (ids are not stored sorted)"""
+        if self._rows is None:
+            self._rows = {string: row for row, string in enumerate(self)}
+        row = self._rows.get(value)
+        if row is None:
+            raise ValueError(value)
+        return row
+
+    def __contains__(self, value) -> bool:
+        try:
+            self.index(value)
+            return True
+        except ValueError:
+            return False
+
+    def find(self, value: str) -> Optional[int]:
+        """Binary search for ``value`` in a table written in sorted order"""
+        target = value.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self.raw(lo) == target else None
+
+
+class MappedTermPostings(Mapping):
+    """``doc_id -> positions`` for one term, read from its slice of the postings arrays.
+
+    Rows within a term are stored in ascending order, so looking up one document
+    is a binary search instead of decoding every posting of the term.
+    """
+
+    def __init__(self, start: int, stop: int, docs: memoryview, offsets: memoryview, positions: memoryview,
+                 ids: StringTable):
+        self._start = start
+        self._stop = stop
+        self._docs = docs
+        self._offsets = offsets
+        self._positions = positions
+        self._ids = ids
+
+    def __getitem__(self, doc_id: str) -> memoryview:
+        try:
+            row = self._ids.index(doc_id)
+        except ValueError:
+            raise KeyError(doc_id) from None
+        j = bisect_left(self._docs, row, self._start, self._stop)
+        if j == self._stop or self._docs[j] != row:
+            raise KeyError(doc_id)
+        return self._positions[self._offsets[j]:self._offsets[j + 1]]
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __iter__(self):
+        return (self._ids[self._docs[j]] for j in range(self._start, self._stop))
+
+    def items(self) -> List[Tuple[str, memoryview]]:
+        """Every posting in one pass (the inherited version would search for each document again)"""
+        offsets = self._offsets
+        return [(self._ids[self._docs[j]], self._positions[offsets[j]:offsets[j + 1]])
+                for j in range(self._start, self._stop)]
+
+
+class MappedPostings(Mapping):
+    """``token -> {doc_id: positions}`` over the flattened postings arrays"""
+
+    def __init__(self, terms: StringTable, term_postings: memoryview, posting_docs: memoryview,
+                 posting_positions: memoryview, positions: memoryview, ids: StringTable):
+        self._terms = terms
+        self._term_postings = term_postings
+        self._posting_docs = posting_docs
+        self._posting_positions = posting_positions
+        self._positions = positions
+        self._ids = ids
+
+    def __getitem__(self, token: str) -> MappedTermPostings:
+        term = self._terms.find(token)
+        if term is None:
+            raise KeyError(token)
+        return MappedTermPostings(self._term_postings[term], self._term_postings[term + 1], self._posting_docs,
+                                  self._posting_positions, self._positions, self._ids)
+
+    def __contains__(self, token) -> bool:
+        return isinstance(token, str) and self._terms.find(token) is not None
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __iter__(self):
+        return iter(self._terms)
+
+
+class MappedLengths(Mapping):
+    """``doc_id -> token count`` backed by an array in id-table order"""
+
+    def __init__(self, ids: StringTable, lengths: memoryview):
+        self._ids = ids
+        self._lengths = lengths
+
+    def __getitem__(self, doc_id: str) -> int:
+        try:
+            return self._lengths[self._ids.index(doc_id)]
+        except ValueError:
+            raise KeyError(doc_id) from None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+
+class MappedChunks(Mapping):
+    """``chunk_id -> chunk dict`` read from the text and metadata arenas on access"""
+
+    def __init__(self, ids: StringTable, texts: StringTable, metadata: StringTable):
+        self._ids = ids
+        self._texts = texts
+        self._metadata = metadata
+
+    def __getitem__(self, chunk_id: str) -> Dict[str, Any]:
+        try:
+            row = self._ids.index(chunk_id)
+        except ValueError:
+            raise KeyError(chunk_id) from None
+        chunk = json.loads(self._metadata[row])
+        chunk['id'] = chunk_id
+        chunk['text'] = self._texts[row]
+        return chunk
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+
+class IndexFile:
+    """A memory-mapped index file; opening it only reads the header and section table"""
+
+    def __init__(self, path: str):
+        if sys.byteorder != 'little':
+            raise IndexFormatError("Memory-mapped index files need a little-endian machine")
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise IndexFormatError("Index file is empty") from None
+        self.size = len(self._mmap)
+        if self.size < HEADER.size:
+            raise IndexFormatError("Index file is truncated")
+        magic, version, digest, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise IndexFormatError("Not a knowledge base index file")
+        if version != FORMAT_VERSION:
+            raise IndexFormatError(f"Index format version {version} (this build reads {FORMAT_VERSION})")
+        if HEADER.size + SECTION.size * count > self.size:
+            raise IndexFormatError("Index file is truncated")
+        self.corpus_hash = digest.hex()
+        self._sections: Dict[str, Tuple[int, int]] = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(self._mmap, HEADER.size + SECTION.size * i)
+            if offset + length > self.size:
+                raise IndexFormatError("Index file is truncated")
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+        self._view = memoryview(self._mmap)
+        self.meta = json.loads(bytes(self.section('meta')))
+
+    def section(self, name: str) -> memoryview:
+        try:
+            offset, length = self._sections[name]
+        except KeyError:
+            raise IndexFormatError(f"Index file has no '{name}' section") from None
+        return self._view[offset:offset + length]
+
+    def array(self, name: str, typecode: str) -> memoryview:
+        return self.section(name).cast(typecode)
+
+    def strings(self, name: str) -> StringTable:
+        return StringTable(self.array(f'{name}.off', 'Q'), self.section(name))
+
+    def postings(self, prefix: str, ids: StringTable) -> Tuple[MappedPostings, MappedLengths, int]:
+        """(postings, doc_lengths, total_length) for an ``InvertedIndex`` over this file"""
+        postings = MappedPostings(self.strings(f'{prefix}.terms'), self.array(f'{prefix}.postings', 'Q'),
+                                  self.array(f'{prefix}.docs', 'I'), self.array(f'{prefix}.pos.off', 'Q'),
+                                  self.array(f'{prefix}.pos', 'I'), ids)
+        lengths = MappedLengths(ids, self.array(f'{prefix}.lengths', 'I'))
+        return postings, lengths, self.meta[f'{prefix}_total_length']
+
+    def chunks(self, ids: StringTable) -> MappedChunks:
+        return MappedChunks(ids, self.strings('chunk.text'), self.strings('chunk.meta'))
+
+    @property
+    def has_vectors(self) -> bool:
+        return 'vectors' in self._sections
+
+    def vectors(self, ids: StringTable):
+        """(ids, matrix, idf) with the matrix a read-only view of the mapped vector block"""
+        dimensions = self.meta['dimensions']
+        offset, length = self._sections['vectors']
+        matrix = np.frombuffer(self._mmap, dtype='<f4', count=length // 4, offset=offset)
+        idf_offset, idf_length = self._sections['vectors.idf']
+        idf = np.frombuffer(self._mmap, dtype='<f4', count=idf_length // 4, offset=idf_offset)
+        return ids, matrix.reshape(len(ids), dimensions), idf
+
+    def section_sizes(self) -> Dict[str, int]:
+        return {name: length for name, (_, length) in self._sections.items()}
+
+    def close(self):
+        try:
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            pass  # Still referenced by a reader; unmapped when the last view goes away
+
+
+def build(path: str, documents_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Index the knowledge base (plus any documents directory) in memory and write it to ``path``"""
+    from knowledge_base import KnowledgeBase, corpus_hash, vector_search_available
+
+    started = time.perf_counter()
+    kb = KnowledgeBase(index_path=None, documents_dir=documents_dir)
+    kb.warm_up()
+    vectors = kb.chunk_vectors.snapshot if vector_search_available() else None
+    size = write_index(path, corpus_hash(kb.documents), kb.index, kb.chunk_index, kb.chunks, vectors)
+    return {'path': path, 'bytes': size, 'documents': len(kb.documents), 'chunks': len(kb.chunks),
+            'vectors': vectors is not None, 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def main(argv: Optional[List[str]] = None):
+    from kb_ingest import DEFAULT_DOCUMENTS_DIR
+    from knowledge_base import DEFAULT_INDEX_PATH, corpus_hash, knowledge_base
+
+    parser = argparse.ArgumentParser(description='Build or inspect the persisted knowledge base index')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Index the knowledge base and write the index file')
+    build_parser.add_argument('--output', default=DEFAULT_INDEX_PATH,
+                              help=f'Index file to write (default: {DEFAULT_INDEX_PATH}, or ECM_KB_INDEX)')
+    build_parser.add_argument('--documents-dir', default=DEFAULT_DOCUMENTS_DIR,
+                              help='Directory of markdown/text documents to include (default: ECM_KB_DOCS)')
+    info_parser = commands.add_parser('info', help='Show an index file and whether it matches the corpus')
+    info_parser.add_argument('path', nargs='?', default=DEFAULT_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        result = build(args.output, args.documents_dir)
+        print(f"✅ Wrote {result['path']} ({result['bytes'] // 1024} KB, {result['documents']} documents, "
+              f"{result['chunks']} chunks, vectors: {'yes' if result['vectors'] else 'no'}) "
+              f"in {result['seconds']}s")
+        return
+
+    try:
+        index_file = IndexFile(args.path)
+    except (OSError, IndexFormatError) as e:
+        print(f"❌ {args.path}: {e}")
+        sys.exit(1)
+    fresh = index_file.corpus_hash == corpus_hash(knowledge_base.documents)
+    print(json.dumps({
+        'path': args.path,
+        'bytes': index_file.size,
+        'corpus_hash': index_file.corpus_hash,
+        'fresh': fresh,
+        'meta': index_file.meta,
+        'sections': index_file.section_sizes(),
+    }, indent=2))
+    if not fresh:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
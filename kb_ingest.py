@@ -0,0 +1,222 @@
+"""
+Document ingestion for the knowledge base
+Loads markdown/text handouts from a directory and keeps the knowledge base in sync as files change
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pdf_ingest import iter_pdf_texts, pdf_support_available
+
+DEFAULT_DOCUMENTS_DIR = os.environ.get('ECM_KB_DOCS', '')
+DEFAULT_WATCH_INTERVAL = float(os.environ.get('ECM_KB_WATCH_INTERVAL', '2'))
+
+TEXT_EXTENSIONS = {'.md', '.markdown', '.txt'}
+# PDFs are picked up only when pypdf is installed
+DOCUMENT_EXTENSIONS = TEXT_EXTENSIONS | ({'.pdf'} if pdf_support_available() else set())
+TITLE_PATTERN = re.compile(r'^#\s+(.+?)\s*$', re.MULTILINE)
+# Optional "key: value" block between --- lines at the top of a text document
+FRONT_MATTER_PATTERN = re.compile(r'\A---[ \t]*\r?\n((?:[A-Za-z_][\w-]*:.*\r?\n)*)---[ \t]*(?:\r?\n|\Z)')
+FRONT_MATTER_FIELDS = ('title', 'type', 'version', 'last_updated')
+
+
+def make_document(doc_id: str, content: str, title: Optional[str] = None, doc_type: str = 'handout',
+                  version: Optional[str] = None, last_updated: Optional[str] = None,
+                  source: Optional[str] = None) -> Dict[str, Any]:
+    """A knowledge base document; the title defaults to the first ``# heading`` or the file name"""
+    if not title:
+        match = TITLE_PATTERN.search(content)
+        title = match.group(1) if match else os.path.splitext(os.path.basename(doc_id))[0]
+    doc = {
+        'title': title,
+        'content': content,
+        'type': doc_type,
+        # The content hash doubles as a version so edits are visible in the document list
+        'version': version or hashlib.sha256(content.encode('utf-8')).hexdigest()[:12],
+        'last_updated': last_updated or time.strftime('%Y-%m-%d'),
+    }
+    if source:
+        doc['source'] = source
+    return doc
+
+
+def split_front_matter(text: str) -> Tuple[Dict[str, str], str]:
+    """(metadata, body) of a document; only the ``FRONT_MATTER_FIELDS`` keys are kept"""
+    match = FRONT_MATTER_PATTERN.match(text)
+    if not match:
+        return {}, text
+    metadata = {}
+    for line in match.group(1).splitlines():
+        key, _, value = line.partition(':')
+        key, value = key.strip().lower(), value.strip()
+        if key in FRONT_MATTER_FIELDS and value:
+            metadata[key] = value
+    return metadata, text[match.end():]
+
+
+def join_front_matter(metadata: Dict[str, Optional[str]], body: str) -> str:
+    """``body`` with the non-empty ``metadata`` fields written as front matter"""
+    lines = [f"{key}: {' '.join(str(metadata[key]).split())}" for key in FRONT_MATTER_FIELDS
+             if metadata.get(key) and str(metadata[key]).strip()]
+    return '---\n' + ''.join(line + '\n' for line in lines) + '---\n' + body if lines else body
+
+
+def document_id(root: str, path: str) -> str:
+    """Documents are identified by their path relative to the documents directory"""
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def resolve_document_path(root: str, doc_id: str, extensions=DOCUMENT_EXTENSIONS) -> str:
+    """Path of ``doc_id`` inside ``root``; rejects ids that would escape it or have another extension"""
+    path = os.path.realpath(os.path.join(root, doc_id))
+    if not path.startswith(os.path.realpath(root) + os.sep):
+        raise ValueError(f"Document id {doc_id!r} is outside the documents directory")
+    if os.path.splitext(path)[1].lower() not in extensions:
+        raise ValueError(f"Document id {doc_id!r} must end in one of {', '.join(sorted(extensions))}")
+    return path
+
+
+def _modified_date(path: str) -> str:
+    return time.strftime('%Y-%m-%d', time.localtime(os.stat(path).st_mtime))
+
+
+def read_document(root: str, path: str) -> Dict[str, Any]:
+    with open(path, 'rb') as f:
+        metadata, content = split_front_matter(f.read().decode('utf-8', errors='replace'))
+    return make_document(document_id(root, path), content, metadata.get('title'), metadata.get('type') or 'handout',
+                         metadata.get('version'), metadata.get('last_updated') or _modified_date(path), source=path)
+
+
+def read_documents(root: str, paths: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Read document files, extracting all the PDFs together in one process pool; unreadable files are skipped"""
+    documents = {}
+    pdfs = []
+    for path in paths:
+        if path.lower().endswith('.pdf'):
+            pdfs.append(path)
+            continue
+        try:
+            documents[document_id(root, path)] = read_document(root, path)
+        except OSError as e:
+            print(f"⚠️ Skipping {path}: {e}")
+    if pdfs:
+        for path, extracted in iter_pdf_texts(pdfs):
+            try:
+                documents[document_id(root, path)] = make_document(
+                    document_id(root, path), extracted['text'], doc_type='paper',
+                    version=extracted['digest'][:12], last_updated=_modified_date(path), source=path)
+            except OSError as e:
+                print(f"⚠️ Skipping {path}: {e}")
+    return documents
+
+
+def scan_directory(root: str) -> Dict[str, Tuple[str, int, int]]:
+    """doc_id -> (path, mtime_ns, size) for every document file under ``root``"""
+    files = {}
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+        for name in names:
+            if name.startswith('.') or os.path.splitext(name)[1].lower() not in DOCUMENT_EXTENSIONS:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Deleted while we were scanning
+            files[document_id(root, path)] = (path, stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def load_directory(root: str) -> Dict[str, Dict[str, Any]]:
+    """Read every document file under ``root``"""
+    root = os.path.realpath(root)
+    return read_documents(root, [path for path, _, _ in scan_directory(root).values()])
+
+
+class DocumentWatcher:
+    """Polls a documents directory and ingests new, changed and deleted files.
+
+    Only files whose size or mtime changed are read again; the knowledge base
+    then re-indexes just those documents and publishes a new snapshot.
+    """
+
+    def __init__(self, knowledge_base, root: str, interval: float = DEFAULT_WATCH_INTERVAL):
+        self.knowledge_base = knowledge_base
+        self.root = os.path.realpath(root)
+        self.interval = interval
+        self._seen: Dict[str, Tuple[str, int, int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.scans = 0
+        self.errors = 0
+
+    def start(self):
+        """Sync once now, then keep polling from a daemon thread (call after forking workers)"""
+        os.makedirs(self.root, exist_ok=True)
+        result = self.sync()
+        print(f"👀 Watching {self.root} for knowledge base documents "
+              f"({len(self._seen)} files, generation {result['generation']})")
+        self._thread = threading.Thread(target=self._run, name='kb-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Knowledge base sync failed: {e}")
+
+    def sync(self) -> Dict[str, Any]:
+        """Ingest whatever changed since the last scan"""
+        with self._lock:
+            self.scans += 1
+            current = scan_directory(self.root)
+            changed = [doc_id for doc_id, entry in current.items() if self._seen.get(doc_id) != entry]
+            changes: Dict[str, Optional[Dict[str, Any]]] = read_documents(
+                self.root, [current[doc_id][0] for doc_id in changed])
+            for doc_id in changed:
+                if doc_id not in changes:
+                    current.pop(doc_id)  # Unreadable for now; tried again on the next scan
+            for doc_id in self._seen.keys() - current.keys():
+                changes[doc_id] = None
+            result = self.knowledge_base.ingest(changes)
+            self._seen = current
+        if result['added'] or result['updated'] or result['removed']:
+            print(f"📥 Knowledge base generation {result['generation']}: {result['added']} added, "
+                  f"{result['updated']} updated, {result['removed']} removed in {result['ms']}ms")
+        return result
+
+    def save(self, doc_id: str, content: str, metadata: Optional[Dict[str, Optional[str]]] = None) -> str:
+        """Write a document into the watched directory (so every worker process picks it up).
+
+        ``metadata`` (title, type, version) is written as front matter, which
+        ``read_document`` turns back into the document's fields.
+        """
+        path = resolve_document_path(self.root, doc_id, TEXT_EXTENSIONS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.tmp{os.getpid()}"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(join_front_matter(metadata or {}, content))
+        os.replace(temporary, path)
+        return path
+
+    def delete(self, doc_id: str) -> bool:
+        path = resolve_document_path(self.root, doc_id)
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {'root': self.root, 'files': len(self._seen), 'scans': self.scans, 'errors': self.errors,
+                'interval': self.interval}
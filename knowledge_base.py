@@ -5,15 +5,432 @@ Contains embedded documents and guidelines that are automatically loaded
 
 import os
 import json
-from typing import Dict, List, Any
+import math
+import heapq
+import hashlib
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Tuple
+
+from kb_index import IndexFile, IndexFormatError
+from kb_ingest import DEFAULT_DOCUMENTS_DIR, load_directory
+from vector_index import DEFAULT_DIMENSIONS, VectorIndex, np
+
+
+def vector_search_available() -> bool:
+    return np is not None
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+HEADER_PATTERN = re.compile(r'^(#{1,6})\s+(.+?)\s*$', re.MULTILINE)
+SENTENCE_PATTERN = re.compile(r'[^.!?\n]+(?:[.!?]+|$)', re.MULTILINE)
+
+# Chunking parameters (mirrors RAGSystem in rag_system.js)
+MAX_CHUNK_SIZE = 1000  # Characters per chunk
+OVERLAP_SIZE = 200  # Overlap between consecutive chunks of one section
+DEFAULT_CONTEXT_TOKENS = int(os.environ.get('ECM_CONTEXT_TOKENS', '1200'))
+DEFAULT_SNIPPET_CHARS = int(os.environ.get('ECM_SNIPPET_CHARS', '300'))
+MIN_SNIPPET_CHARS = 40  # Stop once the remaining budget only fits a fragment
+# Prebuilt index file (python kb_index.py build); set ECM_KB_INDEX to an empty string to always index in memory
+DEFAULT_INDEX_PATH = os.environ.get('ECM_KB_INDEX', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 'knowledge_base.idx'))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens used by the index and by queries"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for prompt budgeting"""
+    return (len(text) + 3) // 4
+
+
+def corpus_hash(documents: Dict[str, Dict[str, Any]]) -> str:
+    """SHA-256 of everything an index is derived from: the documents and the chunking/tokenizing parameters"""
+    parameters = [TOKEN_PATTERN.pattern, MAX_CHUNK_SIZE, OVERLAP_SIZE, DEFAULT_DIMENSIONS]
+    digest = hashlib.sha256(json.dumps(parameters).encode('utf-8'))
+    for doc_id in sorted(documents):
+        doc = documents[doc_id]
+        digest.update(json.dumps([doc_id, doc['title'], doc['content']]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def parse_query(query: str) -> Tuple[List[str], List[List[str]]]:
+    """Split a query into loose terms and quoted phrases"""
+    phrases = [tokenize(phrase) for phrase in PHRASE_PATTERN.findall(query)]
+    terms = tokenize(PHRASE_PATTERN.sub(' ', query))
+    return terms, [phrase for phrase in phrases if phrase]
+
+
+def split_sections(content: str) -> List[Dict[str, Any]]:
+    """Split markdown into sections at headers, tracking the header hierarchy"""
+    sections = []
+    stack: List[Tuple[int, str]] = []
+    headers = list(HEADER_PATTERN.finditer(content))
+    if not headers or content[:headers[0].start()].strip():
+        end = headers[0].start() if headers else len(content)
+        sections.append({'section_path': [], 'start': 0, 'body_start': 0, 'end': end})
+    for i, header in enumerate(headers):
+        level = len(header.group(1))
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, header.group(2)))
+        sections.append({
+            'section_path': [title for _, title in stack],
+            'start': header.start(),
+            'body_start': header.end(),
+            'end': headers[i + 1].start() if i + 1 < len(headers) else len(content),
+        })
+    return sections
+
+
+def create_chunks(doc_id: str, content: str, max_chunk_size: int = MAX_CHUNK_SIZE,
+                  overlap_size: int = OVERLAP_SIZE) -> List[Dict[str, Any]]:
+    """Chunk a document along its markdown sections.
+
+    Each section (header plus body) becomes one chunk; sections longer than
+    ``max_chunk_size`` are split on sentence boundaries with about
+    ``overlap_size`` characters of overlap. ``start``/``end`` are character
+    offsets into ``content``.
+    """
+    chunks = []
+    for section in split_sections(content):
+        if not content[section['body_start']:section['end']].strip():
+            continue  # Header with no body of its own
+        sentences = [(section['start'] + m.start(), section['start'] + m.end())
+                     for m in SENTENCE_PATTERN.finditer(content[section['start']:section['end']])
+                     if m.group().strip()]
+        i = 0
+        while i < len(sentences):
+            j = i
+            while j + 1 < len(sentences) and sentences[j + 1][1] - sentences[i][0] <= max_chunk_size:
+                j += 1
+            start, end = sentences[i][0], sentences[j][1]
+            chunks.append({
+                'id': f"{doc_id}_chunk_{len(chunks)}",
+                'doc_id': doc_id,
+                'section': section['section_path'][-1] if section['section_path'] else '',
+                'section_path': section['section_path'],
+                'start': start,
+                'end': end,
+                'text': content[start:end],
+            })
+            if j + 1 >= len(sentences):
+                break
+            # Start the next chunk a few sentences back to keep some overlap
+            k = j + 1
+            while k - 1 > i and end - sentences[k - 1][0] <= overlap_size:
+                k -= 1
+            i = k
+    return chunks
+
+
+def token_spans(text: str) -> List[Tuple[int, int]]:
+    """Character span of each token ``tokenize(text)`` returns, in the same order"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return [match.span() for match in TOKEN_PATTERN.finditer(lowered)]
+    # Some characters lower-case to several (e.g. 'İ'), so map offsets in ``lowered`` back to ``text``
+    origin = [i for i, char in enumerate(text) for _ in char.lower()]
+    return [(origin[match.start()], origin[match.end() - 1] + 1) for match in TOKEN_PATTERN.finditer(lowered)]
+
+
+def merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def best_window(text: str, highlights: List[Tuple[int, int]], limit: int) -> Tuple[int, int]:
+    """Span of at most ``limit`` characters of ``text`` holding the most highlights, cut at word boundaries"""
+    if len(text) <= limit:
+        return 0, len(text)
+    lead = limit // 4  # Some context before the first match
+    best_count, start = -1, 0
+    for candidate in [max(0, s - lead) for s, _ in highlights] or [0]:
+        candidate = min(candidate, len(text) - limit)
+        count = sum(1 for s, e in highlights if s >= candidate and e <= candidate + limit)
+        if count > best_count:
+            best_count, start = count, candidate
+    end = start + limit
+    if start > 0 and not text[start - 1].isspace():
+        space = text.find(' ', start, end)
+        start = space + 1 if space != -1 else start
+    if end < len(text) and not text[end].isspace():
+        space = text.rfind(' ', start, end)
+        end = space if space > start else end
+    return start, end
+
+
+def fit_bytes(text: str, max_bytes: int) -> str:
+    """Longest prefix of ``text`` within ``max_bytes`` of UTF-8, preferably ending at a word boundary"""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    cut = encoded[:max(0, max_bytes)].decode('utf-8', errors='ignore')
+    space = cut.rfind(' ')
+    return cut[:space] if space > 0 else cut
+
+
+class InvertedIndex:
+    """Token -> postings index with term frequencies and positions.
+
+    ``postings[token][doc_id]`` is the list of token positions of ``token`` in
+    the document, so its length is the term frequency.
+    """
 
-class KnowledgeBase:
     def __init__(self):
-        self.documents = {}
+        self.postings: Dict[str, Dict[str, List[int]]] = defaultdict(dict)
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_length = 0
+        # Tokens whose postings this copy may modify in place (None: all of them)
+        self._owned: Optional[set] = None
+
+    def copy(self) -> 'InvertedIndex':
+        """Copy-on-write clone: per-token postings stay shared until the clone changes them"""
+        index = InvertedIndex.__new__(InvertedIndex)
+        index.postings = defaultdict(dict, self.postings)
+        index.doc_lengths = dict(self.doc_lengths)
+        index.doc_terms = dict(self.doc_terms)
+        index.total_length = self.total_length
+        index._owned = set()
+        return index
+
+    def _writable(self, token: str) -> Dict[str, List[int]]:
+        if self._owned is not None and token not in self._owned:
+            self.postings[token] = dict(self.postings.get(token, ()))
+            self._owned.add(token)
+        return self.postings[token]
+
+    @classmethod
+    def from_storage(cls, postings, doc_lengths, total_length: int) -> 'InvertedIndex':
+        """Read-only index over prebuilt postings (e.g. memory-mapped from an index file)"""
+        index = cls.__new__(cls)
+        index.postings = postings
+        index.doc_lengths = doc_lengths
+        index.doc_terms = {}
+        index.total_length = total_length
+        index._owned = None
+        return index
+
+    def add_document(self, doc_id: str, text: str):
+        """Index (or re-index) a document"""
+        if doc_id in self.doc_lengths:
+            self.remove_document(doc_id)
+        tokens = tokenize(text)
+        positions: Dict[str, List[int]] = defaultdict(list)
+        for position, token in enumerate(tokens):
+            positions[token].append(position)
+        for token, token_positions in positions.items():
+            self._writable(token)[doc_id] = token_positions
+        self.doc_lengths[doc_id] = len(tokens)
+        self.doc_terms[doc_id] = list(positions)
+        self.total_length += len(tokens)
+
+    def remove_document(self, doc_id: str):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for token in self.doc_terms.pop(doc_id):
+            postings = self._writable(token)
+            del postings[doc_id]
+            if not postings:
+                del self.postings[token]
+
+    def idf(self, token: str) -> float:
+        df = len(self.postings.get(token, ()))
+        return math.log(1 + len(self.doc_lengths) / df) if df else 0.0
+
+    def phrase_positions(self, doc_id: str, phrase: List[str]) -> List[int]:
+        """Start positions of ``phrase`` in a document"""
+        first = self.postings.get(phrase[0], {}).get(doc_id)
+        if not first:
+            return []
+        following = []
+        for offset, token in enumerate(phrase[1:], start=1):
+            positions = self.postings.get(token, {}).get(doc_id)
+            if not positions:
+                return []
+            following.append((offset, set(positions)))
+        return [start for start in first
+                if all(start + offset in positions for offset, positions in following)]
+
+    def match_phrases(self, phrases: List[List[str]]):
+        """Documents containing every phrase (None when there are no phrases), with hit counts"""
+        candidates = None
+        phrase_hits: Dict[str, int] = defaultdict(int)
+        for phrase in phrases:
+            docs = set.intersection(*(set(self.postings.get(token, {})) for token in phrase))
+            matched = set()
+            for doc_id in docs:
+                starts = self.phrase_positions(doc_id, phrase)
+                if starts:
+                    matched.add(doc_id)
+                    phrase_hits[doc_id] += len(starts)
+            candidates = matched if candidates is None else candidates & matched
+        return candidates, phrase_hits
+
+    def search(self, query: str) -> List[Tuple[str, float]]:
+        """Rank documents by TF-IDF over loose terms; quoted phrases must all match"""
+        terms, phrases = parse_query(query)
+        if not terms and not phrases:
+            return []
+
+        # Documents must contain every quoted phrase
+        candidates, phrase_hits = self.match_phrases(phrases)
+
+        scores: Dict[str, float] = defaultdict(float)
+        for token in set(terms + [token for phrase in phrases for token in phrase]):
+            idf = self.idf(token)
+            for doc_id, positions in self.postings.get(token, {}).items():
+                if candidates is None or doc_id in candidates:
+                    scores[doc_id] += (1 + math.log(len(positions))) * idf
+        for doc_id, hits in phrase_hits.items():
+            if doc_id in scores:
+                scores[doc_id] += math.log(1 + hits) * len(phrases)
+
+        # Length-normalise so long documents don't win on size alone
+        ranked = [(doc_id, score / math.sqrt(max(self.doc_lengths[doc_id], 1)))
+                  for doc_id, score in scores.items()]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked
+
+    def bm25(self, query: str, top_k: int = 5, k1: float = 1.5, b: float = 0.75) -> List[Tuple[str, float]]:
+        """Top-k documents by Okapi BM25; quoted phrases must all match"""
+        terms, phrases = parse_query(query)
+        if not terms and not phrases or not self.doc_lengths:
+            return []
+        candidates, _ = self.match_phrases(phrases)
+        n = len(self.doc_lengths)
+        avg_length = self.total_length / n or 1.0
+
+        scores: Dict[str, float] = defaultdict(float)
+        for token in set(terms + [token for phrase in phrases for token in phrase]):
+            docs = self.postings.get(token)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, positions in docs.items():
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                tf = len(positions)
+                norm = k1 * (1 - b + b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+class KnowledgeSnapshot:
+    """One generation of the documents and everything indexed from them.
+
+    A published snapshot is never modified: ingestion works on a
+    copy-on-write ``copy()`` and swaps it in whole, so readers that took a
+    reference keep a consistent view without locking.
+    """
+
+    def __init__(self, generation: int = 0):
+        self.generation = generation
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.index = InvertedIndex()
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        self.doc_chunks: Dict[str, List[str]] = {}
+        self.chunk_index = InvertedIndex()
+        self.chunk_vectors = VectorIndex()
+        self.index_file: Optional[IndexFile] = None
+
+    def copy(self) -> 'KnowledgeSnapshot':
+        """The next generation, sharing all unchanged postings, chunks and vectors with this one"""
+        snapshot = KnowledgeSnapshot(self.generation + 1)
+        if self.index_file is not None:
+            # Memory-mapped indexes are read-only, so the first change indexes everything in memory
+            for doc_id, doc in self.documents.items():
+                snapshot.add_document(doc_id, doc)
+            return snapshot
+        snapshot.documents = dict(self.documents)
+        snapshot.index = self.index.copy()
+        snapshot.chunks = dict(self.chunks)
+        snapshot.doc_chunks = dict(self.doc_chunks)
+        snapshot.chunk_index = self.chunk_index.copy()
+        snapshot.chunk_vectors = self.chunk_vectors.copy()
+        return snapshot
+
+    def add_document(self, doc_id: str, doc: Dict[str, Any]) -> int:
+        """Store a document and (re-)index its title, content and section chunks; returns the chunk count"""
+        self.documents[doc_id] = doc
+        self.index.add_document(doc_id, f"{doc['title']}\n{doc['content']}")
+        self._remove_chunks(doc_id)
+        chunks = create_chunks(doc_id, doc['content'])
+        for chunk in chunks:
+            self.chunks[chunk['id']] = chunk
+            # Index the header path with the text so section titles count as matches
+            indexed_text = ' / '.join(chunk['section_path']) + '\n' + chunk['text']
+            self.chunk_index.add_document(chunk['id'], indexed_text)
+            if vector_search_available():
+                self.chunk_vectors.add(chunk['id'], tokenize(indexed_text))
+        self.doc_chunks[doc_id] = [chunk['id'] for chunk in chunks]
+        return len(chunks)
+
+    def remove_document(self, doc_id: str):
+        self.documents.pop(doc_id, None)
+        self.index.remove_document(doc_id)
+        self._remove_chunks(doc_id)
+
+    def _remove_chunks(self, doc_id: str):
+        for chunk_id in self.doc_chunks.pop(doc_id, []):
+            self.chunk_index.remove_document(chunk_id)
+            self.chunk_vectors.remove(chunk_id)
+            del self.chunks[chunk_id]
+
+
+class KnowledgeBase:
+    def __init__(self, index_path: Optional[str] = DEFAULT_INDEX_PATH,
+                 documents_dir: Optional[str] = DEFAULT_DOCUMENTS_DIR):
+        self.snapshot = KnowledgeSnapshot()
+        self._ingest_lock = threading.Lock()
+        self.ingest_stats = {'ingests': 0, 'documents_indexed': 0, 'documents_removed': 0, 'chunks_indexed': 0,
+                             'last_ms': None, 'max_ms': 0.0, 'total_ms': 0.0, 'last_at': None}
         self.initialize_documents()
+        if documents_dir and os.path.isdir(documents_dir):
+            self.documents.update(load_directory(documents_dir))
+        if not (index_path and self.open_index(index_path)):
+            for doc_id, doc in self.documents.items():
+                self.snapshot.add_document(doc_id, doc)
+    
+    # The current snapshot's parts; a reader that needs several should take ``self.snapshot`` once instead
+    @property
+    def documents(self) -> Dict[str, Dict[str, Any]]:
+        return self.snapshot.documents
+    
+    @property
+    def index(self) -> InvertedIndex:
+        return self.snapshot.index
+    
+    @property
+    def chunks(self) -> Dict[str, Dict[str, Any]]:
+        return self.snapshot.chunks
+    
+    @property
+    def chunk_index(self) -> InvertedIndex:
+        return self.snapshot.chunk_index
+    
+    @property
+    def chunk_vectors(self) -> VectorIndex:
+        return self.snapshot.chunk_vectors
+    
+    @property
+    def index_file(self) -> Optional[IndexFile]:
+        return self.snapshot.index_file
     
     def initialize_documents(self):
-        """Initialize the knowledge base with embedded documents"""
+        """Initialize the knowledge base with embedded documents (indexed afterwards by ``__init__``)"""
         
         # EOP Draft Paper Content (extracted key sections)
         eop_content = """
@@ -347,6 +764,89 @@ project/
             'last_updated': '2024-10-28'
         }
     
+    def open_index(self, path: str) -> bool:
+        """Serve from a prebuilt index file if it matches the current documents; False to index in memory"""
+        started = time.perf_counter()
+        try:
+            index_file = IndexFile(path)
+        except FileNotFoundError:
+            return False
+        except (OSError, IndexFormatError) as e:
+            print(f"⚠️ Ignoring knowledge base index {path}: {e}")
+            return False
+        if index_file.corpus_hash != corpus_hash(self.documents):
+            print(f"⚠️ Knowledge base index {path} is stale (documents changed); "
+                  f"rebuild it with: python kb_index.py build")
+            index_file.close()
+            return False
+        if vector_search_available() and not index_file.has_vectors:
+            print(f"⚠️ Knowledge base index {path} was built without NumPy; rebuild it for vector search")
+            index_file.close()
+            return False
+        doc_ids = index_file.strings('doc.ids')
+        chunk_ids = index_file.strings('chunk.ids')
+        snapshot = self.snapshot
+        snapshot.index = InvertedIndex.from_storage(*index_file.postings('doc', doc_ids))
+        snapshot.chunk_index = InvertedIndex.from_storage(*index_file.postings('chunk', chunk_ids))
+        snapshot.chunks = index_file.chunks(chunk_ids)
+        if vector_search_available():
+            snapshot.chunk_vectors.load(*index_file.vectors(chunk_ids))
+        snapshot.index_file = index_file
+        print(f"📚 Opened knowledge base index {path} ({len(chunk_ids)} chunks, {index_file.size // 1024} KB) "
+              f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+        return True
+    
+    def ingest(self, changes: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Add, replace or (with ``None``) remove documents and publish the result as a new snapshot.
+
+        Only the documents that actually changed are re-chunked and re-indexed.
+        Searches running meanwhile keep using the previous snapshot.
+        """
+        started = time.perf_counter()
+        with self._ingest_lock:
+            current = self.snapshot
+            changes = {doc_id: doc for doc_id, doc in changes.items()
+                       if (doc_id in current.documents if doc is None else current.documents.get(doc_id) != doc)}
+            result = {'generation': current.generation, 'added': 0, 'updated': 0, 'removed': 0, 'chunks': 0}
+            if changes:
+                snapshot = current.copy()
+                for doc_id, doc in changes.items():
+                    if doc is None:
+                        snapshot.remove_document(doc_id)
+                        result['removed'] += 1
+                    else:
+                        result['updated' if doc_id in current.documents else 'added'] += 1
+                        result['chunks'] += snapshot.add_document(doc_id, doc)
+                if vector_search_available():
+                    snapshot.chunk_vectors.build()
+                self.snapshot = snapshot  # One reference assignment publishes the whole generation
+                result['generation'] = snapshot.generation
+            elapsed = (time.perf_counter() - started) * 1000
+            result['ms'] = round(elapsed, 2)
+            if changes:
+                stats = self.ingest_stats
+                stats['ingests'] += 1
+                stats['documents_indexed'] += result['added'] + result['updated']
+                stats['documents_removed'] += result['removed']
+                stats['chunks_indexed'] += result['chunks']
+                stats['last_ms'] = result['ms']
+                stats['max_ms'] = max(stats['max_ms'], result['ms'])
+                stats['total_ms'] = round(stats['total_ms'] + elapsed, 2)
+                stats['last_at'] = time.time()
+        return result
+    
+    def add_document(self, doc_id: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a document and index its title, content and section chunks"""
+        return self.ingest({doc_id: doc})
+    
+    def remove_document(self, doc_id: str) -> Dict[str, Any]:
+        return self.ingest({doc_id: None})
+    
+    def warm_up(self):
+        """Build lazily-built structures now (e.g. before forking workers that share them)"""
+        if vector_search_available() and self.index_file is None:
+            self.chunk_vectors.build()
+    
     def get_document(self, doc_id: str) -> Dict[str, Any]:
         """Get a specific document by ID"""
         return self.documents.get(doc_id, {})
@@ -356,24 +856,156 @@ project/
         return self.documents
     
     def search_documents(self, query: str) -> List[Dict[str, Any]]:
-        """Search for documents containing the query"""
+        """Search documents by terms and "quoted phrases", best matches first"""
+        snapshot = self.snapshot
         results = []
-        query_lower = query.lower()
-        
-        for doc_id, doc in self.documents.items():
-            if (query_lower in doc['title'].lower() or 
-                query_lower in doc['content'].lower()):
-                results.append({
-                    'id': doc_id,
-                    'title': doc['title'],
-                    'type': doc['type'],
-                    'relevance': doc['content'].lower().count(query_lower)
-                })
-        
-        # Sort by relevance
-        results.sort(key=lambda x: x['relevance'], reverse=True)
+        for doc_id, score in snapshot.index.search(query):
+            doc = snapshot.documents[doc_id]
+            results.append({
+                'id': doc_id,
+                'title': doc['title'],
+                'type': doc['type'],
+                'relevance': round(score, 4)
+            })
         return results
     
+    def search_chunks(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k document chunks by BM25, with section titles and character offsets"""
+        snapshot = self.snapshot
+        return [self._chunk_result(snapshot, chunk_id, score)
+                for chunk_id, score in snapshot.chunk_index.bm25(query, top_k)]
+    
+    def search_snippets(self, query: str, top_k: int = 5, max_bytes: Optional[int] = None,
+                        max_tokens: Optional[int] = None,
+                        snippet_chars: int = DEFAULT_SNIPPET_CHARS) -> List[Dict[str, Any]]:
+        """Ranked snippets with offsets, section path and highlighted matches, rather than whole documents.
+
+        Match positions come from the positional postings, so only the tokens
+        of each matched chunk are scanned to turn them into character offsets.
+        ``start``/``end`` and ``highlights`` are character offsets into the
+        document's content. Each snippet is at most ``snippet_chars`` long, and
+        all snippets together stay within ``max_bytes`` (UTF-8) and
+        ``max_tokens`` (as counted by ``estimate_tokens``).
+        """
+        snapshot = self.snapshot
+        terms, phrases = parse_query(query)
+        tokens = set(terms + [token for phrase in phrases for token in phrase])
+        results = []
+        used_bytes = used_tokens = 0
+        for chunk_id, score in snapshot.chunk_index.bm25(query, top_k):
+            limit = snippet_chars
+            if max_bytes is not None:
+                limit = min(limit, max_bytes - used_bytes)
+            if max_tokens is not None:
+                limit = min(limit, 4 * (max_tokens - used_tokens))
+            if limit < min(MIN_SNIPPET_CHARS, snippet_chars):
+                break
+            chunk = snapshot.chunks[chunk_id]
+            highlights = self._match_spans(snapshot, chunk_id, chunk, tokens, phrases)
+            start, end = best_window(chunk['text'], highlights, limit)
+            text = chunk['text'][start:end]
+            if max_bytes is not None:
+                text = fit_bytes(text, max_bytes - used_bytes)
+            # Drop leading whitespace (a chunk may start at a line break) without moving the offsets off the text
+            stripped = text.lstrip()
+            start += len(text) - len(stripped)
+            text = stripped.rstrip()
+            end = start + len(text)
+            if not text:
+                continue
+            doc_start, doc_end = chunk['start'] + start, chunk['start'] + end
+            # Neighbouring chunks overlap; don't return the same passage twice
+            if any(r['doc_id'] == chunk['doc_id'] and r['start'] < doc_end and doc_start < r['end'] for r in results):
+                continue
+            size = len(text.encode('utf-8'))
+            results.append({
+                'id': chunk_id,
+                'doc_id': chunk['doc_id'],
+                'title': snapshot.documents[chunk['doc_id']]['title'],
+                'section_path': chunk['section_path'],
+                'start': doc_start,
+                'end': doc_end,
+                'text': text,
+                'highlights': [[chunk['start'] + s, chunk['start'] + e] for s, e in highlights
+                               if s >= start and e <= end],
+                'bytes': size,
+                'tokens': estimate_tokens(text),
+                'score': round(score, 4)
+            })
+            used_bytes += size
+            used_tokens += estimate_tokens(text)
+        return results
+    
+    def _match_spans(self, snapshot: KnowledgeSnapshot, chunk_id: str, chunk: Dict[str, Any], tokens,
+                     phrases: List[List[str]]) -> List[Tuple[int, int]]:
+        """Character spans (within the chunk text) of the query's terms and phrases, from the chunk postings"""
+        index = snapshot.chunk_index
+        # The chunk was indexed with its header path in front of the text
+        header_tokens = len(tokenize(' / '.join(chunk['section_path'])))
+        token_ranges = []
+        for token in tokens:
+            token_ranges.extend((position, position) for position in index.postings.get(token, {}).get(chunk_id, ()))
+        for phrase in phrases:
+            token_ranges.extend((position, position + len(phrase) - 1)
+                                for position in index.phrase_positions(chunk_id, phrase))
+        spans = token_spans(chunk['text'])
+        return merge_spans([(spans[first - header_tokens][0], spans[last - header_tokens][1])
+                            for first, last in token_ranges
+                            if first >= header_tokens and last - header_tokens < len(spans)])
+    
+    def search_similar(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k chunks by vector (cosine) similarity; needs NumPy"""
+        return self.search_similar_batch([query], top_k)[0]
+    
+    def search_similar_batch(self, queries: List[str], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Vector search for many queries at once (one matrix-matrix product)"""
+        snapshot = self.snapshot
+        ranked = snapshot.chunk_vectors.query_batch([tokenize(query) for query in queries], top_k)
+        return [[self._chunk_result(snapshot, chunk_id, score) for chunk_id, score in hits] for hits in ranked]
+    
+    def _chunk_result(self, snapshot: KnowledgeSnapshot, chunk_id: str, score: float) -> Dict[str, Any]:
+        chunk = snapshot.chunks[chunk_id]
+        return {
+            'id': chunk_id,
+            'doc_id': chunk['doc_id'],
+            'title': snapshot.documents[chunk['doc_id']]['title'],
+            'section': chunk['section'],
+            'section_path': chunk['section_path'],
+            'start': chunk['start'],
+            'end': chunk['end'],
+            'text': chunk['text'],
+            'score': round(score, 4)
+        }
+    
+    def retrieve_context(self, query: str, token_budget: int = DEFAULT_CONTEXT_TOKENS,
+                         top_k: int = 20) -> List[Dict[str, Any]]:
+        """Best-ranked chunks that fit in ``token_budget``, skipping overlapping neighbours"""
+        passages = self.search_chunks(query, top_k)
+        if not passages and vector_search_available():
+            passages = self.search_similar(query, top_k)
+        selected = []
+        used = 0
+        for passage in passages:
+            cost = estimate_tokens(passage['text'])
+            if used + cost > token_budget:
+                continue
+            if any(p['doc_id'] == passage['doc_id'] and p['start'] < passage['end'] and passage['start'] < p['end']
+                   for p in selected):
+                continue
+            selected.append(passage)
+            used += cost
+        return selected
+    
+    def format_context(self, passages: List[Dict[str, Any]]) -> str:
+        """Render retrieved passages as a prompt section (same layout as rag_system.js)"""
+        if not passages:
+            return ''
+        context = "## Relevant Information from the Knowledge Base:\n\n"
+        for i, passage in enumerate(passages, start=1):
+            source = ' › '.join([passage['title']] + passage['section_path'][-1:])
+            context += f"### Reference {i} (from {source}):\n{passage['text'].strip()}\n\n"
+        return context
+    
     def get_document_content(self, doc_id: str) -> str:
         """Get the content of a specific document"""
         doc = self.documents.get(doc_id, {})
@@ -381,9 +1013,14 @@ project/
     
     def get_knowledge_base_info(self) -> Dict[str, Any]:
         """Get information about the knowledge base"""
+        snapshot = self.snapshot
         return {
-            'total_documents': len(self.documents),
-            'document_types': list(set(doc['type'] for doc in self.documents.values())),
+            'total_documents': len(snapshot.documents),
+            'total_chunks': len(snapshot.chunks),
+            'generation': snapshot.generation,
+            'index_file': snapshot.index_file.path if snapshot.index_file is not None else None,
+            'ingest': dict(self.ingest_stats),
+            'document_types': list(set(doc['type'] for doc in snapshot.documents.values())),
             'documents': [
                 {
                     'id': doc_id,
@@ -391,7 +1028,7 @@ project/
                     'type': doc['type'],
                     'version': doc['version']
                 }
-                for doc_id, doc in self.documents.items()
+                for doc_id, doc in snapshot.documents.items()
             ]
         }
 
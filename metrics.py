@@ -0,0 +1,214 @@
+"""
+Prometheus-style metrics for the proxy server
+Counters, gauges and fixed-bucket histograms rendered in the text exposition format
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) for latency histograms: 1 ms .. 2 min
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Upper bounds (bytes) for payload size histograms: 256 B .. 4 MiB
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Label sets per metric before new ones are folded into "other" (model names come from clients)
+MAX_SERIES = 500
+OVERFLOW_LABEL = 'other'
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A metric family: one value (or bucket array) per label combination, behind one lock"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence) -> Tuple[str, ...]:
+        key = tuple('' if value is None else str(value) for value in labels)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            return (OVERFLOW_LABEL,) * len(self.label_names)
+        return key
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = [(key, self._snapshot(value)) for key, value in self._series.items()]
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _snapshot(self, value):
+        return value
+
+    def _render_series(self, key, value) -> List[str]:
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram; each series is one preallocated list ``[bucket counts..., sum]``"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _snapshot(self, value):
+        return list(value)
+
+    def _render_series(self, key, value) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+            cumulative += count
+            le = f'le="{format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, le)} {cumulative}")
+        labels = format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {format_value(value[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds metrics plus collectors that turn other components' stats into gauges at scrape time"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]):
+        """``collector()`` yields ``(name, documentation, labels, value)`` gauge samples"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        seen = set()
+        for collector in self.collectors:
+            for name, documentation, labels, value in collector():
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{format_labels(list(labels), list(labels.values()))} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def error_type(error: Optional[BaseException]) -> str:
+    """Short, low-cardinality label for an exception"""
+    if error is None:
+        return ''
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return f"http_{status}"
+    if isinstance(error, TimeoutError):
+        return 'timeout'
+    return type(error).__name__
+
+
+# Global registry and the proxy's metrics
+registry = Registry()
+
+CHAT_REQUESTS = registry.counter(
+    'ecm_chat_requests_total', 'Chat requests handled', ('provider', 'model', 'stream'))
+CHAT_ERRORS = registry.counter(
+    'ecm_chat_errors_total', 'Chat requests that failed, by error type', ('provider', 'model', 'type'))
+CHAT_OUTCOMES = registry.counter(
+    'ecm_chat_outcomes_total', 'How chat requests were answered (upstream, cache, semantic, coalesced)',
+    ('provider', 'model', 'source'))
+HANDLER_LATENCY = registry.histogram(
+    'ecm_handler_latency_seconds', 'Total /api/chat handler time', ('provider', 'model'))
+UPSTREAM_LATENCY = registry.histogram(
+    'ecm_upstream_latency_seconds', 'Provider call time (full response)', ('provider', 'model'))
+UPSTREAM_TTFT = registry.histogram(
+    'ecm_upstream_first_token_seconds', 'Provider time to first streamed token', ('provider', 'model'))
+REQUEST_BYTES = registry.histogram(
+    'ecm_request_bytes', 'Chat request body size', ('provider', 'model'), SIZE_BUCKETS)
+RESPONSE_BYTES = registry.histogram(
+    'ecm_response_bytes', 'Chat response body size', ('provider', 'model'), SIZE_BUCKETS)
+IN_FLIGHT = registry.gauge(
+    'ecm_chat_in_flight', 'Chat requests currently being handled')
+CACHE_LOOKUP = registry.histogram(
+    'ecm_cache_lookup_seconds', 'Response cache lookup time', (), (0.00001, 0.00005, 0.0001, 0.0005, 0.001,
+                                                                    0.005, 0.01, 0.05))
+KB_SEARCH = registry.histogram(
+    'ecm_kb_search_seconds', 'Knowledge base search time', ('kind',), (0.0001, 0.0005, 0.001, 0.0025, 0.005,
+                                                                      0.01, 0.025, 0.05, 0.1, 0.5))
+UPSTREAM_ROUTING = registry.counter(
+    'ecm_upstream_routing_total', 'Hedged and fallback upstream attempts, and the ones that won',
+    ('provider', 'event'))
@@ -0,0 +1,297 @@
+"""
+PDF text extraction for the knowledge base
+Extracts page ranges in a process pool, normalizes them into markdown paragraphs and headings, and caches the
+result by file content hash so unchanged PDFs are never extracted twice
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import unicodedata
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF ingestion is optional (pip install pypdf)
+    PdfReader = None
+
+DEFAULT_PDF_WORKERS = int(os.environ.get('ECM_PDF_WORKERS', '0'))  # 0: one per core
+DEFAULT_PAGES_PER_TASK = int(os.environ.get('ECM_PDF_PAGES_PER_TASK', '4'))
+DEFAULT_CACHE_DIR = os.environ.get('ECM_PDF_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 '.pdf_cache'))
+# Part of the cache key: bump it when extraction or normalization changes
+EXTRACTOR_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+BULLETS = '●•◦▪‣∙-–*'
+PAGE_NUMBER = re.compile(r'(?:page\s+)?\d+(?:\s*(?:/|of)\s*\d+)?', re.IGNORECASE)
+NUMBERED_HEADING = re.compile(r'(\d+(?:\.\d+)+)\.?\s')
+SENTENCE_END = ('.', '?', '!', ':', ';', '"', '”', ')')
+# A line this much shorter than the page's longest line ends its paragraph
+SHORT_LINE_RATIO = 0.8
+
+
+def pdf_support_available() -> bool:
+    return PdfReader is not None
+
+
+def require_pypdf():
+    if PdfReader is None:
+        raise RuntimeError("pypdf is required for PDF ingestion (pip install pypdf)")
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file, read in blocks so large PDFs never sit in memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_heading(line: str) -> bool:
+    return (len(line) <= 80 and len(line.split()) <= 12 and not line.endswith(SENTENCE_END + (',',))
+            and (line[0].isupper() or line[0].isdigit()) and any(ch.isalpha() for ch in line))
+
+
+def _join_lines(lines: List[str]) -> str:
+    text = lines[0]
+    for line in lines[1:]:
+        # Re-join words hyphenated across a line break
+        if text.endswith('-') and len(text) > 1 and text[-2].isalpha() and line[:1].islower():
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}"
+    return text
+
+
+def normalize_page(text: str, first_page: bool = False) -> str:
+    """Turn one page of layout-mode text into markdown: joined paragraphs, ``#`` headings and ``-`` bullets"""
+    text = unicodedata.normalize('NFKC', text)  # Ligatures (ﬁ -> fi) and full-width forms
+    raw_lines = [line.rstrip() for line in text.splitlines()]
+    width = max((len(line) for line in raw_lines), default=0)
+    blocks: List[str] = []
+    paragraph: List[str] = []
+    seen_heading = not first_page
+
+    def flush():
+        if paragraph:
+            blocks.append(_join_lines(paragraph))
+            paragraph.clear()
+
+    for raw in raw_lines:
+        # Layout mode pads justified lines with runs of spaces
+        line = ''.join(ch for ch in ' '.join(raw.split()) if unicodedata.category(ch)[0] != 'C')
+        if not line or PAGE_NUMBER.fullmatch(line):
+            flush()
+            continue
+        if line[0] in BULLETS and (len(line) == 1 or line[1] == ' '):
+            flush()
+            paragraph.append('- ' + line[1:].strip())
+            continue
+        if not paragraph and _is_heading(line):
+            numbered = NUMBERED_HEADING.match(line + ' ')
+            level = min(6, numbered.group(1).count('.') + 2) if numbered else 2
+            blocks.append('#' * (level if seen_heading else 1) + ' ' + line)
+            seen_heading = True
+            continue
+        paragraph.append(line)
+        if line.endswith(SENTENCE_END) and len(raw) < SHORT_LINE_RATIO * width:
+            flush()
+    flush()
+    return '\n\n'.join(blocks)
+
+
+def join_pages(pages: List[str]) -> str:
+    """Concatenate normalized pages, continuing a paragraph that runs over a page break"""
+    text = ''
+    for page in pages:
+        if not page:
+            continue
+        if text and not text.endswith(SENTENCE_END) and page[:1].islower():
+            text += ' ' + page
+        elif text:
+            text += '\n\n' + page
+        else:
+            text = page
+    return text
+
+
+def extract_page_range(path: str, start: int, stop: int) -> Tuple[str, int, List[str]]:
+    """Worker task: normalized text of pages ``start``..``stop - 1`` (each task opens the file itself)"""
+    reader = PdfReader(path)
+    pages = []
+    for number in range(start, stop):
+        try:
+            text = reader.pages[number].extract_text(extraction_mode='layout')
+        except Exception:
+            text = reader.pages[number].extract_text() or ''
+        pages.append(normalize_page(text, first_page=number == 0))
+    return path, start, pages
+
+
+def _cache_path(cache_dir: str, digest: str) -> str:
+    return os.path.join(cache_dir, f"{digest}-v{EXTRACTOR_VERSION}.json")
+
+
+def _read_cache(cache_dir: Optional[str], digest: str) -> Optional[Dict[str, Any]]:
+    if not cache_dir:
+        return None
+    try:
+        with open(_cache_path(cache_dir, digest), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(cache_dir: Optional[str], digest: str, result: Dict[str, Any]):
+    if not cache_dir:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _cache_path(cache_dir, digest)
+        temporary = f"{path}.tmp{os.getpid()}"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(temporary, path)
+    except OSError as e:
+        print(f"⚠️ Could not cache PDF text: {e}")
+
+
+def iter_pdf_texts(paths: List[str], workers: int = DEFAULT_PDF_WORKERS,
+                   pages_per_task: int = DEFAULT_PAGES_PER_TASK,
+                   cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ``(path, {'text', 'pages', 'digest', 'cached'})`` for each PDF as soon as it is complete.
+
+    PDFs whose content hash is in the cache are not opened at all. The rest
+    are split into ranges of ``pages_per_task`` pages, extracted across a
+    process pool (one worker per core by default) with at most two tasks per
+    worker queued, so memory stays bounded however many files there are.
+    Files that cannot be read are reported and skipped.
+    """
+    require_pypdf()
+    pending: Dict[str, Dict[str, Any]] = {}
+    tasks = []
+    for path in paths:
+        try:
+            digest = file_hash(path)
+            cached = _read_cache(cache_dir, digest)
+            page_count = None if cached is not None else len(PdfReader(path).pages)
+        except Exception as e:
+            print(f"⚠️ Skipping PDF {path}: {e}")
+            continue
+        if cached is not None:
+            yield path, dict(cached, cached=True)
+            continue
+        pending[path] = {'digest': digest, 'pages': [None] * page_count, 'remaining': page_count}
+        tasks.extend((path, start, min(start + pages_per_task, page_count))
+                     for start in range(0, page_count, pages_per_task))
+        if not page_count:
+            yield path, _finish(cache_dir, pending.pop(path))
+
+    if not tasks:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers == 1:
+        yield from _collect(_serial_map(tasks), pending, cache_dir)
+        return
+    # Never fork: extraction runs from the server's watcher thread, and a forked child would inherit the other
+    # threads' locks (request log, sqlite, connection pool) in whatever state they were in
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(start_method)) as pool:
+        yield from _collect(_bounded_map(pool, tasks, 2 * workers), pending, cache_dir)
+
+
+def _serial_map(tasks):
+    for task in tasks:
+        try:
+            yield task, extract_page_range(*task), None
+        except Exception as e:
+            yield task, None, e
+
+
+def _bounded_map(pool, tasks, window):
+    """Results of ``tasks`` in completion order, with at most ``window`` submitted at a time"""
+    remaining = iter(tasks)
+    running = {}
+    for task in remaining:
+        running[pool.submit(extract_page_range, *task)] = task
+        if len(running) >= window:
+            break
+    while running:
+        done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            task = running.pop(future)
+            error = future.exception()
+            yield task, None if error else future.result(), error
+            for task in remaining:
+                running[pool.submit(extract_page_range, *task)] = task
+                break
+
+
+def _collect(results, pending, cache_dir):
+    for (path, start, stop), result, error in results:
+        entry = pending.get(path)
+        if entry is None:
+            continue  # An earlier range of this file already failed
+        if error is not None:
+            print(f"⚠️ Skipping PDF {path}: pages {start + 1}-{stop} failed: {error}")
+            del pending[path]
+            continue
+        _, start, pages = result
+        entry['pages'][start:start + len(pages)] = pages
+        entry['remaining'] -= len(pages)
+        if not entry['remaining']:
+            yield path, _finish(cache_dir, pending.pop(path))
+
+
+def _finish(cache_dir, entry) -> Dict[str, Any]:
+    result = {'text': join_pages(entry['pages']), 'pages': len(entry['pages']), 'digest': entry['digest']}
+    _write_cache(cache_dir, entry['digest'], result)
+    return dict(result, cached=False)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Extract PDFs to markdown for the knowledge base')
+    parser.add_argument('paths', nargs='+', help='PDF files or directories containing PDFs')
+    parser.add_argument('--output', help='Directory to write one .md file per PDF (e.g. the --kb-docs directory)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_PDF_WORKERS, help='Processes (default: one per core)')
+    parser.add_argument('--pages-per-task', type=int, default=DEFAULT_PAGES_PER_TASK)
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not update the text cache')
+    args = parser.parse_args(argv)
+    require_pypdf()
+
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths.extend(os.path.join(directory, name) for directory, _, names in os.walk(path)
+                         for name in sorted(names) if name.lower().endswith('.pdf'))
+        else:
+            paths.append(path)
+    started = time.perf_counter()
+    cache_dir = None if args.no_cache else DEFAULT_CACHE_DIR
+    for path, result in iter_pdf_texts(paths, args.workers, args.pages_per_task, cache_dir):
+        line = (f"📄 {path}: {result['pages']} pages, {len(result['text'])} characters"
+                f"{' (cached)' if result['cached'] else ''}")
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            target = os.path.join(args.output, os.path.splitext(os.path.basename(path))[0] + '.md')
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(result['text'])
+            line += f" -> {target}"
+        print(line)
+    print(f"✅ {len(paths)} PDFs in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -0,0 +1,191 @@
+"""
+Pre-fork multi-process serving for the proxy server
+A master process binds the port, preloads shared state, forks N workers and keeps them alive
+"""
+
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+LISTEN_BACKLOG = 128
+# Workers that die this soon after starting count as crashing (and are respawned more slowly)
+QUICK_EXIT_SECONDS = 1.0
+GRACEFUL_TIMEOUT = float(os.environ.get('ECM_GRACEFUL_TIMEOUT', '30'))
+
+
+def prefork_supported() -> bool:
+    return hasattr(os, 'fork')
+
+
+def reuse_port_supported() -> bool:
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+def create_listening_socket(port: int, reuse_port: bool = False) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('', port))
+    sock.listen(LISTEN_BACKLOG)
+    return sock
+
+
+class PreforkMaster:
+    """Forks and supervises worker processes that share one listening port.
+
+    ``make_server(sock)`` is called in each worker with the listening socket and
+    must return a ``socketserver`` server using it. ``preload()`` runs in the
+    master before every round of forks, so whatever it loads is shared with the
+    workers copy-on-write.
+
+    Signals: SIGHUP reloads (preload again, start fresh workers, then retire the
+    old ones once their in-flight requests finish); SIGTERM/SIGINT stop everything.
+    """
+
+    def __init__(self, port: int, workers: int, make_server: Callable[[socket.socket], object],
+                 preload: Optional[Callable[[], None]] = None, reuse_port: bool = False,
+                 graceful_timeout: float = GRACEFUL_TIMEOUT):
+        self.port = port
+        self.num_workers = workers
+        self.make_server = make_server
+        self.preload = preload
+        self.reuse_port = reuse_port and reuse_port_supported()
+        self.graceful_timeout = graceful_timeout
+        self.socket: Optional[socket.socket] = None
+        self.workers: Dict[int, float] = {}  # pid -> start time
+        self.retiring: Dict[int, float] = {}  # pid -> time SIGTERM was sent
+        self.crashes = 0
+        self.stopping = False
+        self.reload_requested = False
+
+    def run(self):
+        if not self.reuse_port:
+            self.socket = create_listening_socket(self.port)
+        self.load_shared_state()
+        for _ in range(self.num_workers):
+            self.spawn()
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        mode = 'SO_REUSEPORT' if self.reuse_port else 'shared socket'
+        print(f"👷 Master {os.getpid()} running {self.num_workers} workers ({mode})")
+
+        while not self.stopping:
+            self.reap()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.kill_stragglers()
+            time.sleep(0.2)
+        self.stop()
+
+    def load_shared_state(self):
+        if self.preload is not None:
+            self.preload()
+        # Move everything loaded so far out of the collector's reach so that GC passes
+        # in the workers don't touch (and copy) the shared pages
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+        # Child process
+        code = 0
+        try:
+            self._run_worker()
+        except BaseException as e:
+            print(f"❌ Worker {os.getpid()} crashed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _run_worker(self):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the master
+        sock = create_listening_socket(self.port, True) if self.reuse_port else self.socket
+        server = self.make_server(sock)
+
+        def stop(signum, frame):
+            # shutdown() blocks until serve_forever returns, so call it off the main thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        server.serve_forever()
+        if hasattr(server, 'drain'):
+            server.drain(self.graceful_timeout)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.retiring:
+                del self.retiring[pid]
+                continue
+            started = self.workers.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+            print(f"⚠️ Worker {pid} exited ({code}), restarting")
+            if time.monotonic() - started < QUICK_EXIT_SECONDS:
+                self.crashes += 1
+                time.sleep(min(0.1 * 2 ** self.crashes, 10))
+            else:
+                self.crashes = 0
+            self.spawn()
+
+    def reload(self):
+        print("🔄 Reloading workers")
+        old = list(self.workers)
+        self.load_shared_state()
+        for _ in range(self.num_workers):
+            self.spawn()
+        for pid in old:
+            self.workers.pop(pid, None)
+            self.retiring[pid] = time.monotonic()
+            self._signal(pid, signal.SIGTERM)
+
+    def kill_stragglers(self):
+        now = time.monotonic()
+        for pid, since in list(self.retiring.items()):
+            if now - since > self.graceful_timeout:
+                self._signal(pid, signal.SIGKILL)
+
+    def stop(self):
+        print("\n🛑 Stopping workers")
+        for pid in list(self.workers):
+            self.retiring[pid] = time.monotonic()
+            self._signal(pid, signal.SIGTERM)
+        self.workers.clear()
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.retiring and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.retiring):
+            self._signal(pid, signal.SIGKILL)
+        if self.socket is not None:
+            self.socket.close()
+
+    def _signal(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,356 @@
+"""
+Per-provider client limits for upstream LLM calls
+Token-bucket rate limits, jittered retries honoring Retry-After, AIMD concurrency and a circuit breaker
+per (provider, endpoint)
+"""
+
+import email.utils
+import http.client
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from tracing import span
+
+DEFAULT_RATE = float(os.environ.get('ECM_PROVIDER_RPS', '0'))  # 0 = no rate limit
+DEFAULT_BURST = int(os.environ.get('ECM_PROVIDER_BURST', '0'))  # 0 = one second's worth of requests
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('ECM_PROVIDER_MAX_CONCURRENCY', '16'))
+DEFAULT_MAX_WAIT = float(os.environ.get('ECM_PROVIDER_WAIT', '5'))
+DEFAULT_RETRIES = int(os.environ.get('ECM_UPSTREAM_RETRIES', '2'))
+DEFAULT_BREAKER_THRESHOLD = int(os.environ.get('ECM_BREAKER_THRESHOLD', '5'))
+DEFAULT_BREAKER_COOLDOWN = float(os.environ.get('ECM_BREAKER_COOLDOWN', '30'))
+
+RETRY_BASE_DELAY = 0.25
+RETRY_MAX_DELAY = 8.0
+# Statuses that mean "try again later" rather than "this request is wrong"
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+# Latency above this multiple of the running average counts as congestion
+LATENCY_TOLERANCE = 2.0
+DECREASE_FACTOR = 0.7
+
+# Shared by every endpoint a client supplies itself (e.g. a self-hosted NIM), per provider
+CUSTOM_ENDPOINT = 'custom'
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+CIRCUIT_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling the provider because its limits say it cannot take the request now"""
+
+    http_status = 503
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(UpstreamUnavailable):
+    """The provider's rate or concurrency limit is exhausted"""
+
+    http_status = 429
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """The provider has been failing and its circuit breaker is open"""
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)"""
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def endpoint_of(url: str) -> str:
+    """scheme://host:port of a URL (never the path or query, which may carry an API key)"""
+    parts = urlsplit(url)
+    scheme = parts.scheme or 'http'
+    return f"{scheme}://{parts.hostname}:{parts.port or (443 if scheme == 'https' else 80)}"
+
+
+class TokenBucket:
+    """Classic token bucket; ``rate`` tokens per second up to ``burst``"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst or int(rate) or 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Take a token and return 0, or return the seconds until one is available"""
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ProviderLimiter:
+    """Limits, retries and circuit state for one (provider, endpoint)"""
+
+    def __init__(self, provider: str, endpoint: str, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_wait: float = DEFAULT_MAX_WAIT,
+                 retries: int = DEFAULT_RETRIES, breaker_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        self.provider = provider
+        self.endpoint = endpoint
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.retries = retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._cond = threading.Condition()
+        # Adaptive concurrency (AIMD): the limit grows by ~1 per limit's worth of good calls
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.latency_avg = None
+        self.last_decrease = 0.0
+        # Retry-After from the provider pauses every caller, not just the one that saw it
+        self.paused_until = 0.0
+        # Circuit breaker
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.probing = False
+        # Counters
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.retried = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def call(self, send: Callable[[], Any], deadline: Optional[float] = None, cancel_token=None,
+             keep_slot: bool = False):
+        """Run ``send()`` under the limits, retrying transient failures.
+
+        With ``keep_slot`` the concurrency slot stays held after a success and
+        ``(result, release)`` is returned; call ``release()`` once the
+        response (e.g. a stream) has been consumed.
+        """
+        attempt = 0
+        while True:
+            with span('admit', provider=self.provider):
+                self._admit(deadline)
+            started = time.monotonic()
+            try:
+                result = send()
+            except Exception as e:
+                self._release()
+                if cancel_token is not None and cancel_token.cancelled:
+                    self._end_probe()
+                    raise
+                self._record_failure(e, time.monotonic() - started)
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None and getattr(e, 'status', None) == 429:
+                    # Still throttled after the retries: tell the client when to come back, as for our own limits
+                    retry_after = parse_retry_after(getattr(e, 'headers', None))
+                    raise RateLimitedError(f"{self.provider} rate limit reached, please retry shortly",
+                                           retry_after or 1.0) from e
+                if delay is None:
+                    raise
+                attempt += 1
+                with self._cond:
+                    self.retried += 1
+                print(f"🔁 Retrying {self.provider} in {delay:.2f}s after: {e}")
+                with span('retry_backoff', attempt=attempt):
+                    time.sleep(delay)
+                continue
+            self._record_success(time.monotonic() - started)
+            if keep_slot:
+                return result, self._release
+            self._release()
+            return result
+
+    def _admit(self, deadline: Optional[float]):
+        """Wait for the circuit, rate limit and concurrency limit to allow one more call"""
+        give_up = time.monotonic() + self.max_wait
+        if deadline is not None:
+            give_up = min(give_up, deadline)
+        with self._cond:
+            self.requests += 1
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self.opened_until:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.provider} is unavailable (circuit open)",
+                                           self.opened_until - now)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.provider} is recovering, please retry shortly",
+                                           self.breaker_cooldown)
+                self.probing = True
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = max(self.paused_until - now, 0.0)
+                    if not wait and self.in_flight >= max(1, int(self.limit)):
+                        wait = None  # Until a slot is released
+                    if not wait and wait is not None:
+                        wait = self.bucket.take(now)
+                        if not wait:
+                            self.in_flight += 1
+                            return
+                    if (give_up - now) <= 0 or (wait is not None and now + wait > give_up):
+                        self.throttled += 1
+                        raise RateLimitedError(f"{self.provider} rate limit reached, please retry shortly",
+                                               wait if wait is not None else 1.0)
+                    self._cond.wait(give_up - now if wait is None else wait)
+            except BaseException:
+                self.probing = False
+                raise
+
+    def _release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _end_probe(self):
+        with self._cond:
+            self.probing = False
+
+    def _record_success(self, latency: float):
+        with self._cond:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                print(f"✅ {self.provider} circuit closed")
+            self.state = CLOSED
+            self.probing = False
+            if self.latency_avg is not None and latency > LATENCY_TOLERANCE * self.latency_avg:
+                self._decrease()
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.latency_avg = latency if self.latency_avg is None else 0.9 * self.latency_avg + 0.1 * latency
+
+    def _record_failure(self, error: BaseException, latency: float):
+        status = getattr(error, 'status', None)
+        with self._cond:
+            self.failures += 1
+            self.probing = False
+            if status in RETRYABLE_STATUSES or isinstance(error, (TimeoutError, ConnectionError)):
+                self._decrease()
+                retry_after = parse_retry_after(getattr(error, 'headers', None))
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            # Throttling is not ill health; only server errors and dead connections trip the breaker
+            unhealthy = (isinstance(status, int) and status >= 500) or (
+                status is None and isinstance(error, (TimeoutError, ConnectionError, http.client.HTTPException)))
+            if not unhealthy:
+                return
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.breaker_threshold:
+                if self.state != OPEN:
+                    print(f"🚫 {self.provider} circuit opened after {self.consecutive_failures} failures")
+                self.state = OPEN
+                self.opened_until = time.monotonic() + self.breaker_cooldown
+
+    def _decrease(self):
+        # At most one multiplicative decrease per average round trip, so one burst does not collapse the limit
+        now = time.monotonic()
+        if now - self.last_decrease >= (self.latency_avg or 0):
+            self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+            self.last_decrease = now
+
+    def _retry_delay(self, error: BaseException, attempt: int, deadline: Optional[float]) -> Optional[float]:
+        """Seconds to wait before retrying, or None if the error should be raised"""
+        if attempt >= self.retries:
+            return None
+        status = getattr(error, 'status', None)
+        if status not in RETRYABLE_STATUSES and not (
+                status is None and isinstance(error, ConnectionError)):
+            return None
+        # Full jitter, but never sooner than the provider asked
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        retry_after = parse_retry_after(getattr(error, 'headers', None))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if delay > RETRY_MAX_DELAY:
+            return None
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                'provider': self.provider,
+                'endpoint': self.endpoint,
+                'circuit': self.state if self.state != OPEN or now < self.opened_until else HALF_OPEN,
+                'circuit_retry_in': round(max(0.0, self.opened_until - now), 3) if self.state == OPEN else 0,
+                'consecutive_failures': self.consecutive_failures,
+                'concurrency_limit': round(self.limit, 2),
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'rate_limit': self.bucket.rate,
+                'tokens': round(min(self.bucket.burst, self.bucket.tokens
+                                    + (now - self.bucket.updated) * self.bucket.rate), 2),
+                'paused_for': round(max(0.0, self.paused_until - now), 3),
+                'latency_avg': round(self.latency_avg, 4) if self.latency_avg is not None else None,
+                'requests': self.requests,
+                'successes': self.successes,
+                'failures': self.failures,
+                'retries': self.retried,
+                'rejected': self.rejected,
+                'throttled': self.throttled,
+            }
+
+
+class ProviderLimits:
+    """Creates one ``ProviderLimiter`` per (provider, endpoint) on first use.
+
+    Only the configured provider endpoints get limiters of their own. Endpoints
+    that come from requests share one ``custom`` limiter per provider, so clients
+    can neither grow the table without bound nor see each other's endpoints in
+    the stats.
+    """
+
+    def __init__(self):
+        self.options: Dict[str, Any] = {}
+        self.endpoints: Set[str] = set()
+        self._limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, endpoints: Optional[Iterable[str]] = None, **options):
+        """Set the known endpoint URLs and limiter options (``rate``, ``burst``, ``max_concurrency``, ``retries``,
+        ...) at startup"""
+        if endpoints is not None:
+            self.endpoints = {endpoint_of(url) for url in endpoints}
+        self.options.update({name: value for name, value in options.items() if value is not None})
+
+    def get(self, provider: Optional[str], url: str) -> ProviderLimiter:
+        endpoint = endpoint_of(url)
+        key = (provider or 'unknown', endpoint if endpoint in self.endpoints else CUSTOM_ENDPOINT)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = self._limiters[key] = ProviderLimiter(*key, **self.options)
+            return limiter
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return [limiter.stats() for limiter in limiters]
+
+# Global instance
+provider_limits = ProviderLimits()
@@ -0,0 +1,248 @@
+"""
+Structured request log for the proxy server
+Chat requests are recorded as JSON lines by a background writer that batches writes and rotates files by size,
+so handlers never wait on disk
+"""
+
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from data_dir import data_path
+from metrics import error_type
+
+DEFAULT_PATH = os.environ.get('ECM_REQUEST_LOG', '')
+DEFAULT_MAX_BYTES = int(os.environ.get('ECM_REQUEST_LOG_MAX_BYTES', str(64 * 1024 * 1024)))
+DEFAULT_BACKUPS = int(os.environ.get('ECM_REQUEST_LOG_BACKUPS', '5'))
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get('ECM_REQUEST_LOG_FLUSH_INTERVAL', '1'))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('ECM_REQUEST_LOG_QUEUE', '10000'))
+DEFAULT_LOG_PROMPTS = os.environ.get('ECM_REQUEST_LOG_PROMPTS', '') in ('1', 'true', 'yes')
+# Records written per write() call at most
+BATCH_SIZE = 512
+
+# Credentials that can show up in error messages (Gemini puts the key in the URL)
+SECRET_PATTERNS = [
+    (re.compile(r'([?&](?:key|api_key|apikey)=)[^&\s"\']+', re.IGNORECASE), r'\1[REDACTED]'),
+    (re.compile(r'(Bearer\s+)[A-Za-z0-9._~+/=-]+', re.IGNORECASE), r'\1[REDACTED]'),
+    (re.compile(r'\b(?:sk|nvapi|AIza)[-_A-Za-z0-9]{16,}'), '[REDACTED]'),
+]
+
+
+def redact(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return text
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def prompt_hash(message: Optional[str]) -> str:
+    return hashlib.sha256((message or '').encode('utf-8')).hexdigest()[:16]
+
+
+def key_id(api_key: Optional[str]) -> Optional[str]:
+    """Short fingerprint of an API key, so callers can be told apart without logging the key"""
+    if not api_key:
+        return None
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]
+
+
+def chat_record(endpoint: str, request_data: Dict[str, Any], started: float, source: Optional[str] = None,
+                error: Any = None, log_prompts: bool = False) -> Dict[str, Any]:
+    """Log entry for one chat request: what was asked (hashed), how it was answered and how long it took.
+
+    The API key is reduced to ``key_id`` and error messages are redacted; the
+    prompt text itself is only included with ``log_prompts``.
+    """
+    message = request_data.get('message') or ''
+    record = {
+        'ts': round(time.time() - (time.perf_counter() - started), 3),
+        'endpoint': endpoint,
+        'provider': request_data.get('provider'),
+        'model': request_data.get('model'),
+        'stream': bool(request_data.get('stream', False)),
+        'temperature': request_data.get('temperature', 0.7),
+        'key': key_id(request_data.get('apiKey')),
+        'prompt_sha256': prompt_hash(message),
+        'prompt_chars': len(message),
+        'session': 'sessionId' in request_data,
+        'source': source,
+        'total_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    if log_prompts:
+        record['prompt'] = message
+    if error is not None:
+        record['error'] = error if isinstance(error, str) else error_type(error)
+        if not isinstance(error, str):
+            record['error_message'] = redact(str(error))[:500]
+    return record
+
+
+class RequestLog:
+    """Asynchronous JSONL writer: ``log()`` only enqueues, a daemon thread serializes, writes and rotates.
+
+    When the queue is full, records are dropped (and counted) rather than
+    making a request wait. Each pre-forked worker process writes its own
+    file, named after its pid, so rotation never races between processes.
+    """
+
+    # What the file holds (for the startup message) and how records are framed in it
+    kind = 'requests'
+    header = ''
+    separator = '\n'
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES,
+                 backups: int = DEFAULT_BACKUPS, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, log_prompts: bool = DEFAULT_LOG_PROMPTS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.log_prompts = log_prompts
+        self._queue: 'queue.Queue[Optional[Dict[str, Any]]]' = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def configure(self, path: Optional[str] = None, max_bytes: Optional[int] = None,
+                  backups: Optional[int] = None, log_prompts: Optional[bool] = None):
+        """Adjust log settings at startup (the file is opened on the first record)"""
+        if path is not None:
+            self.path = path
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if backups is not None:
+            self.backups = backups
+        if log_prompts is not None:
+            self.log_prompts = log_prompts
+
+    def after_fork(self):
+        """Give a forked worker its own queue, writer thread and ``<name>.<pid>.jsonl`` file"""
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        if self.path:
+            root, extension = os.path.splitext(self.path)
+            self.path = f"{root}.{os.getpid()}{extension or '.jsonl'}"
+
+    def log(self, record: Dict[str, Any]):
+        """Queue one record; never blocks"""
+        if not self.path:
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                # Relative paths go in the data directory, never the served one
+                self.path = data_path(self.path)
+                self._thread = threading.Thread(target=self._run, name='request-log', daemon=True)
+                self._thread.start()
+                print(f"📝 Logging {self.kind} to {self.path}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[Dict[str, Any]] = []
+            item = first
+            while True:
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        data = ''.join(json.dumps(record, separators=(',', ':'), default=str) + self.separator
+                       for record in batch)
+        try:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+                if self.header and self._file.tell() == 0:
+                    self._file.write(self.header)
+            self._file.write(data)
+            self._file.flush()
+            self.written += len(batch)
+            self.batches += 1
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self.errors += 1
+            print(f"⚠️ Could not write request log: {e}")
+
+    def _rotate(self):
+        """requests.jsonl -> requests.jsonl.1 -> ... -> requests.jsonl.<backups> (the oldest is deleted)"""
+        self._file.close()
+        self._file = None
+        if self.backups <= 0:
+            os.remove(self.path)
+        else:
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self.rotations += 1
+
+    def close(self, timeout: float = 5.0):
+        """Write out whatever is queued and stop the writer thread"""
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'rotations': self.rotations,
+            'errors': self.errors,
+        }
+
+# Global instance
+request_log = RequestLog()
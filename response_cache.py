@@ -0,0 +1,219 @@
+"""
+Response cache for /api/chat
+In-memory LRU with a byte budget and TTL, plus an optional sqlite tier that survives restarts
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from data_dir import data_path
+
+DEFAULT_MAX_BYTES = int(os.environ.get('ECM_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+DEFAULT_TTL = float(os.environ.get('ECM_CACHE_TTL', str(24 * 3600)))
+DEFAULT_PATH = os.environ.get('ECM_CACHE_PATH') or None
+DEFAULT_CACHE_ALL_TEMPERATURES = os.environ.get('ECM_CACHE_ALL_TEMPERATURES', '') in ('1', 'true', 'yes')
+
+# Rough per-entry bookkeeping overhead (key, timestamps, dict slot) counted against the budget
+ENTRY_OVERHEAD = 200
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Collapse whitespace and case so trivially different prompts share an entry"""
+    return ' '.join((text or '').split()).casefold()
+
+
+def make_cache_key(provider: str, model: str, temperature: Any, message: str,
+                   context: Optional[str] = None, endpoint: Optional[str] = None,
+                   history: Optional[List[Dict[str, str]]] = None, owner: Optional[str] = None) -> str:
+    """Stable hash of the normalized request fields that determine the answer.
+
+    ``owner`` (the API key's ``owner_token``) keeps answers from being served to
+    requests made with a different key, which the provider might have refused.
+    """
+    try:
+        temperature = round(float(temperature), 3)
+    except (TypeError, ValueError):
+        temperature = None
+    parts = [
+        provider or '',
+        (endpoint or '').strip().rstrip('/'),
+        model or '',
+        temperature,
+        normalize_text(message),
+        normalize_text(context),
+        owner or '',
+    ]
+    if history:
+        # Earlier turns of a session change the answer too
+        parts.append([[turn['role'], normalize_text(turn['content'])] for turn in history])
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU response cache with a byte budget, TTL and optional sqlite persistence"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL,
+                 path: Optional[str] = DEFAULT_PATH,
+                 cache_all_temperatures: bool = DEFAULT_CACHE_ALL_TEMPERATURES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_all_temperatures = cache_all_temperatures
+        self.enabled = max_bytes > 0
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.path = None
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bypasses = 0
+        if path:
+            self.open_disk(path)
+
+    def configure(self, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                  path: Optional[str] = None, cache_all_temperatures: Optional[bool] = None):
+        """Adjust cache settings at startup"""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+            self.enabled = max_bytes > 0
+        if ttl is not None:
+            self.ttl = ttl
+        if cache_all_temperatures is not None:
+            self.cache_all_temperatures = cache_all_temperatures
+        if path:
+            self.open_disk(path)
+
+    def open_disk(self, path: str):
+        """Attach the persistent sqlite tier, dropping rows older than the TTL.
+
+        A relative ``path`` is placed in the data directory, never the served one.
+        """
+        path = data_path(path)
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS responses '
+                   '(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)')
+        db.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+        db.commit()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = db
+            self.path = path
+
+    def after_fork(self):
+        """Reopen the sqlite tier in a forked worker (connections must not cross fork)"""
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        if self.path:
+            self._db = None
+            self.open_disk(self.path)
+
+    def should_cache(self, temperature: Any) -> bool:
+        """Sampled (temperature > 0) answers are only cached when explicitly enabled"""
+        if not self.enabled:
+            return False
+        if self.cache_all_temperatures:
+            return True
+        try:
+            return float(temperature) <= 0
+        except (TypeError, ValueError):
+            return False
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, created, size = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+        response = self._disk_get(key, now)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._memory_put(key, response[0], response[1])
+        return response[0]
+
+    def put(self, key: str, response: str):
+        created = time.time()
+        self._memory_put(key, response, created)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute('INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)',
+                                 (key, response, created))
+                self._db.commit()
+
+    def _memory_put(self, key: str, response: str, created: float):
+        size = len(response.encode('utf-8')) + len(key) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (response, created, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _disk_get(self, key: str, now: float):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+        return row
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'bypasses': self.bypasses,
+                'persistent': self._db is not None,
+            }
+
+# Global instance
+response_cache = ResponseCache()
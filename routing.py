@@ -0,0 +1,230 @@
+"""
+Hedged and fallback routing across LLM providers
+Races a backup provider against a slow primary and falls back in order on 5xx errors or timeouts
+"""
+
+import http.client
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from connection_pool import CancelToken
+from metrics import UPSTREAM_ROUTING
+from provider_limits import UpstreamUnavailable
+from tracing import adopt, current_trace, span
+
+DEFAULT_HEDGE_AFTER = float(os.environ['ECM_HEDGE_AFTER']) if os.environ.get('ECM_HEDGE_AFTER') else None
+DEFAULT_DEADLINE = float(os.environ['ECM_DEADLINE']) if os.environ.get('ECM_DEADLINE') else None
+DEFAULT_HEDGE_RATIO = float(os.environ.get('ECM_HEDGE_MAX_RATIO', '0.1'))
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's deadline passes before any route has answered"""
+
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    """Seconds until ``deadline`` (a ``time.monotonic()`` value), or None when there is none"""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return remaining
+
+
+def is_retryable(error: BaseException) -> bool:
+    """5xx, 429, timeouts, dropped connections and providers held back by their limits are worth another route"""
+    if isinstance(error, UpstreamUnavailable):
+        return True
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return isinstance(error, (TimeoutError, ConnectionError, http.client.HTTPException))
+
+
+class Route:
+    """One provider/model/key combination a chat request can be sent to"""
+
+    def __init__(self, provider: str, model: str, api_key: str, nim_endpoint: Optional[str] = None):
+        self.provider = provider
+        self.model = model
+        self.api_key = api_key
+        self.nim_endpoint = nim_endpoint
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], primary: 'Route') -> 'Route':
+        """Build a secondary route; fields it leaves out are taken from the primary when the provider matches"""
+        provider = data.get('provider') or primary.provider
+        same = provider == primary.provider
+        return cls(provider,
+                   data.get('model') or (primary.model if same else None),
+                   data.get('apiKey') or (primary.api_key if same else None),
+                   data.get('nimEndpoint') or (primary.nim_endpoint if same else None))
+
+
+class HedgeBudget:
+    """Caps hedged requests at a fraction of routed requests so hedging cannot double upstream cost"""
+
+    def __init__(self, max_ratio: float = DEFAULT_HEDGE_RATIO, burst: int = 1):
+        self.max_ratio = max_ratio
+        self.burst = burst
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.denied = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges < self.max_ratio * self.requests + self.burst:
+                self.hedges += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_ratio': self.max_ratio,
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'denied': self.denied,
+            }
+
+
+class RoutingPolicy:
+    """Sends a request to its primary route, hedging and falling back to secondaries as configured.
+
+    ``hedge_after`` is the latency budget (seconds) after which the next route
+    is raced against the primary; ``deadline`` is an absolute
+    ``time.monotonic()`` value after which the whole request gives up.
+    """
+
+    def __init__(self, routes: List[Route], hedge_after: Optional[float] = None,
+                 deadline: Optional[float] = None, budget: Optional[HedgeBudget] = None):
+        self.routes = routes
+        self.hedge_after = hedge_after
+        self.deadline = deadline
+        self.budget = budget
+        self.winner: Optional[Route] = None
+
+    @classmethod
+    def from_request(cls, request_data: Dict[str, Any], primary: Route, hedge_after: Optional[float] = None,
+                     deadline: Optional[float] = None, budget: Optional[HedgeBudget] = None) -> 'RoutingPolicy':
+        """Policy from the request's ``fallbacks``, ``hedgeAfterMs`` and ``deadlineMs`` fields (server defaults otherwise)"""
+        routes = [primary] + [Route.from_dict(entry, primary) for entry in request_data.get('fallbacks') or []]
+        if request_data.get('hedgeAfterMs') is not None:
+            hedge_after = float(request_data['hedgeAfterMs']) / 1000
+        if request_data.get('hedge') is False:
+            hedge_after = None
+        if request_data.get('deadlineMs') is not None:
+            deadline = float(request_data['deadlineMs']) / 1000
+        if budget is not None and len(routes) > 1:
+            budget.record_request()
+        return cls(routes, hedge_after, time.monotonic() + deadline if deadline else None, budget)
+
+    @property
+    def primary(self) -> Route:
+        return self.routes[0]
+
+    def run(self, call: Callable[[Route, Optional[CancelToken]], Any],
+            discard: Optional[Callable[[Any], None]] = None) -> Any:
+        """Return the first successful ``call(route, cancel_token)``, cancelling the others.
+
+        ``discard`` disposes of a result that arrives after another route has
+        already won (e.g. closes a stream that is holding a connection).
+        """
+        if len(self.routes) == 1:
+            self.winner = self.primary
+            try:
+                return call(self.primary, None)
+            except TimeoutError as e:
+                raise self._deadline_error(e)
+
+        results = queue.Queue()
+        lock = threading.Lock()
+        tokens: List[CancelToken] = []
+        standby = list(self.routes[1:])
+        running = 0
+        winning_token = None
+
+        trace = current_trace()
+
+        def attempt(route, token):
+            try:
+                with adopt(trace), span('attempt', provider=route.provider):
+                    outcome = (True, call(route, token))
+            except Exception as e:
+                outcome = (False, e)
+            with lock:
+                if not token.cancelled:
+                    results.put((route, token, outcome))
+                    return
+            if outcome[0] and discard is not None:
+                discard(outcome[1])
+
+        def launch(route, event=None):
+            nonlocal running
+            token = CancelToken()
+            tokens.append(token)
+            running += 1
+            if event:
+                UPSTREAM_ROUTING.inc(route.provider, event)
+            threading.Thread(target=attempt, args=(route, token), name=f"upstream-{route.provider}",
+                             daemon=True).start()
+
+        launch(self.primary)
+        hedge_at = None if self.hedge_after is None else time.monotonic() + self.hedge_after
+        last_error = None
+        try:
+            while running:
+                waits = [moment - time.monotonic() for moment in (hedge_at, self.deadline) if moment is not None]
+                try:
+                    route, token, (ok, value) = results.get(timeout=max(0, min(waits)) if waits else None)
+                except queue.Empty:
+                    if self.deadline is not None and time.monotonic() >= self.deadline:
+                        raise DeadlineExceeded("Request deadline exceeded before any provider answered")
+                    if hedge_at is not None and time.monotonic() >= hedge_at:
+                        hedge_at = None
+                        if standby and (self.budget is None or self.budget.try_hedge()):
+                            route = standby.pop(0)
+                            print(f"🏁 {self.primary.provider} is slow, hedging with {route.provider}")
+                            launch(route, 'hedge')
+                    continue
+                running -= 1
+                if ok:
+                    winning_token = token
+                    self.winner = route
+                    if route is not self.primary:
+                        UPSTREAM_ROUTING.inc(route.provider, 'won')
+                    return value
+                last_error = value
+                if is_retryable(value) and standby:
+                    route = standby.pop(0)
+                    print(f"↪️ Falling back to {route.provider} after: {value}")
+                    launch(route, 'fallback')
+            raise self._deadline_error(last_error)
+        finally:
+            with lock:
+                for token in tokens:
+                    if token is not winning_token:
+                        token.cancel()
+            # Results that were queued before the cancel still hold connections
+            while True:
+                try:
+                    _, _, (ok, value) = results.get_nowait()
+                except queue.Empty:
+                    break
+                if ok and discard is not None:
+                    discard(value)
+
+    def _deadline_error(self, error: BaseException) -> BaseException:
+        """A socket timeout at the request deadline is reported as the deadline itself"""
+        if isinstance(error, TimeoutError) and self.deadline is not None and time.monotonic() >= self.deadline:
+            return DeadlineExceeded("Request deadline exceeded before any provider answered")
+        return error
@@ -918,6 +918,16 @@ Focus on providing actionable, specific recommendations that researchers can imm
         this.conversationHistory = [];
         localStorage.removeItem('chatbot-conversation-history');
         localStorage.removeItem('chatbot-session-id');
+        const serverSession = localStorage.getItem('chatbot-server-session');
+        if (serverSession) {
+            localStorage.removeItem('chatbot-server-session');
+            // Sessions are tied to the API key that created them
+            fetch(`/api/sessions/${encodeURIComponent(serverSession)}`, {
+                method: 'DELETE',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ apiKey: this.getCurrentApiKey() })
+            }).catch(() => {});
+        }
     }
 
     toggleFileUpload() {
@@ -1117,36 +1127,34 @@ Focus on providing actionable, specific recommendations that researchers can imm
         this.updateStatus(`Removed ${fileName}`);
     }
 
+    // The parts of a request: the system prompt, the user's question, and reference material for this turn only
+    // (retrieved passages, web results, URL analysis, uploaded files). The proxy gets them as separate fields, so
+    // the server-side session stores just the question; direct provider calls join them into one message.
     async prepareEnhancedMessage(userMessage, urlAnalysis = null) {
-        let enhancedMessage = userMessage;
+        let system = '';
+        let memory = '';
+        let context = '';
         
         // Detect if user is requesting a specific analysis type and auto-switch prompt
         const detectedPrompt = this.detectRequestedPrompt(userMessage);
         if (detectedPrompt && detectedPrompt !== this.settings.systemPrompt) {
             this.addMessage(`🔄 **Switching to ${this.getPromptDisplayName(detectedPrompt)} mode** for better analysis.`, 'system', false);
             // Temporarily use the detected prompt for this message
-            const systemPrompt = this.systemPrompts[detectedPrompt];
-            if (systemPrompt) {
-                enhancedMessage = systemPrompt + '\n\n' + enhancedMessage;
-            }
+            system = this.systemPrompts[detectedPrompt] || '';
         } else {
             // Use the current system prompt
-            const systemPrompt = this.systemPrompts[this.settings.systemPrompt];
-            if (systemPrompt) {
-                enhancedMessage = systemPrompt + '\n\n' + enhancedMessage;
-            }
+            system = this.systemPrompts[this.settings.systemPrompt] || '';
         }
         
-        // Add conversation context for memory
-        if (this.memoryEnabled) {
-            const context = this.getRelevantContext(userMessage);
-            enhancedMessage = systemPrompt + context + enhancedMessage;
+        // Add conversation context for memory (the proxy server keeps the history itself)
+        if (this.memoryEnabled && !this.usesProxy()) {
+            memory = this.getRelevantContext(userMessage);
         }
 
         // Add RAG context from indexed documents
         const ragContext = await this.ragSystem.getEnhancedContext(userMessage);
         if (ragContext.context) {
-            enhancedMessage += ragContext.context;
+            context += ragContext.context;
             
             // Show user that RAG found relevant information
             if (ragContext.chunks > 0) {
@@ -1158,38 +1166,44 @@ Focus on providing actionable, specific recommendations that researchers can imm
         if (this.settings.enableWebBrowsing) {
             const webContext = await this.searchWeb(userMessage);
             if (webContext) {
-                enhancedMessage += webContext;
+                context += webContext;
             }
         }
 
         // Add URL analysis if URLs were detected
         if (urlAnalysis && urlAnalysis.hasUrls && urlAnalysis.analysis) {
-            enhancedMessage += '\n\n## URL Analysis Results:\n' + urlAnalysis.analysis;
+            context += '\n\n## URL Analysis Results:\n' + urlAnalysis.analysis;
         }
         
         // Add file context if files are uploaded
         if (this.uploadedFileData.length > 0) {
-            enhancedMessage += '\n\n## Uploaded Files Context:\n\n';
+            context += '\n\n## Uploaded Files Context:\n\n';
             
             for (const file of this.uploadedFileData) {
-                enhancedMessage += `### File: ${file.name}\n`;
-                enhancedMessage += `Type: ${file.type}\n`;
-                enhancedMessage += `Size: ${this.formatFileSize(file.size)}\n\n`;
+                context += `### File: ${file.name}\n`;
+                context += `Type: ${file.type}\n`;
+                context += `Size: ${this.formatFileSize(file.size)}\n\n`;
                 
                 if (file.isImage) {
-                    enhancedMessage += `[Image file - please analyze this image]\n\n`;
+                    context += `[Image file - please analyze this image]\n\n`;
                 } else if (file.isPDF) {
-                    enhancedMessage += `[PDF file - please analyze this document]\n\n`;
+                    context += `[PDF file - please analyze this document]\n\n`;
                 } else if (file.isZip) {
-                    enhancedMessage += `[ZIP archive - contains multiple files]\n\n`;
+                    context += `[ZIP archive - contains multiple files]\n\n`;
                 } else if (file.content) {
                     // Add text content with proper formatting
-                    enhancedMessage += '```\n' + file.content + '\n```\n\n';
+                    context += '```\n' + file.content + '\n```\n\n';
                 }
             }
         }
         
-        return enhancedMessage;
+        return { system, memory, message: userMessage, context };
+    }
+
+    // Everything in one message, for providers called straight from the browser
+    composeMessage(parts) {
+        const message = parts.system ? parts.system + '\n\n' + parts.memory + parts.message : parts.memory + parts.message;
+        return message + parts.context;
     }
 
     createDisplayMessage(userMessage) {
@@ -1290,7 +1304,7 @@ Focus on providing actionable, specific recommendations that researchers can imm
 
         // Note: NIM endpoint is now optional - will use NVIDIA's integrate API if not provided
 
-        // Prepare enhanced message with file context
+        // Prepare the system prompt, question and file context
         const enhancedMessage = await this.prepareEnhancedMessage(message, urlAnalysis);
         
         // Add user message (display original message + file info)
@@ -1339,14 +1353,15 @@ Focus on providing actionable, specific recommendations that researchers can imm
         }
     }
 
-    async callLLM(message) {
+    async callLLM(parts) {
         const { provider, nimEndpoint, model, temperature } = this.settings;
         const apiKey = this.getCurrentApiKey();
         
         // Check if we're running on localhost (with our proxy server)
-        if (window.location.hostname === 'localhost' && provider !== 'ollama') {
-            return await this.callViaProxy(message, provider, apiKey, nimEndpoint, model, temperature);
+        if (this.usesProxy()) {
+            return await this.callViaProxy(parts, provider, apiKey, nimEndpoint, model, temperature);
         }
+        const message = this.composeMessage(parts);
         
         // Check if user is trying to use NVIDIA API without server
         if (provider === 'nvidia-nim' && window.location.protocol === 'file:') {
@@ -1369,7 +1384,11 @@ Focus on providing actionable, specific recommendations that researchers can imm
         }
     }
 
-    async callViaProxy(message, provider, apiKey, nimEndpoint, model, temperature) {
+    usesProxy() {
+        return window.location.hostname === 'localhost' && this.settings.provider !== 'ollama';
+    }
+
+    async callViaProxy(parts, provider, apiKey, nimEndpoint, model, temperature) {
         const response = await fetch('/api/chat', {
             method: 'POST',
             headers: {
@@ -1379,9 +1398,14 @@ Focus on providing actionable, specific recommendations that researchers can imm
                 provider: provider,
                 apiKey: apiKey,
                 nimEndpoint: nimEndpoint,
-                message: message,
+                // Only the question is stored in the session; the system prompt and context are sent every turn
+                message: parts.message,
+                system: parts.system || undefined,
+                context: parts.context || undefined,
                 model: model,
-                temperature: temperature
+                temperature: temperature,
+                // The server keeps the conversation; only the new turn is sent
+                sessionId: this.memoryEnabled ? (localStorage.getItem('chatbot-server-session') || '') : undefined
             })
         });
 
@@ -1391,6 +1415,9 @@ Focus on providing actionable, specific recommendations that researchers can imm
         }
 
         const data = await response.json();
+        if (data.sessionId) {
+            localStorage.setItem('chatbot-server-session', data.sessionId);
+        }
         return data.response;
     }
 
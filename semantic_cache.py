@@ -0,0 +1,301 @@
+"""
+Near-duplicate answer cache for /api/chat
+Finds earlier answers to paraphrased questions with MinHash signatures in an LSH index, for the same provider and model
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from knowledge_base import tokenize
+
+DEFAULT_MAX_BYTES = int(os.environ.get('ECM_SEMANTIC_MAX_BYTES', str(8 * 1024 * 1024)))
+DEFAULT_TTL = float(os.environ.get('ECM_SEMANTIC_TTL', str(24 * 3600)))
+DEFAULT_THRESHOLD = float(os.environ.get('ECM_SEMANTIC_THRESHOLD', '0.65'))
+DEFAULT_VERIFY_RATE = float(os.environ.get('ECM_SEMANTIC_VERIFY_RATE', '0.05'))
+# Longer prompts (pasted documents) share too much boilerplate to compare safely; system prompts and attached
+# context arrive in separate request fields and only scope the lookup
+DEFAULT_MAX_TERMS = int(os.environ.get('ECM_SEMANTIC_MAX_TERMS', '32'))
+MIN_TERMS = 2
+
+# LSH banding: with 10 bands of 3 rows, prompts at Jaccard 0.65 become candidates 96% of the time
+BANDS = 10
+ROWS = 3
+MERSENNE_PRIME = (1 << 61) - 1
+_permutation_random = random.Random(0x5EC)  # Fixed seed: signatures must agree between processes and restarts
+PERMUTATIONS = [(_permutation_random.randrange(1, MERSENNE_PRIME), _permutation_random.randrange(MERSENNE_PRIME))
+                for _ in range(BANDS * ROWS)]
+
+# Question framing that does not change what is being asked ("what's X" / "explain X" / "tell me about X")
+FRAMING_WORDS = frozenset("""
+a an the is are was were be of in on at for to and or by with about as it its this that these those
+what what's whats explain describe define tell me please can could would you i we my our give some
+briefly quick quickly mean means meaning
+""".split())
+# Terms that flip or pin down the meaning: two prompts only match if they agree on all of them
+NEGATIONS = frozenset("not no never without isn't aren't don't doesn't didn't can't cannot won't shouldn't".split())
+# A verified hit whose fresh answer shares fewer terms than this with the cached one counts as false
+FALSE_HIT_SIMILARITY = 0.4
+# Rough per-entry bookkeeping overhead (signature, band keys, dict slots) counted against the budget
+ENTRY_OVERHEAD = 600
+
+
+def stem(token: str) -> str:
+    """Light suffix stripping so "tracks", "tracking" and "tracked" compare equal"""
+    if token.endswith("'s"):
+        token = token[:-2]
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    for suffix in ('ing', 'ed'):
+        if len(token) > len(suffix) + 3 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def prompt_terms(text: str) -> FrozenSet[str]:
+    """The content words of a prompt, stemmed, without question framing"""
+    return frozenset(token if token in NEGATIONS else stem(token)
+                     for token in tokenize(text or '') if token not in FRAMING_WORDS)
+
+
+def pinned_terms(terms: FrozenSet[str]) -> FrozenSet[str]:
+    """Negations and numbers, which a near-duplicate must share exactly ("step 3" is not "step 4")"""
+    return frozenset(term for term in terms if term in NEGATIONS or term.isdigit())
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(terms: FrozenSet[str]) -> List[int]:
+    hashes = [int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+              for term in terms]
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+class SemanticEntry:
+    __slots__ = ('id', 'scope', 'terms', 'band_keys', 'response', 'created', 'size')
+
+    def __init__(self, entry_id: int, scope: Tuple, terms: FrozenSet[str], band_keys: List[Tuple],
+                 response: str):
+        self.id = entry_id
+        self.scope = scope
+        self.terms = terms
+        self.band_keys = band_keys
+        self.response = response
+        self.created = time.time()
+        self.size = len(response.encode('utf-8')) + sum(len(term) for term in terms) + ENTRY_OVERHEAD
+
+
+class SemanticLookup:
+    """One prompt's fingerprint and lookup outcome, kept until its answer can be stored.
+
+    ``response`` is set when a cached answer should be served. ``candidate`` is
+    set when the hit was sampled for verification instead: the request goes
+    upstream and ``put`` compares the fresh answer with the cached one.
+    """
+
+    __slots__ = ('scope', 'terms', 'band_keys', 'response', 'similarity', 'candidate')
+
+    def __init__(self, scope: Tuple, terms: FrozenSet[str], band_keys: List[Tuple]):
+        self.scope = scope
+        self.terms = terms
+        self.band_keys = band_keys
+        self.response: Optional[str] = None
+        self.similarity = 0.0
+        self.candidate: Optional[SemanticEntry] = None
+
+
+class SemanticCache:
+    """LRU cache of answers looked up by prompt similarity, with a byte budget, TTL and false-hit sampling"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL,
+                 threshold: float = DEFAULT_THRESHOLD, verify_rate: float = DEFAULT_VERIFY_RATE,
+                 max_terms: int = DEFAULT_MAX_TERMS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.threshold = threshold
+        self.verify_rate = verify_rate
+        self.max_terms = max_terms
+        self.enabled = max_bytes > 0 and threshold <= 1
+        self._entries: 'OrderedDict[int, SemanticEntry]' = OrderedDict()
+        self._bands: Dict[Tuple, set] = {}
+        # (scope, terms) -> entry id, so a prompt is stored once however often it is answered
+        self._prompts: Dict[Tuple, int] = {}
+        self._bytes = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self.hits = 0
+        self.misses = 0
+        self.ineligible = 0
+        self.candidates_checked = 0
+        self.verified = 0
+        self.false_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                  threshold: Optional[float] = None, verify_rate: Optional[float] = None):
+        """Adjust cache settings at startup"""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if ttl is not None:
+            self.ttl = ttl
+        if threshold is not None:
+            self.threshold = threshold
+        if verify_rate is not None:
+            self.verify_rate = verify_rate
+        self.enabled = self.max_bytes > 0 and self.threshold <= 1
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def lookup(self, provider: str, model: str, temperature: Any, message: str,
+               endpoint: Optional[str] = None, context: Optional[str] = None,
+               owner: Optional[str] = None) -> Optional[SemanticLookup]:
+        """Fingerprint ``message`` and find the most similar cached prompt in the same scope.
+
+        The scope is the provider, endpoint, model and temperature, plus a hash
+        of the system instruction (``context``: system prompt, knowledge base
+        passages, attachments) and the API key's ``owner`` token, so answers
+        are only shared between questions asked against the same material by
+        the same key. Returns None when the cache is off or the prompt is too short or too
+        long to compare; otherwise a lookup whose ``response`` is the answer
+        to serve, if any, and which should be passed to ``put`` with the
+        upstream answer.
+        """
+        if not self.enabled:
+            return None
+        terms = prompt_terms(message)
+        if not MIN_TERMS <= len(terms) <= self.max_terms:
+            with self._lock:
+                self.ineligible += 1
+            return None
+        try:
+            temperature = round(float(temperature), 3)
+        except (TypeError, ValueError):
+            temperature = None
+        context_hash = hashlib.blake2b(context.encode('utf-8'), digest_size=16).hexdigest() if context else ''
+        scope = (provider or '', (endpoint or '').strip().rstrip('/'), model or '', temperature, context_hash,
+                 owner or '')
+        signature = minhash(terms)
+        query = SemanticLookup(scope, terms, [(scope, band, tuple(signature[band * ROWS:(band + 1) * ROWS]))
+                                              for band in range(BANDS)])
+        now = time.time()
+        with self._lock:
+            candidates = set()
+            for key in query.band_keys:
+                candidates.update(self._bands.get(key, ()))
+            best = None
+            pinned = pinned_terms(terms)
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if now - entry.created > self.ttl:
+                    self._remove(entry)
+                    self.expirations += 1
+                    continue
+                similarity = jaccard(terms, entry.terms)
+                if similarity >= self.threshold and pinned_terms(entry.terms) == pinned and (best is None or similarity > query.similarity):
+                    best, query.similarity = entry, similarity
+            self.candidates_checked += len(candidates)
+            if best is None:
+                self.misses += 1
+                return query
+            self._entries.move_to_end(best.id)
+            if self._random.random() < self.verify_rate:
+                # Shadow check: answer this one upstream and compare, to estimate the false-hit rate
+                query.candidate = best
+                self.misses += 1
+                return query
+            self.hits += 1
+            query.response = best.response
+            return query
+
+    def put(self, query: Optional[SemanticLookup], response: str):
+        """Store the upstream answer for ``query`` (and score it, if it was a sampled hit)"""
+        if query is None or query.response is not None or not response:
+            return
+        if query.candidate is not None:
+            agreement = jaccard(prompt_terms(response), prompt_terms(query.candidate.response))
+            with self._lock:
+                self.verified += 1
+                current = self._entries.get(query.candidate.id) is query.candidate
+                if agreement >= FALSE_HIT_SIMILARITY:
+                    # Confirmed: keep serving the cached answer rather than storing a second copy
+                    if current:
+                        query.candidate.created = time.time()
+                        self._entries.move_to_end(query.candidate.id)
+                    return
+                self.false_hits += 1
+                if current:
+                    self._remove(query.candidate)
+            print(f"🎯 Semantic cache false hit (similarity {query.similarity:.2f}, "
+                  f"answer agreement {agreement:.2f})")
+        with self._lock:
+            entry = SemanticEntry(self._next_id, query.scope, query.terms, query.band_keys, response)
+            if entry.size > self.max_bytes:
+                return
+            previous = self._prompts.get((query.scope, query.terms))
+            if previous is not None:
+                self._remove(self._entries[previous])  # Two misses for the same prompt raced upstream
+            self._next_id += 1
+            self._prompts[(entry.scope, entry.terms)] = entry.id
+            self._entries[entry.id] = entry
+            self._bytes += entry.size
+            for key in entry.band_keys:
+                self._bands.setdefault(key, set()).add(entry.id)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries.values())))
+                self.evictions += 1
+
+    def _remove(self, entry: SemanticEntry):
+        del self._entries[entry.id]
+        del self._prompts[(entry.scope, entry.terms)]
+        self._bytes -= entry.size
+        for key in entry.band_keys:
+            members = self._bands.get(key)
+            if members is not None:
+                members.discard(entry.id)
+                if not members:
+                    del self._bands[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+            self._prompts.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'ineligible': self.ineligible,
+                'candidates_checked': self.candidates_checked,
+                'verified': self.verified,
+                'false_hits': self.false_hits,
+                'false_hit_rate': round(self.false_hits / self.verified, 4) if self.verified else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+# Global instance
+semantic_cache = SemanticCache()
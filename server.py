@@ -5,18 +5,303 @@ This server acts as a proxy between the frontend and various LLM APIs
 """
 
 from http.server import HTTPServer, SimpleHTTPRequestHandler
+import argparse
+import collections
+import concurrent.futures
+import email.utils
+import hmac
+import itertools
 import json
-import urllib.request
+import queue
+import threading
+import time
 import urllib.parse
-import urllib.error
 from urllib.parse import urlparse, parse_qs
-import ssl
 import os
 
+from connection_pool import upstream_pool
+from kb_ingest import DEFAULT_DOCUMENTS_DIR, DEFAULT_WATCH_INTERVAL, DocumentWatcher, make_document
+from knowledge_base import DEFAULT_CONTEXT_TOKENS, DEFAULT_SNIPPET_CHARS, knowledge_base
+from metrics import (CACHE_LOOKUP, CHAT_ERRORS, CHAT_OUTCOMES, CHAT_REQUESTS, HANDLER_LATENCY, IN_FLIGHT,
+                     KB_SEARCH, REQUEST_BYTES, RESPONSE_BYTES, UPSTREAM_LATENCY, UPSTREAM_TTFT, error_type,
+                     registry)
+from prefork import PreforkMaster, prefork_supported
+from provider_limits import CIRCUIT_STATES, UpstreamUnavailable, provider_limits
+from request_log import chat_record, request_log
+from response_cache import make_cache_key, response_cache
+from routing import (DEFAULT_DEADLINE, DEFAULT_HEDGE_AFTER, DEFAULT_HEDGE_RATIO, DeadlineExceeded, HedgeBudget,
+                     Route, RoutingPolicy, time_left)
+from semantic_cache import semantic_cache
+from sessions import session_store
+from single_flight import FlightAbandoned, chat_flights, owner_token
+from static_files import not_modified, static_files
+from streaming import format_sse, iter_text_deltas
+from tracing import ProfilerBusy, profiler, span, tracer
+
+# Concurrency limits (overridable from the command line or the environment)
+DEFAULT_MAX_WORKERS = int(os.environ.get('ECM_MAX_WORKERS', '32'))
+DEFAULT_MAX_QUEUE = int(os.environ.get('ECM_MAX_QUEUE', '64'))
+DEFAULT_MAX_UPSTREAM = int(os.environ.get('ECM_MAX_UPSTREAM', '16'))
+DEFAULT_UPSTREAM_WAIT = float(os.environ.get('ECM_UPSTREAM_WAIT', '10'))
+RETRY_AFTER_SECONDS = int(os.environ.get('ECM_RETRY_AFTER', '2'))
+DEFAULT_BATCH_CONCURRENCY = int(os.environ.get('ECM_BATCH_CONCURRENCY', '8'))
+DEFAULT_BATCH_MAX_ITEMS = int(os.environ.get('ECM_BATCH_MAX_ITEMS', '1000'))
+# Longest a batch waits for its next result before failing the items still outstanding (and the longest one
+# item may run)
+BATCH_RESULT_TIMEOUT = float(os.environ.get('ECM_BATCH_RESULT_TIMEOUT', '300'))
+# Threads answering batch items, shared by every batch request in the process
+BATCH_MAX_THREADS = int(os.environ.get('ECM_BATCH_MAX_THREADS', '32'))
+# Bearer token for the /api/kb admin endpoints; without one they only answer requests from localhost
+ADMIN_TOKEN = os.environ.get('ECM_ADMIN_TOKEN', '')
+LOCAL_ADDRESSES = {'127.0.0.1', '::1', '::ffff:127.0.0.1'}
+# Provider API roots; override to point the proxy at a stand-in server (see benchmarks/)
+PROVIDER_BASE_URLS = {
+    'gemini': os.environ.get('ECM_GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com').rstrip('/'),
+    'openai': os.environ.get('ECM_OPENAI_BASE_URL', 'https://api.openai.com').rstrip('/'),
+    'anthropic': os.environ.get('ECM_ANTHROPIC_BASE_URL', 'https://api.anthropic.com').rstrip('/'),
+    'nvidia-nim': os.environ.get('ECM_NIM_BASE_URL', 'https://integrate.api.nvidia.com').rstrip('/'),
+}
+
+RETRIEVAL_DEFAULT = os.environ.get('ECM_RETRIEVAL', '') in ('1', 'true', 'yes')
+
+CONTEXT_INSTRUCTIONS = (
+    "You are an education assistant for the Evidence Chain Method (ECM) and Evidence-Oriented "
+    "Programming (EOP). Use the references below from the course knowledge base when they are "
+    "relevant to the question, and say so when they do not cover it."
+)
+
+
+class UpstreamHTTPError(Exception):
+    """Raised when a provider answers with an HTTP error status"""
+
+    def __init__(self, status, body, headers=None):
+        super().__init__(f"HTTP Error {status}: {body}")
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class ServerBusyError(Exception):
+    """Raised when the server cannot accept more upstream work right now"""
+
+    def __init__(self, message, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def error_status(error):
+    """HTTP status /api/chat answers with for an error"""
+    if isinstance(error, ServerBusyError):
+        return 429
+    if isinstance(error, UpstreamUnavailable):
+        return error.http_status
+    if isinstance(error, DeadlineExceeded):
+        return 504
+    return 500
+
+
+class UpstreamGate:
+    """Caps the number of in-flight upstream LLM calls.
+
+    Callers beyond ``max_in_flight`` wait up to ``wait_timeout`` seconds for a
+    slot; at most ``max_waiting`` callers may wait at once. Anything beyond
+    that is rejected straight away with ``ServerBusyError``.
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_UPSTREAM, max_waiting=DEFAULT_MAX_QUEUE,
+                 wait_timeout=DEFAULT_UPSTREAM_WAIT):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise ServerBusyError("Too many queued requests, please retry shortly")
+            self.waiting += 1
+        try:
+            with span('upstream_gate'):
+                acquired = self._slots.acquire(timeout=self.wait_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise ServerBusyError("Timed out waiting for an upstream slot")
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'rejected': self.rejected,
+            }
+
+
+class WorkerPoolHTTPServer(HTTPServer):
+    """HTTPServer that hands accepted connections to a fixed pool of worker threads.
+
+    Connections are queued in a bounded queue; when it is full the connection
+    is answered with ``429 Too Many Requests`` and a ``Retry-After`` header
+    instead of being left to pile up behind slow upstream calls.
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, max_workers=DEFAULT_MAX_WORKERS,
+                 max_queue=DEFAULT_MAX_QUEUE, max_upstream=DEFAULT_MAX_UPSTREAM,
+                 upstream_wait=DEFAULT_UPSTREAM_WAIT, retrieval_default=RETRIEVAL_DEFAULT,
+                 context_tokens=DEFAULT_CONTEXT_TOKENS, hedge_after=DEFAULT_HEDGE_AFTER,
+                 deadline=DEFAULT_DEADLINE, hedge_ratio=DEFAULT_HEDGE_RATIO,
+                 batch_concurrency=DEFAULT_BATCH_CONCURRENCY, batch_max_items=DEFAULT_BATCH_MAX_ITEMS,
+                 admin_token=ADMIN_TOKEN, document_watcher=None, bind_and_activate=True):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.retrieval_default = retrieval_default
+        self.context_tokens = context_tokens
+        self.hedge_after = hedge_after
+        self.deadline = deadline
+        self.hedge_budget = HedgeBudget(hedge_ratio)
+        self.batch_concurrency = batch_concurrency
+        self.batch_max_items = batch_max_items
+        self.admin_token = admin_token
+        self.document_watcher = document_watcher
+        self.max_workers = max_workers
+        self.request_queue = queue.Queue(maxsize=max_queue)
+        self.upstream_gate = UpstreamGate(max_upstream, max_queue, upstream_wait)
+        # Batch items queue here rather than getting threads of their own, so concurrent batches stay bounded
+        self.batch_executor = concurrent.futures.ThreadPoolExecutor(BATCH_MAX_THREADS, thread_name_prefix='batch')
+        self.rejected_connections = 0
+        registry.add_collector(collect_component_stats(self))
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"http-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        try:
+            self.request_queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected_connections += 1
+            self.reject_request(request)
+
+    def _worker_loop(self):
+        while True:
+            item = self.request_queue.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def reject_request(self, request):
+        body = json.dumps({'error': 'Server is busy, please retry shortly'}).encode('utf-8')
+        head = (
+            "HTTP/1.1 429 Too Many Requests\r\n"
+            f"Retry-After: {RETRY_AFTER_SECONDS}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('latin-1')
+        try:
+            request.sendall(head + body)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._workers:
+            self.request_queue.put(None)
+
+    def drain(self, timeout=None):
+        """Stop accepting work and wait for queued and in-flight requests to finish"""
+        self.server_close()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        # The batches in flight have finished with the workers above, so nothing is left to run
+        self.batch_executor.shutdown(wait=False, cancel_futures=True)
+        request_log.close()
+        tracer.close()
+
+
+def collect_component_stats(server):
+    """Expose the gate, pool, cache and single-flight counters as gauges on /metrics"""
+    def collect():
+        sections = {
+            'ecm_upstream': server.upstream_gate.stats(),
+            'ecm_connection_pool': upstream_pool.stats(),
+            'ecm_response_cache': response_cache.stats(),
+            'ecm_semantic_cache': semantic_cache.stats(),
+            'ecm_single_flight': chat_flights.stats(),
+            'ecm_hedge': server.hedge_budget.stats(),
+            'ecm_static': static_files.stats(),
+            'ecm_sessions': session_store.stats(),
+            'ecm_request_log': request_log.stats(),
+            'ecm_tracing': tracer.stats(),
+        }
+        for prefix, stats in sections.items():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    yield f"{prefix}_{key}", f"{prefix.replace('_', ' ')[4:]} {key.replace('_', ' ')}", {}, value
+        yield 'ecm_rejected_connections', 'connections answered 429 because the queue was full', {}, \
+            server.rejected_connections
+        limiters = provider_limits.stats()
+        for key in ('concurrency_limit', 'in_flight', 'tokens', 'consecutive_failures', 'retries', 'rejected',
+                    'throttled'):
+            for stats in limiters:
+                yield f"ecm_provider_{key}", f"provider {key.replace('_', ' ')}", \
+                    {'provider': stats['provider'], 'endpoint': stats['endpoint']}, stats[key]
+        for stats in limiters:
+            yield 'ecm_provider_circuit_state', 'provider circuit breaker state (0 closed, 1 half open, 2 open)', \
+                {'provider': stats['provider'], 'endpoint': stats['endpoint']}, CIRCUIT_STATES[stats['circuit']]
+    return collect
+
+
 class CORSRequestHandler(SimpleHTTPRequestHandler):
+    # Headers and body go out in separate writes; with Nagle on, the body waits for a delayed ACK
+    disable_nagle_algorithm = True
+    response_bytes = 0
+    metric_labels = ('', '')
+    response_status = None
+    headers_sent_at = None
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        self.headers_sent_at = time.perf_counter()
+        super().send_response(code, message)
+
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         super().end_headers()
 
@@ -24,18 +309,309 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
         self.send_response(200)
         self.end_headers()
 
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/api/stats':
+            self.send_json(200, {
+                'upstream': self.server.upstream_gate.stats(),
+                'connection_pool': upstream_pool.stats(),
+                'response_cache': response_cache.stats(),
+                'semantic_cache': semantic_cache.stats(),
+                'single_flight': chat_flights.stats(),
+                'hedging': self.server.hedge_budget.stats(),
+                'static_files': static_files.stats(),
+                'sessions': session_store.stats(),
+                'request_log': request_log.stats(),
+                'tracing': tracer.stats(),
+            })
+        elif self.path == '/api/providers':
+            self.send_json(200, {'providers': provider_limits.stats()})
+        elif self.path == '/api/kb/documents':
+            self.handle_kb_documents()
+        elif urlparse(self.path).path == '/api/kb/search':
+            self.handle_kb_search()
+        else:
+            self.serve_static()
+
+    def do_HEAD(self):
+        self.serve_static(head_only=True)
+
+    def serve_static(self, head_only=False):
+        """Serve a file from the in-memory static cache, or straight from disk if it is not cached"""
+        path = self.translate_path(self.path)
+        if static_files.private(path):
+            # Databases, logs and dotfiles under the served directory; answer as if they did not exist
+            self.send_error(404, "File not found")
+            return
+        if os.path.isdir(path):
+            index = os.path.join(path, 'index.html')
+            if not self.path.split('?', 1)[0].endswith('/') or not os.path.isfile(index):
+                # Trailing-slash redirects and directory listings
+                return super().do_HEAD() if head_only else super().do_GET()
+            path = index
+        
+        asset = static_files.get(path)
+        if asset is None:
+            return self.send_file(path, head_only)
+        encoding, body = asset.select(self.headers.get('Accept-Encoding'))
+        if asset.not_modified(self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')):
+            static_files.record('not_modified')
+            self.send_response(304)
+            self.send_validators(asset.variant_etag(encoding), asset.last_modified, bool(asset.variants))
+            self.end_headers()
+            return
+        
+        static_files.record('hit')
+        self.send_response(200)
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_validators(asset.variant_etag(encoding), asset.last_modified, bool(asset.variants))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+            self.response_bytes += len(body)
+
+    def send_file(self, path, head_only=False):
+        """Send a file that is too large to cache, using sendfile(2) where the platform has it"""
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            etag = f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+            if not_modified([etag], stat.st_mtime_ns, self.headers.get('If-None-Match'),
+                            self.headers.get('If-Modified-Since')):
+                static_files.record('not_modified')
+                self.send_response(304)
+                self.send_validators(etag, last_modified)
+                self.end_headers()
+                return
+            
+            static_files.record('disk')
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Length', str(stat.st_size))
+            self.send_validators(etag, last_modified)
+            self.end_headers()
+            if not head_only:
+                # socket.sendfile uses os.sendfile, so the file never passes through user space
+                self.response_bytes += self.connection.sendfile(f)
+
+    def send_validators(self, etag, last_modified, varies=False):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', static_files.cache_control)
+        if varies:
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        with span('write', bytes=len(body)):
+            self.wfile.write(body)
+        self.response_bytes += len(body)
+
     def do_POST(self):
         if self.path == '/api/chat':
             self.handle_chat_request()
+        elif self.path == '/api/chat/batch':
+            self.handle_batch_request()
+        elif self.path == '/api/kb/documents':
+            self.handle_kb_documents()
+        elif urlparse(self.path).path == '/api/admin/profile':
+            self.handle_profile()
         else:
             super().do_POST()
 
+    def do_DELETE(self):
+        if self.path.startswith('/api/kb/documents/'):
+            self.handle_kb_documents()
+        elif self.path.startswith('/api/sessions/'):
+            self.handle_session_delete()
+        else:
+            self.send_error(405, "Method not allowed")
+
+    def handle_session_delete(self):
+        """DELETE /api/sessions/<id> with the {"apiKey": ...} the session was created with"""
+        session_id = urllib.parse.unquote(self.path[len('/api/sessions/'):])
+        try:
+            content_length = int(self.headers.get('Content-Length') or 0)
+            data = json.loads(self.rfile.read(content_length).decode('utf-8') or '{}')
+            api_key = data.get('apiKey') if isinstance(data, dict) else None
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        # Someone else's session looks the same as an unknown one
+        if session_store.delete(session_id, owner_token(api_key)):
+            self.send_json(200, {'deleted': session_id})
+        else:
+            self.send_json(404, {'error': 'Unknown session'})
+
+    def handle_kb_search(self):
+        """Ranked knowledge base snippets: GET /api/kb/search?q=...&k=5&max_bytes=...&max_tokens=...&chars=..."""
+        params = {name: values[-1] for name, values in parse_qs(urlparse(self.path).query).items()}
+        query = params.get('q', '').strip()
+        if not query:
+            self.send_json(400, {'error': "Missing query parameter 'q'"})
+            return
+        try:
+            top_k = max(1, min(int(params.get('k', 5)), 50))
+            max_bytes = int(params['max_bytes']) if 'max_bytes' in params else None
+            max_tokens = int(params['max_tokens']) if 'max_tokens' in params else None
+            snippet_chars = int(params.get('chars', DEFAULT_SNIPPET_CHARS))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        search_started = time.perf_counter()
+        snippets = knowledge_base.search_snippets(query, top_k, max_bytes, max_tokens, snippet_chars)
+        elapsed = time.perf_counter() - search_started
+        KB_SEARCH.observe(elapsed, 'snippets')
+        self.send_json(200, {
+            'query': query,
+            'results': snippets,
+            'bytes': sum(snippet['bytes'] for snippet in snippets),
+            'tokens': sum(snippet['tokens'] for snippet in snippets),
+            'elapsed_ms': round(elapsed * 1000, 2),
+        })
+
+    def admin_allowed(self):
+        """Admin endpoints need the admin token, or a request from this machine when no token is set"""
+        token = self.server.admin_token
+        if token:
+            supplied = (self.headers.get('Authorization') or '').removeprefix('Bearer ').strip()
+            if hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+                return True
+            self.send_json(403, {'error': 'Missing or wrong admin token'})
+            return False
+        if self.client_address[0] in LOCAL_ADDRESSES:
+            return True
+        self.send_json(403, {'error': 'Admin endpoints only answer localhost unless --admin-token is set'})
+        return False
+
+    def handle_kb_documents(self):
+        """List (GET), add or replace (POST) and delete (DELETE /api/kb/documents/<id>) knowledge base documents.
+
+        With a watched documents directory, posted documents are written there as
+        files, so every worker process ingests them; otherwise they are ingested
+        into this process directly.
+        """
+        if not self.admin_allowed():
+            return
+        watcher = self.server.document_watcher
+        if self.command == 'GET':
+            info = knowledge_base.get_knowledge_base_info()
+            if watcher is not None:
+                info['watcher'] = watcher.stats()
+            self.send_json(200, info)
+            return
+        
+        try:
+            if self.command == 'DELETE':
+                doc_id = urllib.parse.unquote(self.path[len('/api/kb/documents/'):])
+                if doc_id not in knowledge_base.documents:
+                    self.send_json(404, {'error': f"No document {doc_id!r}"})
+                    return
+                changes = {doc_id: None}
+            else:
+                content_length = int(self.headers.get('Content-Length') or 0)
+                data = json.loads(self.rfile.read(content_length).decode('utf-8') or '{}')
+                entries = data.get('documents', [data]) if isinstance(data, dict) else data
+                changes = {}
+                metadata = {}
+                for entry in entries:
+                    if entry.get('rescan'):
+                        continue
+                    if not isinstance(entry.get('id'), str) or not isinstance(entry.get('content'), str):
+                        raise ValueError("Each document needs a string 'id' and 'content'")
+                    changes[entry['id']] = make_document(entry['id'], entry['content'], entry.get('title'),
+                                                         entry.get('type') or 'handout', entry.get('version'))
+                    metadata[entry['id']] = {field: entry.get(field) for field in ('title', 'type', 'version')}
+            
+            if watcher is None:
+                result = knowledge_base.ingest(changes)
+            else:
+                direct = {}
+                for doc_id, doc in changes.items():
+                    if doc is not None:
+                        watcher.save(doc_id, doc['content'], metadata[doc_id])
+                    elif not (knowledge_base.documents[doc_id].get('source') and watcher.delete(doc_id)):
+                        direct[doc_id] = None  # Not one of the watched files (e.g. a built-in document)
+                removed = knowledge_base.ingest(direct)['removed'] if direct else 0
+                result = watcher.sync()
+                result['removed'] += removed
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except OSError as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        result['generation'] = knowledge_base.snapshot.generation
+        self.send_json(200, result)
+
+    def handle_profile(self):
+        """Profile this process: POST /api/admin/profile?seconds=10&interval=0.005&threads=all
+
+        Samples the stacks of the threads handling requests (every thread with
+        threads=all) and answers with the collapsed-stack profile, ready for
+        flamegraph.pl, inferno or speedscope; a copy is saved under the profile directory.
+        """
+        if not self.admin_allowed():
+            return
+        params = {name: values[-1] for name, values in parse_qs(urlparse(self.path).query).items()}
+        try:
+            seconds = float(params.get('seconds', 10))
+            interval = float(params['interval']) if 'interval' in params else None
+            if seconds <= 0:
+                raise ValueError("'seconds' must be positive")
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        try:
+            profile = profiler.profile(seconds, interval, params.get('threads') == 'all')
+        except ProfilerBusy as e:
+            self.send_json(409, {'error': str(e)})
+            return
+        body = profile['collapsed'].encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Profile-Samples', str(profile['samples']))
+        if profile['path']:
+            self.send_header('X-Profile-Path', profile['path'])
+        self.end_headers()
+        self.wfile.write(body)
+
     def handle_chat_request(self):
+        started = time.perf_counter()
+        self.metric_labels = ('', '')
+        self.response_status = self.headers_sent_at = None
+        bytes_before = self.response_bytes
+        request_data, content_length, prepared, source, error = {}, 0, None, None, None
+        trace = tracer.begin('POST /api/chat')
+        IN_FLIGHT.inc()
         try:
             # Read the request body
             content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            request_data = json.loads(post_data.decode('utf-8'))
+            with span('read_body', bytes=content_length):
+                post_data = self.rfile.read(content_length)
+            with span('json_decode'):
+                request_data = json.loads(post_data.decode('utf-8'))
             
             provider = request_data.get('provider')
             api_key = request_data.get('apiKey')
@@ -44,44 +620,602 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
             temperature = request_data.get('temperature', 0.7)
             nim_endpoint = request_data.get('nimEndpoint')
             
-            print(f"🔍 Debug: Provider={provider}, Model={model}, NIM Endpoint='{nim_endpoint}'")
+            stream = bool(request_data.get('stream', False))
             
-            # Call the appropriate API
-            if provider == 'gemini':
-                response = self.call_gemini(message, api_key, model, temperature)
-            elif provider == 'openai':
-                response = self.call_openai(message, api_key, model, temperature)
-            elif provider == 'anthropic':
-                response = self.call_anthropic(message, api_key, model, temperature)
-            elif provider == 'nvidia-nim':
-                response = self.call_nvidia_nim(message, api_key, nim_endpoint, model, temperature)
-            else:
-                raise ValueError(f"Unsupported provider: {provider}")
+            labels = self.metric_labels = (provider, model)
+            CHAT_REQUESTS.inc(provider, model, 'true' if stream else 'false')
+            REQUEST_BYTES.observe(content_length, *labels)
             
-            # Send successful response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'response': response}).encode('utf-8'))
+            print(f"🔍 Debug: Provider={provider}, Model={model}, NIM Endpoint='{nim_endpoint}', Stream={stream}")
+            
+            with span('prepare'):
+                context, session, cache_key, cached, semantic = self.prepare_chat(request_data)
+            prepared = time.perf_counter()
+            session_headers = {'X-Session-Id': session.id} if session is not None else {}
+            if cached is not None:
+                if semantic is not None and semantic.response is not None:
+                    source = 'semantic'
+                    session_headers['X-Cache-Similarity'] = f"{semantic.similarity:.2f}"
+                else:
+                    source = 'cache'
+                CHAT_OUTCOMES.inc(*labels, source)
+                session_store.record(session, message, cached)
+                self.send_cached_response(cached, stream, session_headers)
+                return
+            
+            if not stream:
+                with span('complete'):
+                    response, source = self.complete_chat(request_data, context, cache_key, session, semantic)
+                if source == 'coalesced':
+                    headers = {'X-Coalesced': '1'}
+                else:
+                    headers = {'X-Cache': 'MISS'} if cache_key is not None else {}
+                body = {'response': response}
+                if session is not None:
+                    body['sessionId'] = session.id
+                self.send_json(200, body, dict(headers, **session_headers) or None)
+                return
+            
+            # Coalesce identical requests that are already in flight
+            flight_key = cache_key or self.flight_key(request_data, context, session)
+            owner = owner_token(api_key)
+            flight, is_leader = chat_flights.join(flight_key, owner)
+            if not is_leader:
+                try:
+                    with span('follow'):
+                        response = self.follow_flight(flight, owner, session_headers)
+                    session_store.record(session, message, response)
+                    source = 'coalesced'
+                    CHAT_OUTCOMES.inc(*labels, source)
+                    return
+                except FlightAbandoned:
+                    # The leader gave up (or failed with someone else's key): go upstream ourselves
+                    flight = None
+            
+            source = 'upstream'
+            CHAT_OUTCOMES.inc(*labels, source)
+            try:
+                response = self.stream_chat_response(self.routing_policy(request_data), message, temperature,
+                                                     cache_key, flight, context, session, semantic)
+                session_store.record(session, message, response)
+                if not response:
+                    error = 'stream_incomplete'  # The error went out as an SSE event, or the client left
+            finally:
+                if flight is not None:
+                    chat_flights.release(flight_key, flight)
+            
+        except ServerBusyError as e:
+            print(f"⏳ Server Busy: {str(e)}")
+            error = e
+            CHAT_ERRORS.inc(*self.metric_labels, 'busy')
+            self.send_json(429, {'error': str(e)}, {'Retry-After': str(e.retry_after)})
+            
+        except UpstreamUnavailable as e:
+            print(f"🚦 Provider Unavailable: {str(e)}")
+            error = e
+            CHAT_ERRORS.inc(*self.metric_labels, type(e).__name__)
+            self.send_json(e.http_status, {'error': str(e)}, {'Retry-After': str(max(1, round(e.retry_after)))})
+            
+        except DeadlineExceeded as e:
+            print(f"⌛ Deadline Exceeded: {str(e)}")
+            error = e
+            CHAT_ERRORS.inc(*self.metric_labels, 'deadline')
+            self.send_json(504, {'error': str(e)})
             
         except Exception as e:
             print(f"❌ Server Error: {str(e)}")
+            error = e
+            CHAT_ERRORS.inc(*self.metric_labels, error_type(e))
             # Send error response
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            error_response = {'error': str(e)}
-            self.wfile.write(json.dumps(error_response).encode('utf-8'))
+            self.send_json(500, {'error': str(e)})
+        
+        finally:
+            IN_FLIGHT.dec()
+            HANDLER_LATENCY.observe(time.perf_counter() - started, *self.metric_labels)
+            RESPONSE_BYTES.observe(self.response_bytes, *self.metric_labels)
+            if request_log.enabled:
+                record = chat_record('/api/chat', request_data, started, source, error, request_log.log_prompts)
+                record.update(request_bytes=content_length, response_bytes=self.response_bytes - bytes_before,
+                              status=self.response_status)
+                if prepared is not None:
+                    record['prepare_ms'] = round((prepared - started) * 1000, 2)
+                if self.headers_sent_at is not None:
+                    record['ttfb_ms'] = round((self.headers_sent_at - started) * 1000, 2)
+                if trace is not None:
+                    record['trace'] = trace.id
+                request_log.log(record)
+            tracer.finish(trace, provider=request_data.get('provider'), model=request_data.get('model'),
+                          stream=bool(request_data.get('stream', False)), status=self.response_status,
+                          source=source)
+
+    def prepare_chat(self, request_data):
+        """Knowledge base context, session, cache key, any cached answer and the semantic cache lookup.
+
+        A request carrying a ``sessionId`` field (empty to start a conversation)
+        continues that server-side session; the id to send next time is the
+        one returned with the answer. Without an exact cache hit, a prompt
+        with no earlier turns is looked up by similarity in the semantic cache.
+        """
+        message = request_data.get('message')
+        temperature = request_data.get('temperature', 0.7)
+        
+        # Optionally ground the answer in knowledge base passages retrieved server-side
+        retrieved = None
+        if request_data.get('retrieval', self.server.retrieval_default):
+            with span('retrieve'):
+                retrieved = self.retrieve_context(message, request_data.get('contextTokens'))
+        context = self.request_context(request_data, retrieved)
+        session = None
+        if 'sessionId' in request_data:
+            with span('session'):
+                session = session_store.open(request_data.get('sessionId'),
+                                             owner_token(request_data.get('apiKey')))
+        
+        # Serve repeated questions from the response cache
+        if not self.cacheable(request_data, temperature):
+            response_cache.record_bypass()
+            return context, session, None, None, None
+        cache_key = self.flight_key(request_data, context, session)
+        lookup_started = time.perf_counter()
+        with span('cache_lookup') as lookup:
+            cached = response_cache.get(cache_key)
+            lookup.set(hit=cached is not None)
+        semantic = None
+        if cached is None and (session is None or not session.turns):
+            with span('semantic_lookup') as lookup:
+                semantic = semantic_cache.lookup(request_data.get('provider'), request_data.get('model'),
+                                                 temperature, message, request_data.get('nimEndpoint'), context,
+                                                 owner_token(request_data.get('apiKey')))
+                lookup.set(hit=semantic is not None and semantic.response is not None)
+            if semantic is not None and semantic.response is not None:
+                # Not copied into the exact cache: a near match is not an answer to this exact prompt
+                cached = semantic.response
+        CACHE_LOOKUP.observe(time.perf_counter() - lookup_started)
+        return context, session, cache_key, cached, semantic
+
+    def request_context(self, request_data, retrieved=None):
+        """System instruction for this turn: the client's ``system`` prompt, the retrieved passages and the client's
+        ``context`` (attached files, web results), kept out of the message so sessions record only the question"""
+        parts = [request_data.get('system'), retrieved, request_data.get('context')]
+        parts = [part.strip() for part in parts if isinstance(part, str) and part.strip()]
+        return "\n\n".join(parts) or None
+
+    def flight_key(self, request_data, context=None, session=None):
+        """Cache and single-flight key: the request fields, the session history the model sees and the API key"""
+        model = request_data.get('model')
+        message = request_data.get('message')
+        history, context = session_store.conversation(session, model, message, context)
+        return make_cache_key(request_data.get('provider'), model, request_data.get('temperature', 0.7), message,
+                              context, request_data.get('nimEndpoint'), history,
+                              owner_token(request_data.get('apiKey')))
+
+    def complete_chat(self, request_data, context=None, cache_key=None, session=None, semantic=None):
+        """Answer a non-streaming chat request upstream; returns (response, source).
+
+        Identical requests already in flight are shared (source "coalesced"),
+        otherwise the provider is called through the routing policy and the
+        upstream gate (source "upstream").
+        """
+        provider = request_data.get('provider')
+        api_key = request_data.get('apiKey')
+        message = request_data.get('message')
+        model = request_data.get('model')
+        temperature = request_data.get('temperature', 0.7)
+        labels = (provider, model)
+        
+        # Coalesce identical requests that are already in flight
+        flight_key = cache_key or self.flight_key(request_data, context, session)
+        owner = owner_token(api_key)
+        flight, is_leader = chat_flights.join(flight_key, owner)
+        if not is_leader:
+            try:
+                response = flight.result(owner)
+                session_store.record(session, message, response)
+                CHAT_OUTCOMES.inc(*labels, 'coalesced')
+                return response, 'coalesced'
+            except FlightAbandoned:
+                # The leader gave up (or failed with someone else's key): go upstream ourselves
+                flight = None
+        
+        CHAT_OUTCOMES.inc(*labels, 'upstream')
+        policy = self.routing_policy(request_data)
+        try:
+            # Call the appropriate API (hedged or with fallbacks if configured), bounded by the upstream gate
+            try:
+                with self.server.upstream_gate, span('route', routes=len(policy.routes)):
+                    upstream_started = time.perf_counter()
+                    response = policy.run(lambda route, cancel_token: self.call_provider(
+                        route.provider, message, route.api_key, route.model, temperature, route.nim_endpoint,
+                        context=context, deadline=policy.deadline, cancel_token=cancel_token, session=session))
+                    UPSTREAM_LATENCY.observe(time.perf_counter() - upstream_started, *labels)
+            except Exception as e:
+                if flight is not None:
+                    flight.fail(e)
+                raise
+            if flight is not None:
+                flight.finish(response)
+        finally:
+            if flight is not None:
+                chat_flights.release(flight_key, flight)
+        # Answers from a secondary provider are not cached under the primary's key
+        if cache_key is not None and policy.winner is policy.primary:
+            response_cache.put(cache_key, response)
+            semantic_cache.put(semantic, response)
+        session_store.record(session, message, response)
+        return response, 'upstream'
+
+    def routing_policy(self, request_data):
+        primary = Route(request_data.get('provider'), request_data.get('model'), request_data.get('apiKey'),
+                        request_data.get('nimEndpoint'))
+        return RoutingPolicy.from_request(request_data, primary, self.server.hedge_after, self.server.deadline,
+                                          self.server.hedge_budget)
 
-    def call_gemini(self, message, api_key, model, temperature):
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+    def handle_batch_request(self):
+        """Answer many chat requests concurrently, streaming NDJSON results in completion order"""
+        started = time.perf_counter()
+        try:
+            items, concurrency = self.read_batch()
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        print(f"📦 Batch of {len(items)} requests, up to {concurrency} at a time per provider")
+        
+        # One work list per provider so each provider's concurrency is bounded separately
+        pending = {}
+        for index, item in enumerate(items):
+            pending.setdefault(item.get('provider'), collections.deque()).append((index, item))
+        results = queue.Queue()
+        stop = threading.Event()
+        # No item outlives the batch's result timeout, so a given-up batch frees its threads
+        longest = BATCH_RESULT_TIMEOUT * 1000
+        
+        def work(todo):
+            # One item per task, then back of the pool's queue, so concurrent batches take turns on the threads
+            if stop.is_set():
+                return
+            try:
+                index, item = todo.popleft()
+            except IndexError:
+                return
+            deadline = item.get('deadlineMs')
+            if deadline is None and self.server.deadline:
+                deadline = self.server.deadline * 1000
+            item = dict(item, deadlineMs=min(float(deadline), longest) if deadline else longest)
+            try:
+                result = self.answer_batch_item(index, item)
+            except Exception as e:
+                # Every item must produce a line, or the response below waits for it forever
+                print(f"❌ Batch item {index} failed: {str(e)}")
+                result = {'index': index, 'error': str(e), 'status': 500}
+            results.put(result)
+            if todo and not stop.is_set():
+                workers.append(self.server.batch_executor.submit(work, todo))
+        
+        workers = []
+        for todo in pending.values():
+            for _ in range(min(concurrency, len(todo))):
+                workers.append(self.server.batch_executor.submit(work, todo))
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        errors = 0
+        outstanding = set(range(len(items)))
+        try:
+            while outstanding:
+                try:
+                    result = results.get(timeout=BATCH_RESULT_TIMEOUT)
+                except queue.Empty:
+                    print(f"⏱️ No batch result in {BATCH_RESULT_TIMEOUT:g}s, failing {len(outstanding)} items")
+                    stop.set()
+                    for worker in list(workers):
+                        worker.cancel()
+                    for index in sorted(outstanding):
+                        self.write_ndjson({'index': index, 'error': 'Batch item timed out', 'status': 504})
+                    errors += len(outstanding)
+                    break
+                outstanding.discard(result['index'])
+                errors += 'error' in result
+                self.write_ndjson(result)
+            self.write_ndjson({'done': True, 'count': len(items), 'errors': errors,
+                               'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
+        except (BrokenPipeError, ConnectionResetError):
+            print("🔌 Client disconnected, cancelling the rest of the batch")
+            stop.set()
+            for worker in list(workers):
+                worker.cancel()
+        self.close_connection = True
+
+    def read_batch(self):
+        """Batch items from a JSON array, a {"requests": [...], "defaults": {...}} object, or JSONL.
+
+        Items are prompts or full /api/chat request objects; fields missing from
+        an item come from "defaults" (a JSONL body may start with a {"defaults": ...} line).
+        """
+        content_length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(content_length).decode('utf-8')
+        content_type = self.headers.get('Content-Type') or ''
+        defaults = {}
+        concurrency = self.server.batch_concurrency
+        if 'ndjson' in content_type or 'jsonl' in content_type:
+            entries = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            data = json.loads(body)
+            if isinstance(data, dict):
+                defaults = data.get('defaults') or {}
+                concurrency = int(data.get('concurrency') or concurrency)
+                entries = data.get('requests') or data.get('prompts') or []
+            else:
+                entries = data
         
+        items = []
+        for entry in entries:
+            if isinstance(entry, dict) and list(entry) == ['defaults']:
+                defaults = entry['defaults']
+                continue
+            if isinstance(entry, str):
+                entry = {'message': entry}
+            if not isinstance(entry, dict):
+                raise ValueError("Batch items must be prompts or request objects")
+            item = dict(defaults, **entry)
+            item.pop('stream', None)
+            item.setdefault('message', item.get('prompt'))
+            items.append(item)
+        if not items:
+            raise ValueError("Batch contains no requests")
+        if len(items) > self.server.batch_max_items:
+            raise ValueError(f"Batch has {len(items)} requests; the limit is {self.server.batch_max_items}")
+        return items, max(1, min(concurrency, self.server.batch_concurrency))
+
+    def answer_batch_item(self, index, item):
+        """One NDJSON result line: the answer and where it came from, or the error"""
+        item_started = time.perf_counter()
+        trace = tracer.begin('batch item', index=index)
+        provider, model = item.get('provider'), item.get('model')
+        CHAT_REQUESTS.inc(provider, model, 'false')
+        result = {'index': index}
+        error = None
+        if item.get('id') is not None:
+            result['id'] = item['id']
+        try:
+            context, session, cache_key, cached, semantic = self.prepare_chat(item)
+            if cached is not None:
+                source = 'semantic' if semantic is not None and semantic.response is not None else 'cache'
+                CHAT_OUTCOMES.inc(provider, model, source)
+                session_store.record(session, item.get('message'), cached)
+                response = cached
+            else:
+                response, source = self.complete_chat(item, context, cache_key, session, semantic)
+            result.update(response=response, source=source)
+            if session is not None:
+                result['sessionId'] = session.id
+        except Exception as e:
+            print(f"❌ Batch item {index} failed: {str(e)}")
+            error = e
+            CHAT_ERRORS.inc(provider, model, error_type(e))
+            result.update(error=str(e), status=error_status(e))
+        result['elapsed_ms'] = round((time.perf_counter() - item_started) * 1000, 1)
+        if request_log.enabled:
+            record = chat_record('/api/chat/batch', item, item_started, result.get('source'), error,
+                                 request_log.log_prompts)
+            record.update(status=result.get('status', 200), index=index,
+                          response_bytes=len((result.get('response') or '').encode('utf-8')))
+            if trace is not None:
+                record['trace'] = trace.id
+            request_log.log(record)
+        tracer.finish(trace, provider=provider, model=model, status=result.get('status', 200),
+                      source=result.get('source'))
+        return result
+
+    def write_ndjson(self, data):
+        line = (json.dumps(data) + '\n').encode('utf-8')
+        self.wfile.write(line)
+        self.wfile.flush()
+        self.response_bytes += len(line)
+
+    def call_provider(self, provider, message, api_key, model, temperature, nim_endpoint=None, stream=False,
+                      context=None, deadline=None, cancel_token=None, session=None):
+        """Dispatch to the provider's call_* method (returns text, or a delta iterator when streaming)"""
+        with span('dispatch', provider=provider, model=model, stream=stream):
+            return self.dispatch(provider, message, api_key, model, temperature, nim_endpoint, stream, context,
+                                 deadline, cancel_token, session)
+
+    def dispatch(self, provider, message, api_key, model, temperature, nim_endpoint=None, stream=False,
+                 context=None, deadline=None, cancel_token=None, session=None):
+        # Session history is trimmed per call, since fallback routes may use a model with a smaller window
+        history, context = session_store.conversation(session, model, message, context)
+        if provider == 'gemini':
+            return self.call_gemini(message, api_key, model, temperature, stream, context, deadline, cancel_token,
+                                    history)
+        elif provider == 'openai':
+            return self.call_openai(message, api_key, model, temperature, stream, context, deadline, cancel_token,
+                                    history)
+        elif provider == 'anthropic':
+            return self.call_anthropic(message, api_key, model, temperature, stream, context, deadline,
+                                       cancel_token, history)
+        elif provider == 'nvidia-nim':
+            return self.call_nvidia_nim(message, api_key, nim_endpoint, model, temperature, stream, context,
+                                        deadline, cancel_token, history)
+        else:
+            raise ValueError(f"Unsupported provider: {provider}")
+
+    def retrieve_context(self, message, token_budget=None):
+        """System prompt built from the knowledge base passages that best match the message"""
+        search_started = time.perf_counter()
+        passages = knowledge_base.retrieve_context(message or '', int(token_budget or self.server.context_tokens))
+        KB_SEARCH.observe(time.perf_counter() - search_started, 'retrieve')
+        if not passages:
+            return None
+        print(f"📚 Retrieved {len(passages)} passages: {', '.join(p['section'] for p in passages)}")
+        return CONTEXT_INSTRUCTIONS + "\n\n" + knowledge_base.format_context(passages)
+
+    def cacheable(self, request_data, temperature):
+        """Per-request "cache" flag wins; otherwise only deterministic requests are cached"""
+        requested = request_data.get('cache')
+        if requested is not None:
+            return bool(requested) and response_cache.enabled
+        return response_cache.should_cache(temperature)
+
+    def send_cached_response(self, response, stream, headers=None):
+        headers = dict(headers or {}, **{'X-Cache': 'HIT'})
+        if stream:
+            self.start_sse(headers)
+            self.write_sse({'delta': response})
+            self.write_sse({'done': True}, event='done')
+            self.close_connection = True
+        else:
+            body = {'response': response}
+            if 'X-Session-Id' in headers:
+                body['sessionId'] = headers['X-Session-Id']
+            self.send_json(200, body, headers)
+
+    def start_sse(self, headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def follow_flight(self, flight, owner, headers=None):
+        """Stream the answer of an identical request that is already in flight; returns it if it completed"""
+        deltas = flight.follow(owner)
+        parts = []
+        try:
+            first = next(deltas, None)
+            self.start_sse(dict(headers or {}, **{'X-Coalesced': '1'}))
+            try:
+                if first is not None:
+                    parts.append(first)
+                    self.write_sse({'delta': first})
+                    for delta in deltas:
+                        parts.append(delta)
+                        self.write_sse({'delta': delta})
+                self.write_sse({'done': True}, event='done')
+            except (BrokenPipeError, ConnectionResetError):
+                print("🔌 Client disconnected from shared stream")
+            except Exception as e:
+                print(f"❌ Stream Error: {str(e)}")
+                self.write_sse({'error': str(e)}, event='error')
+                parts = []
+        finally:
+            deltas.close()
+        self.close_connection = True
+        return ''.join(parts)
+
+    def stream_chat_response(self, policy, message, temperature, cache_key=None, flight=None, context=None,
+                             session=None, semantic=None):
+        """Relay provider token deltas to the browser as Server-Sent Events; returns the completed answer"""
+        gate = self.server.upstream_gate
+        try:
+            gate.acquire()
+            try:
+                upstream_started = time.perf_counter()
+                # Routes race to the first delta; the losing streams are closed
+                with span('route', routes=len(policy.routes)):
+                    first, deltas = policy.run(
+                        lambda route, cancel_token: self.open_stream(route, message, temperature, context,
+                                                                     policy.deadline, cancel_token, session),
+                        discard=lambda opened: opened[1].close())
+                UPSTREAM_TTFT.observe(time.perf_counter() - upstream_started, *self.metric_labels)
+            except BaseException:
+                gate.release()
+                raise
+        except Exception as e:
+            if flight is not None:
+                flight.fail(e)
+            raise
+        if policy.winner is not policy.primary:
+            cache_key = None
+        headers = {'X-Cache': 'MISS'} if cache_key is not None else {}
+        if session is not None:
+            headers['X-Session-Id'] = session.id
+        try:
+            self.start_sse(headers)
+            with span('relay') as relay:
+                response = self.relay_stream(first, deltas, cache_key, flight)
+                relay.set(chars=len(response or ''))
+            UPSTREAM_LATENCY.observe(time.perf_counter() - upstream_started, *self.metric_labels)
+        finally:
+            deltas.close()
+            gate.release()
+        self.close_connection = True
+        if cache_key is not None:
+            semantic_cache.put(semantic, response)
+        return response
+
+    def open_stream(self, route, message, temperature, context=None, deadline=None, cancel_token=None,
+                    session=None):
+        """Start a streaming call on ``route`` and wait for its first delta; returns (first, deltas)"""
+        deltas = self.call_provider(route.provider, message, route.api_key, route.model, temperature,
+                                    route.nim_endpoint, stream=True, context=context, deadline=deadline,
+                                    cancel_token=cancel_token, session=session)
+        try:
+            # Fetch the first delta before committing to a 200 so upstream errors stay JSON errors
+            return next(deltas, None), deltas
+        except BaseException:
+            deltas.close()
+            raise
+
+    def relay_stream(self, first, deltas, cache_key=None, flight=None):
+        """Write deltas to the client, publishing them to any coalesced followers; returns the completed answer"""
+        parts = []
+        client_alive = True
+        try:
+            for delta in itertools.chain([first] if first is not None else [], deltas):
+                parts.append(delta)
+                if flight is not None:
+                    flight.append(delta)
+                if not client_alive:
+                    continue
+                try:
+                    self.write_sse({'delta': delta})
+                except (BrokenPipeError, ConnectionResetError):
+                    client_alive = False
+                    if flight is None or not chat_flights.has_followers(flight):
+                        # Closing the generator drops the upstream connection
+                        print("🔌 Client disconnected, cancelling upstream stream")
+                        return ''
+                    print("🔌 Client disconnected, finishing stream for coalesced requests")
+            if flight is not None:
+                flight.finish()
+            if cache_key is not None:
+                response_cache.put(cache_key, ''.join(parts))
+            if client_alive:
+                self.write_sse({'done': True}, event='done')
+            return ''.join(parts)
+        except (BrokenPipeError, ConnectionResetError):
+            print("🔌 Client disconnected")
+        except Exception as e:
+            print(f"❌ Stream Error: {str(e)}")
+            CHAT_ERRORS.inc(*self.metric_labels, error_type(e))
+            if flight is not None:
+                flight.fail(e)
+            if client_alive:
+                self.write_sse({'error': str(e)}, event='error')
+
+    def write_sse(self, data, event=None):
+        message = format_sse(data, event)
+        self.wfile.write(message)
+        self.wfile.flush()
+        self.response_bytes += len(message)
+
+    def call_gemini(self, message, api_key, model, temperature, stream=False, context=None,
+                    deadline=None, cancel_token=None, history=None):
+        if stream:
+            url = f"{PROVIDER_BASE_URLS['gemini']}/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+        else:
+            url = f"{PROVIDER_BASE_URLS['gemini']}/v1beta/models/{model}:generateContent?key={api_key}"
+        
+        # Gemini calls the assistant role "model"
+        contents = [{"role": "model" if turn["role"] == "assistant" else "user",
+                     "parts": [{"text": turn["content"]}]} for turn in history or []]
+        contents.append({"role": "user", "parts": [{"text": message}]})
         data = {
-            "contents": [{
-                "parts": [{
-                    "text": message
-                }]
-            }],
+            "contents": contents,
             "generationConfig": {
                 "temperature": temperature,
                 "topK": 40,
@@ -89,39 +1223,54 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
                 "maxOutputTokens": 1024,
             }
         }
+        if context:
+            data["systemInstruction"] = {"parts": [{"text": context}]}
         
-        return self.make_api_request(url, data)
+        if stream:
+            return self.stream_api_request(url, data, None, deadline, cancel_token, 'gemini')
+        return self.make_api_request(url, data, None, deadline, cancel_token, 'gemini')
 
-    def call_openai(self, message, api_key, model, temperature):
-        url = "https://api.openai.com/v1/chat/completions"
+    def call_openai(self, message, api_key, model, temperature, stream=False, context=None,
+                    deadline=None, cancel_token=None, history=None):
+        url = f"{PROVIDER_BASE_URLS['openai']}/v1/chat/completions"
         
         data = {
             "model": model,
             "messages": [
+                *(history or []),
                 {"role": "user", "content": message}
             ],
             "temperature": temperature,
             "max_tokens": 1024
         }
+        if context:
+            data["messages"].insert(0, {"role": "system", "content": context})
         
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
         
-        return self.make_api_request(url, data, headers)
+        if stream:
+            data["stream"] = True
+            return self.stream_api_request(url, data, headers, deadline, cancel_token, 'openai')
+        return self.make_api_request(url, data, headers, deadline, cancel_token, 'openai')
 
-    def call_anthropic(self, message, api_key, model, temperature):
-        url = "https://api.anthropic.com/v1/messages"
+    def call_anthropic(self, message, api_key, model, temperature, stream=False, context=None,
+                       deadline=None, cancel_token=None, history=None):
+        url = f"{PROVIDER_BASE_URLS['anthropic']}/v1/messages"
         
         data = {
             "model": model,
             "max_tokens": 1024,
             "temperature": temperature,
             "messages": [
+                *(history or []),
                 {"role": "user", "content": message}
             ]
         }
+        if context:
+            data["system"] = context
         
         headers = {
             "x-api-key": api_key,
@@ -129,17 +1278,23 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
             "Content-Type": "application/json"
         }
         
-        return self.make_api_request(url, data, headers)
+        if stream:
+            data["stream"] = True
+            return self.stream_api_request(url, data, headers, deadline, cancel_token, 'anthropic')
+        return self.make_api_request(url, data, headers, deadline, cancel_token, 'anthropic')
 
-    def call_nvidia_nim(self, message, api_key, nim_endpoint, model, temperature):
+    def call_nvidia_nim(self, message, api_key, nim_endpoint, model, temperature, stream=False, context=None,
+                        deadline=None, cancel_token=None, history=None):
         # Use NVIDIA's integrate API if no custom endpoint is provided
         if not nim_endpoint or nim_endpoint.strip() == "":
-            base_url = "https://integrate.api.nvidia.com/v1"
+            base_url = f"{PROVIDER_BASE_URLS['nvidia-nim']}/v1"
             url = f"{base_url}/chat/completions"
             print(f"🔗 Using NVIDIA hosted API: {url}")
         else:
             # Clean up the endpoint URL
-            base_url = nim_endpoint.rstrip('/').rstrip('/v1')
+            base_url = nim_endpoint.rstrip('/')
+            if base_url.endswith('/v1'):
+                base_url = base_url[:-len('/v1')]
             url = f"{base_url}/v1/chat/completions"
             print(f"🔗 Using custom endpoint: {url}")
         
@@ -148,69 +1303,275 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
         data = {
             "model": model,
             "messages": [
+                *(history or []),
                 {"role": "user", "content": message}
             ],
             "temperature": temperature,
             "top_p": 0.7,
             "max_tokens": 4096,
-            "stream": False
+            "stream": stream
         }
+        if context:
+            data["messages"].insert(0, {"role": "system", "content": context})
         
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
         
-        return self.make_api_request(url, data, headers)
+        if stream:
+            return self.stream_api_request(url, data, headers, deadline, cancel_token, 'nvidia-nim')
+        return self.make_api_request(url, data, headers, deadline, cancel_token, 'nvidia-nim')
+
+    def make_api_request(self, url, data, headers=None, deadline=None, cancel_token=None, provider=None):
+        """POST to a provider and return the answer text.
 
-    def make_api_request(self, url, data, headers=None):
+        ``deadline`` (a ``time.monotonic()`` value) caps the socket timeout;
+        ``cancel_token`` lets a hedging policy abort the call from another thread.
+        The call goes through the provider's rate limit, retry and circuit breaker layer.
+        """
         if headers is None:
             headers = {"Content-Type": "application/json"}
         
         # Prepare the request
-        json_data = json.dumps(data).encode('utf-8')
-        req = urllib.request.Request(url, data=json_data, headers=headers)
-        
-        # Create SSL context that doesn't verify certificates (for development)
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        try:
-            with urllib.request.urlopen(req, context=ssl_context) as response:
-                response_data = json.loads(response.read().decode('utf-8'))
-                
-                # Extract the actual response text based on the API format
-                if 'candidates' in response_data:  # Gemini
-                    return response_data['candidates'][0]['content']['parts'][0]['text']
-                elif 'choices' in response_data:  # OpenAI/NIM
-                    return response_data['choices'][0]['message']['content']
-                elif 'content' in response_data:  # Anthropic
-                    return response_data['content'][0]['text']
-                else:
-                    return str(response_data)
-                    
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
+        with span('json_encode'):
+            json_data = json.dumps(data).encode('utf-8')
+        
+        # Send it over a pooled keep-alive connection (shared SSL context, no per-call handshake)
+        def send():
+            with upstream_pool.request('POST', url, body=json_data, headers=headers, timeout=time_left(deadline),
+                                       cancel_token=cancel_token) as response:
+                with span('read', status=response.status) as read:
+                    body = response.read()
+                    read.set(bytes=len(body))
+                if response.status >= 400:
+                    raise UpstreamHTTPError(response.status, body.decode('utf-8', 'replace'), response.headers)
+                with span('parse'):
+                    return json.loads(body.decode('utf-8'))
+        
+        response_data = provider_limits.get(provider, url).call(send, deadline, cancel_token)
+        
+        # Extract the actual response text based on the API format
+        with span('extract'):
+            if 'candidates' in response_data:  # Gemini
+                return response_data['candidates'][0]['content']['parts'][0]['text']
+            elif 'choices' in response_data:  # OpenAI/NIM
+                return response_data['choices'][0]['message']['content']
+            elif 'content' in response_data:  # Anthropic
+                return response_data['content'][0]['text']
+            else:
+                return str(response_data)
+
+    def stream_api_request(self, url, data, headers=None, deadline=None, cancel_token=None, provider=None):
+        """Open a streaming request and return a generator of text deltas.
+
+        The upstream request is sent before this returns, so HTTP errors surface
+        immediately. Closing the generator closes the upstream connection, which
+        cancels generation on the provider side.
+        """
+        if headers is None:
+            headers = {"Content-Type": "application/json"}
+        headers = dict(headers, Accept="text/event-stream")
+        
+        with span('json_encode'):
+            json_data = json.dumps(data).encode('utf-8')
+        def send():
+            response = upstream_pool.request('POST', url, body=json_data, headers=headers,
+                                             timeout=time_left(deadline), cancel_token=cancel_token)
+            if response.status >= 400:
+                with response:
+                    body = response.read()
+                raise UpstreamHTTPError(response.status, body.decode('utf-8', 'replace'), response.headers)
+            return response
+        
+        # The provider's concurrency slot is held until the stream has been consumed
+        response, release = provider_limits.get(provider, url).call(send, deadline, cancel_token, keep_slot=True)
+        
+        def deltas():
             try:
-                error_data = json.loads(error_body)
-                raise Exception(f"API Error: {error_data}")
-            except:
-                raise Exception(f"HTTP Error {e.code}: {error_body}")
+                with response:
+                    yield from iter_text_deltas(response)
+                    # Drain any trailing bytes so the connection can be reused
+                    response.read()
+            finally:
+                release()
+        
+        return deltas()
 
-def run_server(port=8000):
+def run_server(port=8000, max_workers=DEFAULT_MAX_WORKERS, max_queue=DEFAULT_MAX_QUEUE,
+               max_upstream=DEFAULT_MAX_UPSTREAM, upstream_wait=DEFAULT_UPSTREAM_WAIT,
+               retrieval_default=RETRIEVAL_DEFAULT, context_tokens=DEFAULT_CONTEXT_TOKENS,
+               workers=1, reuse_port=False, hedge_after=DEFAULT_HEDGE_AFTER, deadline=DEFAULT_DEADLINE,
+               hedge_ratio=DEFAULT_HEDGE_RATIO, batch_concurrency=DEFAULT_BATCH_CONCURRENCY,
+               batch_max_items=DEFAULT_BATCH_MAX_ITEMS, documents_dir=DEFAULT_DOCUMENTS_DIR,
+               watch_interval=DEFAULT_WATCH_INTERVAL, admin_token=ADMIN_TOKEN):
     server_address = ('', port)
-    httpd = HTTPServer(server_address, CORSRequestHandler)
+    server_options = dict(max_workers=max_workers, max_queue=max_queue, max_upstream=max_upstream,
+                          upstream_wait=upstream_wait, retrieval_default=retrieval_default,
+                          context_tokens=context_tokens, hedge_after=hedge_after, deadline=deadline,
+                          hedge_ratio=hedge_ratio, batch_concurrency=batch_concurrency,
+                          batch_max_items=batch_max_items, admin_token=admin_token)
+    static_files.load(os.getcwd())
+    # The provider APIs get limiters of their own; endpoints sent by clients share the 'custom' ones
+    provider_limits.configure(endpoints=PROVIDER_BASE_URLS.values())
+    
+    def start_watcher():
+        # Threads do not survive fork, so each worker process runs its own watcher
+        if not documents_dir:
+            return None
+        watcher = DocumentWatcher(knowledge_base, documents_dir, watch_interval)
+        watcher.start()
+        return watcher
+
     print(f"🚀 Server running at http://localhost:{port}")
+    print(f"🧵 Threads: {max_workers}, queue: {max_queue}, max upstream calls: {max_upstream}")
     print(f"📁 Serving files from: {os.getcwd()}")
     print(f"🌐 Open your browser to: http://localhost:{port}")
     print("Press Ctrl+C to stop the server")
     
+    if workers > 1:
+        if prefork_supported():
+            def make_server(sock):
+                # Per-process resources must not be shared across fork
+                response_cache.after_fork()
+                semantic_cache.after_fork()
+                request_log.after_fork()
+                tracer.after_fork()
+                session_store.after_fork()
+                httpd = WorkerPoolHTTPServer(server_address, CORSRequestHandler, bind_and_activate=False,
+                                             document_watcher=start_watcher(), **server_options)
+                httpd.socket.close()
+                httpd.socket = sock
+                httpd.server_port = port
+                return httpd
+            
+            PreforkMaster(port, workers, make_server, preload=knowledge_base.warm_up,
+                          reuse_port=reuse_port).run()
+            upstream_pool.close_all()
+            return
+        print("⚠️ Multi-process mode needs os.fork; running a single process")
+    
+    httpd = WorkerPoolHTTPServer(server_address, CORSRequestHandler, document_watcher=start_watcher(),
+                                 **server_options)
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 Server stopped")
         httpd.server_close()
+        request_log.close()
+        tracer.close()
+        upstream_pool.close_all()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ECM Education Agent proxy server")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('ECM_WORKERS', '1')),
+                        help="number of pre-forked server processes sharing the port")
+    parser.add_argument('--reuse-port', action='store_true',
+                        help="give each worker process its own SO_REUSEPORT socket")
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="number of request handler threads per process")
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help="connections allowed to wait for a worker before answering 429")
+    parser.add_argument('--max-upstream', type=int, default=DEFAULT_MAX_UPSTREAM,
+                        help="maximum concurrent calls to LLM providers")
+    parser.add_argument('--upstream-wait', type=float, default=DEFAULT_UPSTREAM_WAIT,
+                        help="seconds a request may wait for an upstream slot")
+    parser.add_argument('--pool-size', type=int, default=upstream_pool.max_per_host,
+                        help="idle keep-alive connections kept per provider host")
+    parser.add_argument('--pool-idle-timeout', type=float, default=upstream_pool.idle_timeout,
+                        help="seconds an idle provider connection is kept before reconnecting")
+    parser.add_argument('--cache-max-bytes', type=int, default=response_cache.max_bytes,
+                        help="memory budget of the response cache (0 disables it)")
+    parser.add_argument('--cache-ttl', type=float, default=response_cache.ttl,
+                        help="seconds a cached answer stays valid")
+    parser.add_argument('--cache-path', default=None,
+                        help="sqlite file that persists cached answers across restarts")
+    parser.add_argument('--cache-all-temperatures', action='store_true',
+                        default=response_cache.cache_all_temperatures,
+                        help="also cache requests with temperature > 0")
+    parser.add_argument('--semantic-cache-max-bytes', type=int, default=semantic_cache.max_bytes,
+                        help="memory budget of the near-duplicate answer cache (0 disables it)")
+    parser.add_argument('--semantic-threshold', type=float, default=semantic_cache.threshold,
+                        help="prompt similarity (Jaccard, 0-1) at which a cached answer is reused")
+    parser.add_argument('--semantic-verify-rate', type=float, default=semantic_cache.verify_rate,
+                        help="fraction of near-duplicate hits answered upstream anyway to measure false hits")
+    parser.add_argument('--session-max-bytes', type=int, default=session_store.max_bytes,
+                        help="memory budget for conversation sessions (least recently used are evicted)")
+    parser.add_argument('--session-ttl', type=float, default=session_store.ttl,
+                        help="seconds an idle conversation session is kept")
+    parser.add_argument('--session-history-tokens', type=int, default=session_store.history_tokens,
+                        help="token budget for earlier turns sent with each session request")
+    parser.add_argument('--session-path', default=None,
+                        help="sqlite file that shares sessions between worker processes and restarts")
+    parser.add_argument('--retrieval', action='store_true', default=RETRIEVAL_DEFAULT,
+                        help="inject knowledge base passages into every chat request by default")
+    parser.add_argument('--context-tokens', type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="token budget for injected knowledge base passages")
+    parser.add_argument('--hedge-after', type=float, default=DEFAULT_HEDGE_AFTER,
+                        help="seconds before a request with fallbacks is raced against the next provider")
+    parser.add_argument('--hedge-max-ratio', type=float, default=DEFAULT_HEDGE_RATIO,
+                        help="maximum fraction of routed requests that may be hedged")
+    parser.add_argument('--deadline', type=float, default=DEFAULT_DEADLINE,
+                        help="default per-request deadline in seconds across all attempts")
+    parser.add_argument('--provider-rps', type=float, default=None,
+                        help="requests per second allowed per provider endpoint (0 = unlimited)")
+    parser.add_argument('--provider-burst', type=int, default=None,
+                        help="requests a provider endpoint may receive in a burst above its rate")
+    parser.add_argument('--provider-max-concurrency', type=int, default=None,
+                        help="ceiling of the adaptive concurrency limit per provider endpoint")
+    parser.add_argument('--upstream-retries', type=int, default=None,
+                        help="retries of 429/502/503/504 answers and dropped connections")
+    parser.add_argument('--breaker-threshold', type=int, default=None,
+                        help="consecutive provider failures that open its circuit breaker")
+    parser.add_argument('--breaker-cooldown', type=float, default=None,
+                        help="seconds an open circuit fails fast before letting a probe through")
+    parser.add_argument('--static-max-bytes', type=int, default=static_files.max_bytes,
+                        help="memory budget for cached static files and their compressed variants")
+    parser.add_argument('--static-max-age', type=int, default=static_files.max_age,
+                        help="Cache-Control max-age for static files (0 = always revalidate)")
+    parser.add_argument('--batch-concurrency', type=int, default=DEFAULT_BATCH_CONCURRENCY,
+                        help="concurrent requests per provider within one /api/chat/batch call")
+    parser.add_argument('--batch-max-items', type=int, default=DEFAULT_BATCH_MAX_ITEMS,
+                        help="maximum number of requests in one /api/chat/batch call")
+    parser.add_argument('--request-log', default=request_log.path,
+                        help="JSONL file to log every chat request to (API keys redacted, prompts hashed)")
+    parser.add_argument('--request-log-max-bytes', type=int, default=request_log.max_bytes,
+                        help="size at which the request log is rotated")
+    parser.add_argument('--request-log-prompts', action='store_true', default=request_log.log_prompts,
+                        help="also log prompt text, so benchmarks/replay.py can replay exact prompts")
+    parser.add_argument('--trace-rate', type=float, default=tracer.rate,
+                        help="fraction of chat requests traced span by span (0 disables tracing)")
+    parser.add_argument('--trace-path', default=tracer.output.path,
+                        help="Chrome trace-event file for sampled traces (open in ui.perfetto.dev)")
+    parser.add_argument('--profile-dir', default=profiler.directory,
+                        help="directory where /api/admin/profile saves collapsed-stack profiles")
+    parser.add_argument('--kb-docs', default=DEFAULT_DOCUMENTS_DIR,
+                        help="directory of markdown/text documents to watch and ingest into the knowledge base")
+    parser.add_argument('--kb-watch-interval', type=float, default=DEFAULT_WATCH_INTERVAL,
+                        help="seconds between scans of the documents directory")
+    parser.add_argument('--admin-token', default=ADMIN_TOKEN,
+                        help="bearer token for the /api/kb and /api/admin endpoints (default: localhost only)")
+    return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    run_server()
+    args = parse_args()
+    upstream_pool.configure(max_per_host=args.pool_size, idle_timeout=args.pool_idle_timeout)
+    response_cache.configure(max_bytes=args.cache_max_bytes, ttl=args.cache_ttl, path=args.cache_path,
+                             cache_all_temperatures=args.cache_all_temperatures)
+    semantic_cache.configure(max_bytes=args.semantic_cache_max_bytes, threshold=args.semantic_threshold,
+                             verify_rate=args.semantic_verify_rate)
+    request_log.configure(path=args.request_log, max_bytes=args.request_log_max_bytes,
+                          log_prompts=args.request_log_prompts)
+    tracer.configure(rate=args.trace_rate, path=args.trace_path)
+    profiler.configure(directory=args.profile_dir)
+    session_store.configure(max_bytes=args.session_max_bytes, ttl=args.session_ttl,
+                            history_tokens=args.session_history_tokens, path=args.session_path)
+    static_files.configure(max_bytes=args.static_max_bytes, max_age=args.static_max_age)
+    provider_limits.configure(rate=args.provider_rps, burst=args.provider_burst,
+                              max_concurrency=args.provider_max_concurrency, retries=args.upstream_retries,
+                              breaker_threshold=args.breaker_threshold, breaker_cooldown=args.breaker_cooldown)
+    run_server(args.port, args.max_workers, args.max_queue, args.max_upstream, args.upstream_wait,
+               args.retrieval, args.context_tokens, args.workers, args.reuse_port, args.hedge_after,
+               args.deadline, args.hedge_max_ratio, args.batch_concurrency, args.batch_max_items, args.kb_docs,
+               args.kb_watch_interval, args.admin_token)
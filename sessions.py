@@ -0,0 +1,342 @@
+"""
+Conversation sessions for /api/chat
+Keeps each conversation's turns server-side and assembles them into a messages array that fits the model's
+token budget, folding older turns into a short summary
+"""
+
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from data_dir import data_path
+from knowledge_base import estimate_tokens
+
+DEFAULT_MAX_BYTES = int(os.environ.get('ECM_SESSION_MAX_BYTES', str(16 * 1024 * 1024)))
+DEFAULT_TTL = float(os.environ.get('ECM_SESSION_TTL', str(2 * 3600)))
+DEFAULT_HISTORY_TOKENS = int(os.environ.get('ECM_SESSION_HISTORY_TOKENS', '3000'))
+DEFAULT_SUMMARY_TOKENS = int(os.environ.get('ECM_SESSION_SUMMARY_TOKENS', '300'))
+DEFAULT_MAX_TURNS = int(os.environ.get('ECM_SESSION_MAX_TURNS', '40'))
+DEFAULT_PATH = os.environ.get('ECM_SESSION_PATH') or None
+
+# Context windows by model name prefix (first match wins); history never takes more than what is left of it
+MODEL_CONTEXT_TOKENS = (
+    ('gemini-1.5', 1_000_000), ('gemini-2', 1_000_000), ('gemini', 32_000),
+    ('gpt-4o', 128_000), ('gpt-4-turbo', 128_000), ('gpt-4.1', 1_000_000), ('gpt-4', 8_192),
+    ('gpt-3.5', 16_385), ('o1', 128_000), ('o3', 200_000), ('o4', 200_000),
+    ('claude', 200_000),
+    ('meta/llama-3.1', 128_000), ('meta/llama', 8_192), ('mistralai', 32_000), ('nvidia', 32_000),
+)
+DEFAULT_CONTEXT_WINDOW = 8_192
+# Room left for the answer (the largest max_tokens any call_* method asks for)
+OUTPUT_RESERVE_TOKENS = 4096
+# Rough per-session and per-turn bookkeeping overhead counted against the memory budget
+SESSION_OVERHEAD = 300
+TURN_OVERHEAD = 100
+SUMMARY_HEADER = "Summary of the earlier part of this conversation:"
+SUMMARY_LINE_CHARS = 160
+SENTENCE_PATTERN = re.compile(r'(.+?[.?!])(?:\s|$)', re.DOTALL)
+
+
+def context_window(model: Optional[str]) -> int:
+    name = (model or '').lower()
+    for prefix, tokens in MODEL_CONTEXT_TOKENS:
+        if name.startswith(prefix):
+            return tokens
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def first_sentence(text: str, limit: int = SUMMARY_LINE_CHARS) -> str:
+    """Leading sentence of ``text`` on one line, cut at ``limit`` characters"""
+    text = ' '.join(text.split())
+    match = SENTENCE_PATTERN.match(text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= limit else sentence[:limit - 1].rstrip() + '…'
+
+
+def summarize_turn(message: str, response: str) -> str:
+    """One summary line for an exchange: what was asked and how the answer began"""
+    return f"- User asked: {first_sentence(message)} Assistant: {first_sentence(response)}"
+
+
+def fit_summary(lines: List[str], token_budget: int) -> List[str]:
+    """The most recent summary lines that fit ``token_budget``"""
+    kept = []
+    used = estimate_tokens(SUMMARY_HEADER)
+    for line in reversed(lines):
+        used += estimate_tokens(line) + 1
+        if used > token_budget:
+            break
+        kept.append(line)
+    kept.reverse()
+    return kept
+
+
+class Session:
+    """One conversation: verbatim (message, response) exchanges plus summary lines for older ones"""
+
+    def __init__(self, session_id: str, owner: str, turns=None, summary=None, created=None, revision=0):
+        self.id = session_id
+        self.owner = owner
+        self.turns: List[Tuple[str, str]] = [tuple(turn) for turn in turns or []]
+        self.summary: List[str] = list(summary or [])
+        self.created = created or time.time()
+        self.last_used = time.time()
+        self.revision = revision
+        self.size = self.measure()
+
+    def measure(self) -> int:
+        return (SESSION_OVERHEAD + sum(len(m.encode('utf-8')) + len(r.encode('utf-8')) + TURN_OVERHEAD
+                                       for m, r in self.turns)
+                + sum(len(line.encode('utf-8')) for line in self.summary))
+
+    def to_json(self) -> str:
+        return json.dumps({'turns': self.turns, 'summary': self.summary, 'created': self.created})
+
+
+class SessionStore:
+    """LRU store of conversation sessions with a memory budget, idle TTL and optional sqlite persistence.
+
+    The sqlite tier is what lets pre-forked worker processes share sessions:
+    each process keeps its own in-memory copy and reloads a session whenever
+    another process has recorded a newer revision of it.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL,
+                 history_tokens: int = DEFAULT_HISTORY_TOKENS, summary_tokens: int = DEFAULT_SUMMARY_TOKENS,
+                 max_turns: int = DEFAULT_MAX_TURNS, path: Optional[str] = DEFAULT_PATH):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_turns = max_turns
+        self._sessions: 'OrderedDict[str, Session]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.path = None
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.created = 0
+        self.resumed = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.turns_recorded = 0
+        self.turns_summarized = 0
+        if path:
+            self.open_disk(path)
+
+    def configure(self, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                  history_tokens: Optional[int] = None, summary_tokens: Optional[int] = None,
+                  max_turns: Optional[int] = None, path: Optional[str] = None):
+        """Adjust session settings at startup"""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if ttl is not None:
+            self.ttl = ttl
+        if history_tokens is not None:
+            self.history_tokens = history_tokens
+        if summary_tokens is not None:
+            self.summary_tokens = summary_tokens
+        if max_turns is not None:
+            self.max_turns = max_turns
+        if path:
+            self.open_disk(path)
+
+    def open_disk(self, path: str):
+        """Attach the shared sqlite tier, dropping sessions idle for longer than the TTL.
+
+        A relative ``path`` is placed in the data directory, never the served one.
+        """
+        path = data_path(path)
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, owner TEXT NOT NULL, '
+                   'data TEXT NOT NULL, revision INTEGER NOT NULL, last_used REAL NOT NULL)')
+        db.execute('DELETE FROM sessions WHERE last_used < ?', (time.time() - self.ttl,))
+        db.commit()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = db
+            self.path = path
+
+    def after_fork(self):
+        """Reopen the sqlite tier in a forked worker (connections must not cross fork)"""
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        if self.path:
+            self._db = None
+            self.open_disk(self.path)
+
+    def open(self, session_id: Optional[str], owner: str) -> Session:
+        """The caller's session ``session_id``, or a new one if it is unknown, expired or someone else's"""
+        now = time.time()
+        session = self._memory_get(session_id, now) if session_id else None
+        if session_id:
+            session = self._disk_refresh(session_id, session, now)
+        if session is not None and session.owner == owner:
+            session.last_used = now
+            with self._lock:
+                self.resumed += 1
+            return session
+        session = Session(secrets.token_urlsafe(16), owner)
+        with self._lock:
+            self.created += 1
+            self._store(session)
+        return session
+
+    def _memory_get(self, session_id: str, now: float) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if now - session.last_used > self.ttl:
+                self._discard(session_id)
+                self.expirations += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def _disk_refresh(self, session_id: str, session: Optional[Session], now: float) -> Optional[Session]:
+        """Reload ``session_id`` from sqlite when another process holds a newer revision"""
+        if self._db is None:
+            return session
+        with self._db_lock:
+            row = self._db.execute('SELECT revision FROM sessions WHERE id = ?', (session_id,)).fetchone()
+            if row is None or (session is not None and row[0] == session.revision):
+                return session
+            row = self._db.execute('SELECT owner, data, revision, last_used FROM sessions WHERE id = ?',
+                                   (session_id,)).fetchone()
+        if row is None or now - row[3] > self.ttl:
+            return None
+        data = json.loads(row[1])
+        fresh = Session(session_id, row[0], data['turns'], data['summary'], data['created'], row[2])
+        with self._lock:
+            self.reloads += 1
+            self._store(fresh)
+        return fresh
+
+    def _store(self, session: Session):
+        """Insert or replace ``session`` and evict least recently used ones over the budget (lock held)"""
+        self._discard(session.id)
+        self._sessions[session.id] = session
+        self._bytes += session.size
+        # Least recently used first, so idle sessions past the TTL are all at the front
+        expired_before = time.time() - self.ttl
+        while len(self._sessions) > 1:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_used >= expired_before:
+                break
+            self._discard(oldest.id)
+            self.expirations += 1
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            self._discard(session_id)
+            self.evictions += 1
+
+    def _discard(self, session_id: str):
+        previous = self._sessions.pop(session_id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+
+    def conversation(self, session: Optional[Session], model: Optional[str], message: str,
+                     context: Optional[str] = None) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """``(history, context)`` for one upstream call on ``model``.
+
+        ``history`` is the newest exchanges, as alternating user/assistant
+        messages, that fit the model's history budget next to the system
+        context and the new message. Exchanges that do not fit, and those
+        already folded out of the session, are summarized into the context.
+        """
+        if session is None:
+            return [], context
+        with self._lock:
+            turns = list(session.turns)
+            summary = list(session.summary)
+        reserved = estimate_tokens(context or '') + estimate_tokens(message or '') + OUTPUT_RESERVE_TOKENS
+        budget = max(0, min(self.history_tokens, context_window(model) - reserved))
+        kept = 0
+        used = 0
+        for user_text, assistant_text in reversed(turns):
+            used += estimate_tokens(user_text) + estimate_tokens(assistant_text) + 8
+            if used > budget:
+                break
+            kept += 1
+        dropped = turns[:len(turns) - kept]
+        if dropped:
+            summary += [summarize_turn(user_text, assistant_text) for user_text, assistant_text in dropped]
+        history = []
+        for user_text, assistant_text in turns[len(turns) - kept:]:
+            history.append({'role': 'user', 'content': user_text})
+            history.append({'role': 'assistant', 'content': assistant_text})
+        summary = fit_summary(summary, min(self.summary_tokens, budget))
+        if summary:
+            recap = SUMMARY_HEADER + '\n' + '\n'.join(summary)
+            context = f"{context}\n\n{recap}" if context else recap
+        return history, context
+
+    def record(self, session: Optional[Session], message: str, response: str):
+        """Append a completed exchange, folding the oldest ones into the summary past ``max_turns``"""
+        if session is None or not response:
+            return
+        with self._lock:
+            session.turns.append((message or '', response))
+            overflow = session.turns[:max(0, len(session.turns) - self.max_turns)]
+            if overflow:
+                del session.turns[:len(overflow)]
+                session.summary = fit_summary(
+                    session.summary + [summarize_turn(m, r) for m, r in overflow], self.summary_tokens)
+                self.turns_summarized += len(overflow)
+            session.last_used = time.time()
+            session.revision += 1
+            self.turns_recorded += 1
+            self._discard(session.id)
+            session.size = session.measure()
+            self._store(session)
+            data, revision = session.to_json(), session.revision
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute('INSERT OR REPLACE INTO sessions (id, owner, data, revision, last_used) '
+                                 'VALUES (?, ?, ?, ?, ?)',
+                                 (session.id, session.owner, data, revision, session.last_used))
+                self._db.commit()
+
+    def delete(self, session_id: str, owner: str) -> bool:
+        """End ``session_id`` if it belongs to ``owner``; False if it is unknown or someone else's"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            found = session is not None and session.owner == owner
+            if found:
+                self._discard(session_id)
+        if self._db is not None:
+            with self._db_lock:
+                deleted = self._db.execute('DELETE FROM sessions WHERE id = ? AND owner = ?',
+                                           (session_id, owner)).rowcount
+                self._db.commit()
+            found = found or deleted > 0
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'created': self.created,
+                'resumed': self.resumed,
+                'reloads': self.reloads,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'turns_recorded': self.turns_recorded,
+                'turns_summarized': self.turns_summarized,
+                'persistent': self._db is not None,
+            }
+
+# Global instance
+session_store = SessionStore()
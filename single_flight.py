@@ -0,0 +1,125 @@
+"""
+Single-flight coalescing of identical in-flight chat requests
+The first request for a key goes upstream; concurrent duplicates wait on (or stream) its result
+"""
+
+import hashlib
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class FlightAbandoned(Exception):
+    """The leading request stopped without a result its followers can use"""
+
+
+def owner_token(api_key: Optional[str]) -> str:
+    """Hash of the caller's API key, so errors only fan out to callers using the same key"""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+
+class Flight:
+    """One upstream call shared by every identical request that arrives while it runs"""
+
+    def __init__(self, owner: str):
+        self.owner = owner
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self._cond = threading.Condition()
+
+    def append(self, chunk: str):
+        """Publish a streamed delta to followers"""
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, result: Optional[str] = None):
+        """Complete the flight; non-streaming leaders pass the whole answer as ``result``"""
+        with self._cond:
+            if self.done:
+                return
+            if result is not None:
+                self.chunks.append(result)
+            self.done = True
+            self._cond.notify_all()
+
+    def fail(self, error: BaseException):
+        with self._cond:
+            if self.done:
+                return
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self, owner: str) -> Iterator[str]:
+        """Yield the leader's deltas as they arrive, then re-raise its error if it failed.
+
+        Errors are only shared with callers using the same API key; anyone else
+        gets ``FlightAbandoned`` and should make the call themselves.
+        """
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                finished = self.done
+                error = self.error
+            yield from pending
+            if finished and index >= len(self.chunks):
+                break
+        if error is not None:
+            if isinstance(error, FlightAbandoned) or owner != self.owner:
+                raise FlightAbandoned(str(error))
+            raise error
+
+    def result(self, owner: str) -> str:
+        """Block until the flight completes and return the full answer"""
+        return ''.join(self.follow(owner))
+
+
+class SingleFlight:
+    """Registry of in-flight calls keyed by normalized request"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key: str, owner: str) -> Tuple[Flight, bool]:
+        """Return ``(flight, is_leader)``; the leader must call ``release`` when done"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = Flight(owner)
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def release(self, key: str, flight: Flight):
+        """Unregister a leader's flight, abandoning it if it never completed"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.fail(FlightAbandoned("Leading request ended without a result"))
+
+    def has_followers(self, flight: Flight) -> bool:
+        with self._lock:
+            return flight.followers > 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+            }
+
+# Global instance
+chat_flights = SingleFlight()
@@ -0,0 +1,243 @@
+"""
+Static asset cache for the proxy server
+Serves the app's files from memory with precompressed gzip/brotli variants, ETag/Last-Modified
+validators, and os.sendfile for large files that are not cached
+"""
+
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+DEFAULT_MAX_FILE_BYTES = int(os.environ.get('ECM_STATIC_MAX_FILE_BYTES', str(1024 * 1024)))
+DEFAULT_MAX_BYTES = int(os.environ.get('ECM_STATIC_MAX_BYTES', str(64 * 1024 * 1024)))
+DEFAULT_CHECK_INTERVAL = float(os.environ.get('ECM_STATIC_CHECK_INTERVAL', '1'))
+DEFAULT_MAX_AGE = int(os.environ.get('ECM_STATIC_MAX_AGE', '0'))
+
+# Files loaded into memory at startup; anything else is cached on first request if small enough
+PRELOAD_EXTENSIONS = {'.html', '.js', '.css', '.json', '.svg', '.ico', '.png', '.jpg', '.jpeg', '.gif', '.webp',
+                      '.woff', '.woff2', '.txt', '.md', '.map'}
+SKIP_DIRECTORIES = {'__pycache__', 'node_modules', 'benchmarks'}
+# Never served from under the root, even if an operator points a data file there: dotfiles and dot-directories,
+# these directories, and databases (with their -wal/-shm/-journal files), logs, traces and profiles
+PRIVATE_DIRECTORIES = {'logs', '__pycache__'}
+PRIVATE_FILE_PATTERN = re.compile(r'\.(db|sqlite3?|jsonl|log|folded|idx)(\.\d+|-\w+)?$', re.IGNORECASE)
+# Only text-like types shrink enough to be worth compressing
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/xml')
+MIN_COMPRESS_BYTES = 256
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Encoding -> q-value from an Accept-Encoding header"""
+    encodings = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name.strip().lower()] = q
+    return encodings
+
+
+def not_modified(etags: Iterable[str], mtime_ns: int, if_none_match: Optional[str],
+                 if_modified_since: Optional[str]) -> bool:
+    """True when a client's cached copy with these validators is still current.
+
+    If-None-Match wins over If-Modified-Since when both are sent, and entity tags
+    are compared weakly (``W/"x"`` matches ``"x"``), as a conditional GET should.
+    """
+    if if_none_match:
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or any(etag.removeprefix('W/') in tags for etag in etags)
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have whole-second resolution
+        return mtime_ns // 1_000_000_000 <= since
+    return False
+
+
+class StaticAsset:
+    """One file's bytes, compressed variants and validators"""
+
+    def __init__(self, path: str, body: bytes, stat: os.stat_result):
+        self.path = path
+        self.body = body
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.checked = time.monotonic()
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:20] + '"'
+        self.variants: Dict[str, bytes] = {}
+        if len(body) >= MIN_COMPRESS_BYTES and self.content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body)
+                if len(compressed) < len(body):
+                    self.variants['br'] = compressed
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.body) + sum(len(variant) for variant in self.variants.values())
+
+    def variant_etag(self, encoding: Optional[str]) -> str:
+        # Each encoding is a different byte sequence, so it gets its own strong validator
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+    def select(self, accept_encoding: Optional[str]):
+        """(encoding or None, body) best matching the client's Accept-Encoding"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding, self.variants[encoding]
+        return None, self.body
+
+    def not_modified(self, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+        """True when the client's cached copy (of any encoding) is still current"""
+        return not_modified([self.variant_etag(encoding) for encoding in [None, *self.variants]], self.mtime_ns,
+                            if_none_match, if_modified_since)
+
+
+class StaticFiles:
+    """In-memory cache of the files under the served directory, reloaded when they change on disk"""
+
+    def __init__(self, max_file_bytes: int = DEFAULT_MAX_FILE_BYTES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 check_interval: float = DEFAULT_CHECK_INTERVAL, max_age: int = DEFAULT_MAX_AGE):
+        self.max_file_bytes = max_file_bytes
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.root = None
+        self._assets: Dict[str, StaticAsset] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_serves = 0
+        self.not_modified = 0
+        self.reloads = 0
+
+    def configure(self, max_bytes: Optional[int] = None, max_age: Optional[int] = None):
+        """Adjust cache settings at startup"""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_age is not None:
+            self.max_age = max_age
+
+    @property
+    def cache_control(self) -> str:
+        # Without a max-age browsers revalidate every time, which costs a 304 rather than the whole file
+        return f'public, max-age={self.max_age}' if self.max_age > 0 else 'no-cache'
+
+    def load(self, root: str):
+        """Preload the web assets under ``root`` (call once at startup, before forking workers)"""
+        self.root = os.path.realpath(root)
+        started = time.perf_counter()
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories[:] = [name for name in subdirectories
+                                 if not name.startswith('.') and name not in SKIP_DIRECTORIES]
+            for name in files:
+                path = os.path.join(directory, name)
+                if os.path.splitext(name)[1].lower() in PRELOAD_EXTENSIONS and not self.private(path):
+                    self.get(path)
+        stats = self.stats()
+        print(f"🗂️ Cached {stats['files']} static files ({stats['bytes'] // 1024} KB with compressed variants) "
+              f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def private(self, path: str) -> bool:
+        """True for paths that must not be served: outside the root, hidden, or a data file (see PRIVATE_*)"""
+        root = self.root or os.path.realpath(os.getcwd())
+        relative = os.path.relpath(os.path.realpath(path), root)
+        if relative == '.':
+            return False
+        parts = relative.split(os.sep)
+        if parts[0] == '..':
+            return True
+        return (any(part.startswith('.') or part in PRIVATE_DIRECTORIES for part in parts)
+                or PRIVATE_FILE_PATTERN.search(parts[-1]) is not None)
+
+    def get(self, path: str) -> Optional[StaticAsset]:
+        """The cached asset for ``path``, (re)loading it if it is new or changed; None if it is not cacheable"""
+        path = os.path.realpath(path)
+        asset = self._assets.get(path)
+        now = time.monotonic()
+        if asset is not None and now - asset.checked < self.check_interval:
+            return asset
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._forget(path)
+            return None
+        if asset is not None and (stat.st_mtime_ns, stat.st_size) == (asset.mtime_ns, asset.size):
+            asset.checked = now
+            return asset
+        if stat.st_size > self.max_file_bytes:
+            self._forget(path)
+            return None
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        fresh = StaticAsset(path, body, stat)
+        with self._lock:
+            previous = self._assets.pop(path, None)
+            if previous is not None:
+                self._bytes -= previous.memory_bytes
+                self.reloads += 1
+            if self._bytes + fresh.memory_bytes > self.max_bytes:
+                return None
+            self._assets[path] = fresh
+            self._bytes += fresh.memory_bytes
+        return fresh
+
+    def _forget(self, path: str):
+        with self._lock:
+            previous = self._assets.pop(path, None)
+            if previous is not None:
+                self._bytes -= previous.memory_bytes
+
+    def record(self, outcome: str):
+        with self._lock:
+            if outcome == 'hit':
+                self.hits += 1
+            elif outcome == 'disk':
+                self.disk_serves += 1
+            elif outcome == 'not_modified':
+                self.not_modified += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'files': len(self._assets),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_serves': self.disk_serves,
+                'not_modified': self.not_modified,
+                'reloads': self.reloads,
+                'brotli': brotli is not None,
+            }
+
+# Global instance
+static_files = StaticFiles()
@@ -0,0 +1,75 @@
+"""
+Incremental Server-Sent Events parsing for streamed LLM responses
+Turns OpenAI/NIM, Anthropic and Gemini streams into plain text deltas
+"""
+
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+
+def iter_sse_events(lines: Iterable[bytes]) -> Iterator[Dict[str, str]]:
+    """Yield ``{'event': ..., 'data': ...}`` dicts from an SSE byte stream, one line at a time"""
+    event = None
+    data = []
+    for raw in lines:
+        line = raw.decode('utf-8').rstrip('\r\n')
+        if not line:
+            if data:
+                yield {'event': event or 'message', 'data': '\n'.join(data)}
+            event = None
+            data = []
+            continue
+        if line.startswith(':'):
+            continue
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'event':
+            event = value
+        elif field == 'data':
+            data.append(value)
+    if data:
+        yield {'event': event or 'message', 'data': '\n'.join(data)}
+
+
+def extract_stream_delta(payload: Dict[str, Any]) -> Optional[str]:
+    """Extract the text delta from one streamed chunk, whatever the provider format"""
+    if 'candidates' in payload:  # Gemini
+        if not payload['candidates']:
+            return None
+        parts = payload['candidates'][0].get('content', {}).get('parts', [])
+        return ''.join(part.get('text', '') for part in parts) or None
+    if 'choices' in payload:  # OpenAI/NIM
+        if not payload['choices']:
+            return None
+        return payload['choices'][0].get('delta', {}).get('content') or None
+    if payload.get('type') == 'content_block_delta':  # Anthropic
+        return payload.get('delta', {}).get('text') or None
+    if payload.get('type') == 'error':  # Anthropic in-stream error
+        raise Exception(f"API Error: {payload.get('error')}")
+    return None
+
+
+def iter_text_deltas(lines: Iterable[bytes]) -> Iterator[str]:
+    """Yield text deltas from a provider's SSE stream until it reports completion"""
+    for event in iter_sse_events(lines):
+        if event['data'] == '[DONE]':  # OpenAI/NIM terminator
+            return
+        if event['event'] == 'message_stop':  # Anthropic terminator
+            return
+        try:
+            payload = json.loads(event['data'])
+        except ValueError:
+            continue
+        delta = extract_stream_delta(payload)
+        if delta:
+            yield delta
+
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    """Encode one Server-Sent Event for the browser"""
+    message = ''
+    if event:
+        message += f"event: {event}\n"
+    message += f"data: {json.dumps(data)}\n\n"
+    return message.encode('utf-8')
@@ -0,0 +1,9 @@
+"""
+Shared test setup: the server modules live at the repository root, not in a package
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
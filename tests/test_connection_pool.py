@@ -0,0 +1,59 @@
+"""
+Tests for the upstream keep-alive connection pool: reuse and stale connection counters
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from connection_pool import ConnectionPool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+        # '/drop' hangs up without saying so, like a server timing out an idle keep-alive connection
+        self.close_connection = self.path == '/drop'
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def get(pool, url):
+    with pool.request('GET', url) as response:
+        return response.read()
+
+
+def counters(pool):
+    stats = pool.stats()
+    return stats['new_connections'], stats['reused_connections'], stats['discarded_connections']
+
+
+def test_keep_alive_connections_are_reused(base_url):
+    pool = ConnectionPool()
+    assert get(pool, f"{base_url}/") == b'ok'
+    assert get(pool, f"{base_url}/") == b'ok'
+    assert counters(pool) == (1, 1, 0)
+
+
+def test_a_stale_connection_counts_as_discarded_not_reused(base_url):
+    pool = ConnectionPool()
+    assert get(pool, f"{base_url}/drop") == b'ok'
+    assert get(pool, f"{base_url}/") == b'ok'
+    # The pooled connection was dead, so the request went out on a second new one
+    assert counters(pool) == (2, 0, 1)
@@ -0,0 +1,80 @@
+"""
+Tests for the memory-mapped knowledge base index file
+"""
+
+import hashlib
+
+import pytest
+
+from kb_index import IndexFile, IndexFormatError, build, write_index
+from knowledge_base import InvertedIndex, KnowledgeBase
+
+TEXTS = {
+    'a': 'evidence chain model tracks provenance of every claim',
+    'b': 'the chain of custody keeps evidence intact',
+    'c': 'provenance tracking records where data came from and the evidence chain',
+}
+
+
+@pytest.fixture
+def in_memory():
+    index = InvertedIndex()
+    for doc_id, text in TEXTS.items():
+        index.add_document(doc_id, text)
+    return index
+
+
+@pytest.fixture
+def mapped(tmp_path, in_memory):
+    chunks = {doc_id: {'text': text, 'doc_id': doc_id, 'section': doc_id, 'section_path': [doc_id],
+                       'start': 0, 'end': len(text)} for doc_id, text in TEXTS.items()}
+    path = str(tmp_path / 'kb.idx')
+    write_index(path, hashlib.sha256(b'corpus').hexdigest(), in_memory, in_memory, chunks)
+    index_file = IndexFile(path)
+    index = InvertedIndex.from_storage(*index_file.postings('doc', index_file.strings('doc.ids')))
+    yield index
+    del index
+    index_file.close()
+
+
+def test_postings_match_the_in_memory_index(in_memory, mapped):
+    assert sorted(mapped.postings) == sorted(in_memory.postings)
+    for token, docs in in_memory.postings.items():
+        term = mapped.postings[token]
+        assert len(term) == len(docs)
+        assert {doc_id: list(positions) for doc_id, positions in term.items()} == docs
+        for doc_id, positions in docs.items():
+            assert list(term[doc_id]) == positions
+    assert dict(mapped.doc_lengths) == in_memory.doc_lengths
+
+
+def test_missing_terms_and_documents(mapped):
+    assert 'nonexistent' not in mapped.postings
+    assert mapped.postings.get('nonexistent') is None
+    assert mapped.postings['custody'].get('a') is None
+    assert mapped.postings['custody'].get('unknown-doc') is None
+
+
+def test_searches_agree_with_the_in_memory_index(in_memory, mapped):
+    for query in ('evidence chain', '"evidence chain"', '"chain of custody" evidence', 'provenance'):
+        assert mapped.search(query) == in_memory.search(query)
+        assert mapped.bm25(query) == in_memory.bm25(query)
+    assert mapped.phrase_positions('c', ['evidence', 'chain']) == in_memory.phrase_positions('c', ['evidence',
+                                                                                                    'chain'])
+
+
+def test_rejects_files_that_are_not_indexes(tmp_path):
+    path = tmp_path / 'bogus.idx'
+    path.write_bytes(b'not an index file at all, just some bytes')
+    with pytest.raises(IndexFormatError):
+        IndexFile(str(path))
+
+
+def test_knowledge_base_serves_the_same_results_from_a_built_file(tmp_path):
+    path = str(tmp_path / 'kb.idx')
+    build(path)
+    from_file = KnowledgeBase(index_path=path)
+    in_memory = KnowledgeBase(index_path=None)
+    assert from_file.snapshot.index_file is not None
+    for query in ('evidence chain', '"provenance tracking"', 'unit tests'):
+        assert from_file.search_chunks(query, 5) == in_memory.search_chunks(query, 5)
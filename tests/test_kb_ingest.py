@@ -0,0 +1,56 @@
+"""
+Tests for live document ingestion: knowledge base snapshots, front matter and the directory watcher
+"""
+
+from kb_ingest import DocumentWatcher, join_front_matter, make_document, split_front_matter
+from knowledge_base import KnowledgeBase
+
+HANDOUT = "# Zebra Handouts\n\nQuokka provenance drills for the zebra exercise."
+
+
+def test_ingest_publishes_a_new_generation():
+    kb = KnowledgeBase(index_path=None)
+    before = kb.snapshot
+    result = kb.ingest({'zebra.md': make_document('zebra.md', HANDOUT)})
+    assert result['added'] == 1 and result['generation'] == before.generation + 1
+    assert [hit['id'] for hit in kb.search_documents('quokka zebra')] == ['zebra.md']
+    # Readers holding the previous snapshot still see the previous documents
+    assert 'zebra.md' not in before.documents
+    assert not before.index.search('quokka')
+
+
+def test_unchanged_documents_are_not_reindexed():
+    kb = KnowledgeBase(index_path=None)
+    doc = make_document('zebra.md', HANDOUT, version='1')
+    kb.ingest({'zebra.md': doc})
+    generation = kb.snapshot.generation
+    assert kb.ingest({'zebra.md': dict(doc)})['generation'] == generation
+    result = kb.ingest({'zebra.md': None})
+    assert result['removed'] == 1
+    assert not kb.search_documents('quokka')
+
+
+def test_front_matter_round_trips():
+    text = join_front_matter({'title': 'Drills\nfor zebras', 'type': 'guideline', 'version': None}, HANDOUT)
+    metadata, body = split_front_matter(text)
+    assert metadata == {'title': 'Drills for zebras', 'type': 'guideline'}
+    assert body == HANDOUT
+    assert join_front_matter({}, HANDOUT) == HANDOUT
+
+
+def test_a_leading_rule_is_not_front_matter():
+    text = "---\nJust a horizontal rule, then text.\n"
+    assert split_front_matter(text) == ({}, text)
+
+
+def test_watcher_keeps_posted_metadata(tmp_path):
+    kb = KnowledgeBase(index_path=None)
+    watcher = DocumentWatcher(kb, str(tmp_path))
+    watcher.save('notes/zebra.md', HANDOUT, {'title': 'Zebra Drills', 'type': 'guideline', 'version': '2.1'})
+    watcher.sync()
+    doc = kb.get_document('notes/zebra.md')
+    assert (doc['title'], doc['type'], doc['version']) == ('Zebra Drills', 'guideline', '2.1')
+    assert doc['content'] == HANDOUT
+    assert watcher.delete('notes/zebra.md')
+    watcher.sync()
+    assert kb.get_document('notes/zebra.md') == {}
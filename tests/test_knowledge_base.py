@@ -0,0 +1,25 @@
+"""
+Tests for knowledge base snippets: match offsets and highlights
+"""
+
+from kb_ingest import make_document
+from knowledge_base import KnowledgeBase, token_spans, tokenize
+
+TEXT = "İstanbul ECM matrix. The matrix links every claim to its evidence."
+
+
+def test_token_spans_follow_the_original_text():
+    # 'İ' lower-cases to two characters, so the lower-cased text is longer than the original
+    assert tokenize('İstanbul ECM matrix') == ['i', 'stanbul', 'ecm', 'matrix']
+    assert [TEXT[start:end] for start, end in token_spans('İstanbul ECM matrix')] == ['İ', 'stanbul', 'ECM',
+                                                                                       'matrix']
+    assert len(token_spans(TEXT)) == len(tokenize(TEXT))
+
+
+def test_snippet_highlights_land_on_the_matches_after_non_ascii_text():
+    kb = KnowledgeBase(index_path=None)
+    kb.ingest({'cities.md': make_document('cities.md', TEXT)})
+    snippet, = kb.search_snippets('matrix evidence', top_k=1)
+    content = kb.get_document('cities.md')['content']
+    assert content[snippet['start']:snippet['end']] == snippet['text']
+    assert [content[start:end] for start, end in snippet['highlights']] == ['matrix', 'matrix', 'evidence']
@@ -0,0 +1,73 @@
+"""
+Tests for the Prometheus metrics and their text rendering
+"""
+
+import metrics
+from metrics import Registry, error_type
+
+
+def test_counter_renders_labelled_series():
+    registry = Registry()
+    requests = registry.counter('chat_total', 'Chat requests', ('provider', 'model'))
+    requests.inc('openai', 'gpt-4o')
+    requests.inc('openai', 'gpt-4o', amount=2)
+    text = registry.render()
+    assert '# TYPE chat_total counter' in text
+    assert 'chat_total{provider="openai",model="gpt-4o"} 3' in text
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('c', 'doc', ('model',)).inc('a"b\\c\nd')
+    assert 'c{model="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', 'Latency', (), (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        latency.observe(value)
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum 5.65' in lines
+    assert 'latency_seconds_count 4' in lines
+
+
+def test_gauge_goes_up_and_down():
+    registry = Registry()
+    in_flight = registry.gauge('in_flight', 'In flight')
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    assert 'in_flight 1' in registry.render().splitlines()
+
+
+def test_new_label_sets_past_the_limit_fold_into_other(monkeypatch):
+    monkeypatch.setattr(metrics, 'MAX_SERIES', 2)
+    registry = Registry()
+    requests = registry.counter('c', 'doc', ('model',))
+    for model in ('a', 'b', 'c', 'd'):
+        requests.inc(model)
+    text = registry.render()
+    assert 'c{model="other"} 2' in text
+    assert 'model="c"' not in text
+
+
+def test_collectors_are_rendered_as_gauges():
+    registry = Registry()
+    registry.add_collector(lambda: [('cache_entries', 'Entries', {'tier': 'memory'}, 3)])
+    text = registry.render()
+    assert '# TYPE cache_entries gauge' in text
+    assert 'cache_entries{tier="memory"} 3' in text
+
+
+def test_error_type_is_low_cardinality():
+    class UpstreamError(Exception):
+        status = 503
+
+    assert error_type(None) == ''
+    assert error_type(UpstreamError()) == 'http_503'
+    assert error_type(TimeoutError()) == 'timeout'
+    assert error_type(ValueError('details')) == 'ValueError'
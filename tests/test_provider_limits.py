@@ -0,0 +1,122 @@
+"""
+Tests for the per-provider limiters: retries, rate limits, circuit breaker and limiter lookup
+"""
+
+import pytest
+
+import provider_limits
+from provider_limits import (CUSTOM_ENDPOINT, CircuitOpenError, ProviderLimiter, ProviderLimits, RateLimitedError,
+                             TokenBucket, endpoint_of, parse_retry_after)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP Error {status}")
+        self.status = status
+        self.headers = headers or {}
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(provider_limits, 'RETRY_BASE_DELAY', 0.001)
+
+
+def failing(*errors, result='ok'):
+    """A send() that raises ``errors`` in turn, then returns ``result``; counts its calls"""
+    remaining = list(errors)
+
+    def send():
+        send.calls += 1
+        if remaining:
+            raise remaining.pop(0)
+        return result
+
+    send.calls = 0
+    return send
+
+
+def test_transient_errors_are_retried():
+    limiter = ProviderLimiter('openai', 'https://api.openai.com:443', retries=2)
+    send = failing(UpstreamError(503), ConnectionResetError())
+    assert limiter.call(send) == 'ok'
+    assert send.calls == 3
+    assert limiter.retried == 2
+    assert limiter.in_flight == 0
+
+
+def test_client_errors_are_not_retried():
+    limiter = ProviderLimiter('openai', 'https://api.openai.com:443', retries=2)
+    send = failing(UpstreamError(400))
+    with pytest.raises(UpstreamError):
+        limiter.call(send)
+    assert send.calls == 1
+
+
+def test_persistent_429_becomes_rate_limited_with_retry_after():
+    limiter = ProviderLimiter('openai', 'https://api.openai.com:443', retries=1)
+    send = failing(*[UpstreamError(429, {'Retry-After': '0'})] * 2)
+    with pytest.raises(RateLimitedError) as raised:
+        limiter.call(send)
+    assert raised.value.http_status == 429
+    assert raised.value.retry_after >= 1
+    assert isinstance(raised.value.__cause__, UpstreamError)
+
+
+def test_circuit_opens_after_consecutive_server_errors():
+    limiter = ProviderLimiter('openai', 'https://api.openai.com:443', retries=0, breaker_threshold=2,
+                              breaker_cooldown=60)
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            limiter.call(failing(UpstreamError(500)))
+    send = failing()
+    with pytest.raises(CircuitOpenError):
+        limiter.call(send)
+    assert send.calls == 0
+    assert limiter.stats()['circuit'] == 'open'
+
+
+def test_throttling_does_not_trip_the_breaker():
+    limiter = ProviderLimiter('openai', 'https://api.openai.com:443', retries=0, breaker_threshold=1)
+    with pytest.raises(RateLimitedError):
+        limiter.call(failing(UpstreamError(429)))
+    assert limiter.call(failing()) == 'ok'
+
+
+def test_rate_limit_rejects_calls_beyond_the_burst():
+    limiter = ProviderLimiter('openai', 'https://api.openai.com:443', rate=0.01, burst=1, max_wait=0)
+    assert limiter.call(failing()) == 'ok'
+    with pytest.raises(RateLimitedError):
+        limiter.call(failing())
+    assert limiter.throttled == 1
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=10, burst=1)
+    now = bucket.updated
+    assert bucket.take(now) == 0
+    assert bucket.take(now) == pytest.approx(0.1)
+    assert bucket.take(now + 0.2) == 0
+
+
+def test_client_supplied_endpoints_share_one_limiter():
+    limits = ProviderLimits()
+    limits.configure(endpoints=['https://integrate.api.nvidia.com'])
+    known = limits.get('nvidia-nim', 'https://integrate.api.nvidia.com/v1/chat/completions')
+    first = limits.get('nvidia-nim', 'https://nim-a.example/v1/chat/completions')
+    second = limits.get('nvidia-nim', 'http://nim-b.example:8000/v1/chat/completions')
+    assert first is second
+    assert first is not known
+    assert sorted(stats['endpoint'] for stats in limits.stats()) == \
+        sorted(['https://integrate.api.nvidia.com:443', CUSTOM_ENDPOINT])
+
+
+def test_endpoint_of_drops_path_and_query():
+    assert endpoint_of('https://example.com/v1/models/x?key=secret') == 'https://example.com:443'
+    assert endpoint_of('http://localhost:9000/v1') == 'http://localhost:9000'
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({'Retry-After': '3'}) == 3
+    assert parse_retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}) == 0
+    assert parse_retry_after({'Retry-After': 'soon'}) is None
+    assert parse_retry_after(None) is None
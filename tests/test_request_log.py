@@ -0,0 +1,78 @@
+"""
+Tests for the JSONL request log: what a record keeps of the request and size-based rotation
+"""
+
+import json
+import time
+
+from request_log import RequestLog, chat_record
+
+API_KEY = 'sk-proj-abcdefghijklmnopqrstuvwxyz0123'
+GEMINI_KEY = 'AIzaSyA1234567890abcdefghijklmnop'
+PROMPT = 'What does my private evidence file say about patient 4711?'
+
+
+class UpstreamError(Exception):
+    status = 403
+
+
+def written(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def chat_request(**fields):
+    return dict({'provider': 'gemini', 'model': 'gemini-1.5-flash', 'apiKey': API_KEY, 'message': PROMPT}, **fields)
+
+
+def log_records(path, records, **options):
+    log = RequestLog(path=str(path), flush_interval=0.01, **options)
+    for record in records:
+        log.log(record)
+    log.close()
+    return log
+
+
+def test_keys_and_prompts_are_not_written_without_log_prompts(tmp_path):
+    path = tmp_path / 'requests.jsonl'
+    error = UpstreamError(f"HTTP Error 403 for https://example.test/v1beta/models?key={GEMINI_KEY}: "
+                          f"Authorization: Bearer {API_KEY}")
+    log_records(path, [chat_record('/api/chat', chat_request(), time.perf_counter(), 'upstream'),
+                       chat_record('/api/chat', chat_request(), time.perf_counter(), error=error)])
+    text = path.read_text(encoding='utf-8')
+    assert API_KEY not in text and GEMINI_KEY not in text and PROMPT not in text
+    ok, failed = written(path)
+    assert 'prompt' not in ok
+    assert ok['key'] and ok['prompt_chars'] == len(PROMPT) and ok['source'] == 'upstream'
+    assert failed['error'] == 'http_403'
+    assert '[REDACTED]' in failed['error_message']
+
+
+def test_prompts_are_written_with_log_prompts(tmp_path):
+    path = tmp_path / 'requests.jsonl'
+    log_records(path, [chat_record('/api/chat', chat_request(), time.perf_counter(), log_prompts=True)])
+    record, = written(path)
+    assert record['prompt'] == PROMPT
+    assert API_KEY not in path.read_text(encoding='utf-8')
+
+
+def test_the_file_rotates_at_max_bytes(tmp_path):
+    path = tmp_path / 'requests.jsonl'
+    record = {'endpoint': '/api/chat', 'padding': 'x' * 80}
+    size = len(json.dumps(record, separators=(',', ':'))) + 1
+    log = RequestLog(path=str(path), max_bytes=3 * size, backups=2, flush_interval=0.01)
+    for batch in range(4):
+        for _ in range(3):
+            log.log(dict(record, batch=batch))
+        # Wait for each batch to be written, so every write reaches max_bytes exactly
+        for _ in range(200):
+            if log.written == 3 * (batch + 1):
+                break
+            time.sleep(0.01)
+    log.close()
+    assert log.rotations == 4
+    assert not path.exists()
+    # Two backups are kept; the oldest batches were deleted
+    assert [record['batch'] for record in written(f"{path}.1")] == [3, 3, 3]
+    assert [record['batch'] for record in written(f"{path}.2")] == [2, 2, 2]
+    assert not (tmp_path / 'requests.jsonl.3').exists()
@@ -0,0 +1,65 @@
+"""
+Tests for the exact-match response cache and its key
+"""
+
+from response_cache import ResponseCache, make_cache_key
+
+
+def test_key_ignores_whitespace_and_case():
+    assert make_cache_key('openai', 'gpt-4o', 0, 'What is  ECM?') == \
+        make_cache_key('openai', 'gpt-4o', 0.0, ' what is ecm? ')
+
+
+def test_key_covers_context_history_endpoint_and_owner():
+    base = make_cache_key('nvidia-nim', 'm', 0, 'q', 'ctx', 'https://nim.example/v1/', None, 'owner-a')
+    assert base == make_cache_key('nvidia-nim', 'm', 0, 'q', 'ctx', 'https://nim.example/v1', None, 'owner-a')
+    assert base != make_cache_key('nvidia-nim', 'm', 0, 'q', 'other ctx', 'https://nim.example/v1', None,
+                                  'owner-a')
+    assert base != make_cache_key('nvidia-nim', 'm', 0, 'q', 'ctx', 'https://nim.example/v1', None, 'owner-b')
+    history = [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'hello'}]
+    assert base != make_cache_key('nvidia-nim', 'm', 0, 'q', 'ctx', 'https://nim.example/v1', history,
+                                  'owner-a')
+
+
+def test_get_returns_what_was_put():
+    cache = ResponseCache()
+    assert cache.get('k') is None
+    cache.put('k', 'answer')
+    assert cache.get('k') == 'answer'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expired_entries_are_dropped():
+    cache = ResponseCache(ttl=60)
+    cache.put('k', 'answer')
+    cache.ttl = -1
+    assert cache.get('k') is None
+    assert cache.expirations == 1
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = ResponseCache(max_bytes=700)
+    cache.put('a', 'x' * 100)
+    cache.put('b', 'y' * 100)
+    cache.get('a')
+    cache.put('c', 'z' * 100)
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.evictions == 1
+
+
+def test_only_deterministic_requests_are_cached_by_default():
+    cache = ResponseCache()
+    assert cache.should_cache(0)
+    assert not cache.should_cache(0.7)
+    assert not cache.should_cache('warm')
+    cache.configure(cache_all_temperatures=True)
+    assert cache.should_cache(0.7)
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResponseCache(path=path).put('k', 'answer')
+    restarted = ResponseCache(path=path)
+    assert restarted.get('k') == 'answer'
+    assert restarted.disk_hits == 1
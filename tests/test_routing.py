@@ -0,0 +1,119 @@
+"""
+Tests for hedged and fallback routing across providers, with fake upstream calls
+"""
+
+import threading
+import time
+
+import pytest
+
+from routing import DeadlineExceeded, HedgeBudget, Route, RoutingPolicy
+
+PRIMARY = Route('openai', 'gpt-4o', 'key-a')
+BACKUP = Route('anthropic', 'claude-3-5-haiku', 'key-b')
+
+
+class UpstreamError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP Error {status}")
+        self.status = status
+
+
+def fake_upstream(**behaviours):
+    """A call(route, token) that runs ``behaviours[provider](token)`` and records which providers it saw"""
+    def call(route, token):
+        call.calls.append(route.provider)
+        call.tokens[route.provider] = token
+        return behaviours[route.provider](token)
+
+    call.calls = []
+    call.tokens = {}
+    return call
+
+
+def answer(text, after=0.0):
+    def behaviour(token):
+        time.sleep(after)
+        return text
+    return behaviour
+
+
+def fail(status):
+    def behaviour(token):
+        raise UpstreamError(status)
+    return behaviour
+
+
+def until_cancelled(token):
+    """A provider that never answers, like a stalled stream, until its request is cancelled"""
+    for _ in range(200):
+        if token.cancelled:
+            raise ConnectionResetError("cancelled")
+        time.sleep(0.01)
+    return 'too late'
+
+
+def test_a_slow_primary_loses_to_the_hedge_and_is_cancelled():
+    call = fake_upstream(openai=until_cancelled, anthropic=answer('backup'))
+    policy = RoutingPolicy([PRIMARY, BACKUP], hedge_after=0.05)
+    assert policy.run(call) == 'backup'
+    assert policy.winner is BACKUP
+    assert call.calls == ['openai', 'anthropic']
+    assert call.tokens['openai'].cancelled and not call.tokens['anthropic'].cancelled
+
+
+def test_a_late_answer_from_the_loser_is_discarded():
+    discarded = []
+    finished = threading.Event()
+
+    def discard(value):
+        discarded.append(value)
+        finished.set()
+
+    call = fake_upstream(openai=answer('late primary', after=0.2), anthropic=answer('backup'))
+    policy = RoutingPolicy([PRIMARY, BACKUP], hedge_after=0.05)
+    assert policy.run(call, discard) == 'backup'
+    assert finished.wait(2)
+    assert discarded == ['late primary']
+
+
+def test_a_server_error_falls_back():
+    call = fake_upstream(openai=fail(503), anthropic=answer('backup'))
+    policy = RoutingPolicy([PRIMARY, BACKUP])
+    assert policy.run(call) == 'backup'
+    assert call.calls == ['openai', 'anthropic']
+
+
+def test_a_client_error_does_not_fall_back():
+    call = fake_upstream(openai=fail(400), anthropic=answer('backup'))
+    with pytest.raises(UpstreamError) as raised:
+        RoutingPolicy([PRIMARY, BACKUP]).run(call)
+    assert raised.value.status == 400
+    assert call.calls == ['openai']
+
+
+def test_the_deadline_raises_deadline_exceeded():
+    call = fake_upstream(openai=until_cancelled, anthropic=until_cancelled)
+    policy = RoutingPolicy([PRIMARY, BACKUP], deadline=time.monotonic() + 0.1)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        policy.run(call)
+    assert time.monotonic() - started < 1
+    assert call.tokens['openai'].cancelled
+
+
+def test_hedges_beyond_the_budget_are_denied():
+    budget = HedgeBudget(max_ratio=0, burst=0)
+    call = fake_upstream(openai=answer('primary', after=0.1), anthropic=answer('backup'))
+    policy = RoutingPolicy.from_request({'fallbacks': [{'provider': 'anthropic', 'apiKey': 'key-b'}]}, PRIMARY,
+                                        hedge_after=0.02, budget=budget)
+    assert policy.run(call) == 'primary'
+    assert call.calls == ['openai']
+    assert budget.stats() == {'max_ratio': 0, 'requests': 1, 'hedges': 0, 'denied': 1}
+
+
+def test_the_budget_allows_a_share_of_requests_to_hedge():
+    budget = HedgeBudget(max_ratio=0.5, burst=0)
+    for _ in range(4):
+        budget.record_request()
+    assert [budget.try_hedge() for _ in range(3)] == [True, True, False]
@@ -0,0 +1,115 @@
+"""
+Tests for the near-duplicate (semantic) answer cache
+"""
+
+from semantic_cache import SemanticCache, prompt_terms
+
+ANSWER = "Provenance tracking records where each piece of evidence came from."
+
+
+def cache(**options):
+    return SemanticCache(**dict({'verify_rate': 0}, **options))
+
+
+def ask(semantic, message, provider='openai', context=None, owner='owner-a'):
+    return semantic.lookup(provider, 'gpt-4o', 0, message, None, context, owner)
+
+
+def remember(semantic, message, response=ANSWER, **scope):
+    semantic.put(ask(semantic, message, **scope), response)
+
+
+def test_question_framing_is_ignored():
+    assert prompt_terms("What's provenance tracking?") == prompt_terms('explain provenance tracking')
+
+
+def test_paraphrase_is_served_from_the_cache():
+    semantic = cache()
+    remember(semantic, "what's provenance tracking in ECM")
+    query = ask(semantic, 'explain provenance tracking in ECM')
+    assert query.response == ANSWER
+    assert query.similarity >= semantic.threshold
+    assert semantic.hits == 1
+
+
+def test_different_questions_miss():
+    semantic = cache()
+    remember(semantic, "what's provenance tracking in ECM")
+    assert ask(semantic, 'how do evidence chains handle retractions').response is None
+
+
+def test_numbers_and_negations_must_match():
+    semantic = cache(threshold=0.5)
+    remember(semantic, 'explain step 3 of the evidence chain')
+    assert ask(semantic, 'explain step 4 of the evidence chain').response is None
+    remember(semantic, 'why is provenance tracking required')
+    assert ask(semantic, 'why is provenance tracking not required').response is None
+
+
+def test_scope_covers_context_owner_and_provider():
+    semantic = cache()
+    remember(semantic, "what's provenance tracking in ECM", context='System prompt A')
+    assert ask(semantic, 'explain provenance tracking in ECM', context='System prompt A').response == ANSWER
+    assert ask(semantic, 'explain provenance tracking in ECM', context='System prompt B').response is None
+    assert ask(semantic, 'explain provenance tracking in ECM').response is None
+    assert ask(semantic, 'explain provenance tracking in ECM', context='System prompt A',
+               owner='owner-b').response is None
+    assert ask(semantic, 'explain provenance tracking in ECM', context='System prompt A',
+               provider='anthropic').response is None
+
+
+def test_prompts_outside_the_term_limits_are_not_compared():
+    semantic = cache()
+    assert ask(semantic, 'provenance') is None
+    assert ask(semantic, ' '.join(f'term{i}x' for i in range(semantic.max_terms + 1))) is None
+    assert semantic.ineligible == 2
+
+
+def test_sampled_false_hits_are_dropped():
+    semantic = cache(verify_rate=1)
+    remember(semantic, "what's provenance tracking in ECM")
+    query = ask(semantic, 'explain provenance tracking in ECM')
+    assert query.response is None and query.candidate is not None
+    semantic.put(query, 'Completely unrelated reply about lunch menus and weather.')
+    assert (semantic.verified, semantic.false_hits) == (1, 1)
+    semantic.verify_rate = 0
+    assert ask(semantic, 'explain provenance tracking in ECM').response != ANSWER
+
+
+def test_expired_entries_are_not_served():
+    semantic = cache()
+    remember(semantic, "what's provenance tracking in ECM")
+    semantic.ttl = -1
+    assert ask(semantic, 'explain provenance tracking in ECM').response is None
+    assert semantic.expirations == 1
+
+
+def test_memory_budget_evicts_oldest_entries():
+    semantic = cache(max_bytes=2000)
+    remember(semantic, "what's provenance tracking in ECM", 'a' * 700)
+    remember(semantic, 'how do evidence chains handle retractions', 'b' * 700)
+    assert semantic.evictions == 1
+    assert semantic.stats()['entries'] == 1
+
+
+def test_the_same_prompt_is_stored_once():
+    semantic = cache()
+    first = ask(semantic, "what's provenance tracking in ECM")
+    second = ask(semantic, "what's provenance tracking in ECM")
+    semantic.put(first, ANSWER)
+    stored = semantic.stats()['bytes']
+    semantic.put(second, ANSWER)
+    assert semantic.stats()['entries'] == 1
+    assert semantic.stats()['bytes'] == stored
+
+
+def test_a_verified_hit_refreshes_the_entry_instead_of_copying_it():
+    semantic = cache(verify_rate=1)
+    remember(semantic, "what's provenance tracking in ECM")
+    stored = semantic.stats()['bytes']
+    query = ask(semantic, 'explain provenance tracking in ECM')
+    assert query.candidate is not None
+    semantic.put(query, ANSWER)
+    assert (semantic.verified, semantic.false_hits) == (1, 0)
+    assert semantic.stats()['entries'] == 1
+    assert semantic.stats()['bytes'] == stored
@@ -0,0 +1,81 @@
+"""
+Tests for server-side conversation sessions
+"""
+
+from sessions import SUMMARY_HEADER, SessionStore
+
+
+def test_sessions_belong_to_their_owner():
+    store = SessionStore()
+    session = store.open('', 'owner-a')
+    store.record(session, 'What is ECM?', 'The Evidence Chain Method.')
+    assert store.open(session.id, 'owner-a') is session
+    stranger = store.open(session.id, 'owner-b')
+    assert stranger.id != session.id and not stranger.turns
+
+
+def test_only_the_owner_can_delete(tmp_path):
+    store = SessionStore(path=str(tmp_path / 'sessions.db'))
+    session = store.open('', 'owner-a')
+    store.record(session, 'q', 'a')
+    assert not store.delete(session.id, 'owner-b')
+    assert not store.delete('unknown', 'owner-a')
+    assert store.delete(session.id, 'owner-a')
+    assert not store.delete(session.id, 'owner-a')
+    assert store.open(session.id, 'owner-a').id != session.id
+
+
+def test_history_is_the_recorded_turns():
+    store = SessionStore()
+    session = store.open('', 'owner')
+    store.record(session, 'first question', 'first answer')
+    store.record(session, 'second question', 'second answer')
+    history, context = store.conversation(session, 'gpt-4o', 'third question', 'system prompt')
+    assert [turn['content'] for turn in history] == ['first question', 'first answer', 'second question',
+                                                      'second answer']
+    assert context == 'system prompt'
+
+
+def test_turns_beyond_the_budget_are_summarized():
+    store = SessionStore(history_tokens=100)
+    session = store.open('', 'owner')
+    for i in range(5):
+        store.record(session, f"Question number {i} about provenance. More detail here.", 'An answer. ' * 8)
+    history, context = store.conversation(session, 'gpt-4o', 'next', None)
+    assert 0 < len(history) < 10
+    assert history[-2]['content'].startswith('Question number 4')
+    # The newest dropped exchange is summarized right before the verbatim ones
+    newest_dropped = 4 - len(history) // 2
+    assert context.startswith(SUMMARY_HEADER)
+    assert context.endswith(f"User asked: Question number {newest_dropped} about provenance. Assistant: An answer.")
+
+
+def test_old_turns_fold_into_the_summary_past_max_turns():
+    store = SessionStore(max_turns=2)
+    session = store.open('', 'owner')
+    for i in range(4):
+        store.record(session, f"q{i}.", f"a{i}.")
+    assert [message for message, _ in session.turns] == ['q2.', 'q3.']
+    assert len(session.summary) == 2
+    assert store.turns_summarized == 2
+
+
+def test_least_recently_used_sessions_are_evicted():
+    store = SessionStore(max_bytes=1500)
+    first = store.open('', 'owner')
+    store.record(first, 'q', 'x' * 600)
+    second = store.open('', 'owner')
+    store.record(second, 'q', 'y' * 600)
+    assert store.evictions == 1
+    assert store.open(first.id, 'owner').id != first.id
+
+
+def test_another_process_sees_recorded_turns(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    worker_a, worker_b = SessionStore(path=path), SessionStore(path=path)
+    session = worker_a.open('', 'owner')
+    worker_a.record(session, 'q1', 'a1')
+    assert worker_b.open(session.id, 'owner').turns == [('q1', 'a1')]
+    worker_a.record(session, 'q2', 'a2')
+    assert worker_b.open(session.id, 'owner').turns == [('q1', 'a1'), ('q2', 'a2')]
+    assert worker_b.reloads == 2
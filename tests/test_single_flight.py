@@ -0,0 +1,137 @@
+"""
+Tests for single-flight coalescing of identical in-flight requests
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from response_cache import make_cache_key
+from single_flight import FlightAbandoned, SingleFlight, owner_token
+
+OWNER_A = owner_token('key-a')
+OWNER_B = owner_token('key-b')
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class Upstream:
+    """A fake provider call that blocks until released, counting how often it was made"""
+
+    def __init__(self, answer='answer', error=None):
+        self.answer = answer
+        self.error = error
+        self.calls = 0
+        self.gate = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.gate.wait(2)
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+
+def ask(flights, key, owner, upstream):
+    """What the chat handler does: follow a flight in progress, or lead one and share its outcome"""
+    flight, is_leader = flights.join(key, owner)
+    if not is_leader:
+        try:
+            return flight.result(owner)
+        except FlightAbandoned:
+            flight = None
+    try:
+        try:
+            response = upstream()
+        except Exception as e:
+            if flight is not None:
+                flight.fail(e)
+            raise
+        if flight is not None:
+            flight.finish(response)
+        return response
+    finally:
+        if flight is not None:
+            flights.release(key, flight)
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+def run_pair(flights, first, second, upstream):
+    """Start ``first`` leading, then ``second`` once it has joined; return both futures"""
+    pool = ThreadPoolExecutor(2)
+    leader = pool.submit(ask, flights, *first, upstream)
+    wait_for(lambda: upstream.calls == 1)
+    follower = pool.submit(ask, flights, *second, upstream)
+    wait_for(lambda: flights.stats()['coalesced'] == 1 or upstream.calls == 2)
+    upstream.gate.set()
+    pool.shutdown()
+    return leader, follower
+
+
+def test_identical_concurrent_calls_go_upstream_once():
+    flights, upstream = SingleFlight(), Upstream()
+    leader, follower = run_pair(flights, ('key', OWNER_A), ('key', OWNER_A), upstream)
+    assert leader.result() == follower.result() == 'answer'
+    assert upstream.calls == 1
+    assert flights.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 1}
+
+
+def test_a_leader_failure_reaches_followers_with_the_same_key():
+    flights, upstream = SingleFlight(), Upstream(error=UpstreamError('503 from provider'))
+    leader, follower = run_pair(flights, ('key', OWNER_A), ('key', OWNER_A), upstream)
+    for outcome in (leader, follower):
+        with pytest.raises(UpstreamError):
+            outcome.result()
+    assert upstream.calls == 1
+
+
+def test_a_leader_failure_is_not_shared_with_another_key():
+    flight = SingleFlight().join('key', OWNER_A)[0]
+    flight.fail(UpstreamError('401 invalid API key'))
+    with pytest.raises(FlightAbandoned):
+        flight.result(OWNER_B)
+    with pytest.raises(UpstreamError):
+        flight.result(OWNER_A)
+
+
+def test_followers_of_an_abandoned_flight_make_the_call_themselves():
+    flights = SingleFlight()
+    flight, _ = flights.join('key', OWNER_A)
+    follower, is_leader = flights.join('key', OWNER_A)
+    assert follower is flight and not is_leader
+    # The leader's client went away before an answer arrived
+    flights.release('key', flight)
+    with pytest.raises(FlightAbandoned):
+        follower.result(OWNER_A)
+    assert ask(flights, 'key', OWNER_A, lambda: 'own answer') == 'own answer'
+
+
+def test_followers_stream_the_leaders_deltas():
+    flight = SingleFlight().join('key', OWNER_A)[0]
+    deltas = flight.follow(OWNER_A)
+    flight.append('Hello')
+    assert next(deltas) == 'Hello'
+    flight.append(', world')
+    flight.finish()
+    assert list(deltas) == [', world']
+
+
+def test_different_owners_never_share_a_flight():
+    flights, upstream = SingleFlight(), Upstream()
+    keys = [make_cache_key('openai', 'gpt-4o', 0, 'What is ECM?', owner=owner) for owner in (OWNER_A, OWNER_B)]
+    assert keys[0] != keys[1]
+    leader, other = run_pair(flights, (keys[0], OWNER_A), (keys[1], OWNER_B), upstream)
+    assert leader.result() == other.result() == 'answer'
+    assert upstream.calls == 2
+    assert flights.stats() == {'in_flight': 0, 'leaders': 2, 'coalesced': 0}
@@ -0,0 +1,77 @@
+"""
+Tests for the static asset cache: conditional requests and files that must not be served
+"""
+
+import email.utils
+import os
+
+import pytest
+
+from static_files import StaticFiles, not_modified
+
+MTIME_NS = 1_700_000_000_123_456_789
+LAST_MODIFIED = email.utils.formatdate(MTIME_NS / 1e9, usegmt=True)
+
+
+def test_if_none_match_compares_whole_tags():
+    assert not_modified(['W/"abc-10"'], MTIME_NS, 'W/"abc-10"', None)
+    assert not_modified(['W/"abc-10"'], MTIME_NS, '"abc-10"', None)
+    assert not_modified(['"abc-10"'], MTIME_NS, '"other", W/"abc-10"', None)
+    assert not not_modified(['W/"abc-10"'], MTIME_NS, 'W/"abc-100"', None)
+    assert not not_modified(['W/"abc-100"'], MTIME_NS, 'W/"abc-10"', None)
+
+
+def test_if_none_match_star_matches_any_tag():
+    assert not_modified(['"abc"'], MTIME_NS, '*', None)
+
+
+def test_if_modified_since():
+    assert not_modified(['"abc"'], MTIME_NS, None, LAST_MODIFIED)
+    assert not not_modified(['"abc"'], MTIME_NS, None, 'Mon, 01 Jan 2001 00:00:00 GMT')
+    assert not not_modified(['"abc"'], MTIME_NS, None, 'not a date')
+    assert not not_modified(['"abc"'], MTIME_NS, None, None)
+
+
+def test_if_none_match_wins_over_if_modified_since():
+    assert not not_modified(['"abc"'], MTIME_NS, '"stale"', LAST_MODIFIED)
+
+
+def test_cached_assets_match_every_encoding(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_text('const answer = 42;\n' * 100)
+    files = StaticFiles()
+    asset = files.get(str(path))
+    assert 'gzip' in asset.variants
+    assert asset.not_modified(asset.variant_etag('gzip'), None)
+    assert asset.not_modified(asset.etag, None)
+    assert asset.not_modified(None, asset.last_modified)
+    assert not asset.not_modified('"something-else"', None)
+
+
+@pytest.fixture
+def served(tmp_path):
+    files = StaticFiles()
+    files.root = str(tmp_path)
+    return files, tmp_path
+
+
+@pytest.mark.parametrize('name', ['index.html', 'styles.css', 'docs/guide.md', 'api/chat.js'])
+def test_web_assets_are_public(served, name):
+    files, root = served
+    assert not files.private(os.path.join(root, name))
+
+
+@pytest.mark.parametrize('name', [
+    'sessions.db', 'sessions.db-wal', 'cache.sqlite3', 'requests.jsonl', 'requests.1.jsonl', 'server.log',
+    'profile-1-x.folded', 'knowledge_base.idx', 'logs/anything.txt', '.git/config', '.env', 'notes/.secret.md',
+    '__pycache__/server.cpython-311.pyc',
+])
+def test_data_files_and_dotfiles_are_private(served, name):
+    files, root = served
+    assert files.private(os.path.join(root, name))
+
+
+def test_paths_outside_the_root_are_private(served):
+    files, root = served
+    assert files.private(os.path.join(root, '..', 'elsewhere.html'))
+    assert not files.private(str(root))
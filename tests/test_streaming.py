@@ -0,0 +1,74 @@
+"""
+Tests for the SSE parser and the per-provider stream delta extraction
+"""
+
+import json
+
+import pytest
+
+from streaming import extract_stream_delta, format_sse, iter_sse_events, iter_text_deltas
+
+
+def sse(text):
+    """The stream as the response yields it: one bytes object per line"""
+    return [line.encode('utf-8') for line in text.splitlines(keepends=True)]
+
+
+def openai_chunk(content):
+    return 'data: ' + json.dumps({'choices': [{'delta': {'content': content}}]}) + '\n\n'
+
+
+def test_events_are_split_on_blank_lines():
+    events = list(iter_sse_events(sse(': keep-alive\n\nevent: ping\ndata: {}\n\ndata: one\r\n\r\ndata:two\n')))
+    assert events == [{'event': 'ping', 'data': '{}'}, {'event': 'message', 'data': 'one'},
+                      {'event': 'message', 'data': 'two'}]
+
+
+def test_data_lines_of_one_event_are_joined():
+    assert list(iter_sse_events(sse('data: first line\ndata: second line\n\n'))) == [
+        {'event': 'message', 'data': 'first line\nsecond line'}]
+
+
+def test_a_json_payload_split_over_data_lines():
+    stream = 'data: {"choices": [{"delta":\ndata: {"content": "Hel"}}]}\n\n' + openai_chunk('lo')
+    assert list(iter_text_deltas(sse(stream))) == ['Hel', 'lo']
+
+
+def test_openai_stream_stops_at_done():
+    stream = openai_chunk('Hello') + openai_chunk(', world') + 'data: [DONE]\n\n' + openai_chunk('ignored')
+    assert ''.join(iter_text_deltas(sse(stream))) == 'Hello, world'
+
+
+def test_anthropic_stream_stops_at_message_stop():
+    stream = (
+        'event: message_start\ndata: {"type": "message_start", "message": {}}\n\n'
+        'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"text": "Evidence"}}\n\n'
+        'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"text": " chain"}}\n\n'
+        'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+        'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"text": "ignored"}}\n\n'
+    )
+    assert ''.join(iter_text_deltas(sse(stream))) == 'Evidence chain'
+
+
+def test_anthropic_in_stream_error_raises():
+    stream = (
+        'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"text": "Partial"}}\n\n'
+        'event: error\ndata: {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}\n\n'
+    )
+    deltas = iter_text_deltas(sse(stream))
+    assert next(deltas) == 'Partial'
+    with pytest.raises(Exception, match='overloaded_error'):
+        next(deltas)
+
+
+def test_gemini_chunks_without_candidates_are_skipped():
+    assert extract_stream_delta({'candidates': []}) is None
+    assert extract_stream_delta({'choices': []}) is None
+    stream = ('data: {"candidates": [{"content": {"parts": [{"text": "ECM"}]}}]}\n\n'
+              'data: {"candidates": [], "usageMetadata": {"totalTokenCount": 12}}\n\n')
+    assert list(iter_text_deltas(sse(stream))) == ['ECM']
+
+
+def test_format_sse_round_trips():
+    encoded = format_sse({'content': 'Hi\nthere'}, event='delta')
+    assert list(iter_sse_events(sse(encoded.decode()))) == [{'event': 'delta', 'data': '{"content": "Hi\\nthere"}'}]
@@ -0,0 +1,307 @@
+"""
+Request tracing and sampling profiler for the proxy server
+Sampled chat requests record timed spans for each stage and export them as Chrome trace events; an on-demand
+profiler samples thread stacks into a flamegraph-ready collapsed profile
+"""
+
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from data_dir import data_path
+from request_log import DEFAULT_BACKUPS, RequestLog
+
+DEFAULT_TRACE_RATE = float(os.environ.get('ECM_TRACE_RATE', '0'))
+DEFAULT_TRACE_PATH = os.environ.get('ECM_TRACE_PATH', 'trace.json')
+DEFAULT_TRACE_MAX_BYTES = int(os.environ.get('ECM_TRACE_MAX_BYTES', str(64 * 1024 * 1024)))
+DEFAULT_PROFILE_INTERVAL = float(os.environ.get('ECM_PROFILE_INTERVAL', '0.005'))
+DEFAULT_PROFILE_DIR = os.environ.get('ECM_PROFILE_DIR', 'profiles')
+PROFILE_MAX_SECONDS = 300
+
+# Functions that mark a thread as working on a request (idle pool threads are left out of profiles by default)
+REQUEST_FRAMES = frozenset({'handle_one_request', 'attempt', 'work'})
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Chrome trace timestamps are microseconds; anchor the monotonic clock to wall time so files from
+# several worker processes line up
+_CLOCK_OFFSET = time.time() - time.perf_counter()
+
+
+def _microseconds(moment: float) -> int:
+    return int((moment + _CLOCK_OFFSET) * 1_000_000)
+
+
+class _TraceLocal(threading.local):
+    trace = None
+
+
+_local = _TraceLocal()
+
+
+class Trace:
+    """The spans of one sampled request, kept until the request finishes"""
+
+    __slots__ = ('id', 'name', 'args', 'started', 'events', 'threads', 'finished', 'sink')
+
+    def __init__(self, trace_id: str, name: str, args: Dict[str, Any], sink):
+        self.id = trace_id
+        self.name = name
+        self.args = args
+        self.started = time.perf_counter()
+        self.events: List[Dict[str, Any]] = []
+        self.threads: Dict[int, str] = {}
+        self.finished = False
+        self.sink = sink
+
+    def add(self, name: str, started: float, ended: float, args: Optional[Dict[str, Any]] = None,
+            error: Optional[type] = None):
+        thread = threading.current_thread()
+        event = {
+            'name': name, 'cat': 'chat', 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+            'ts': _microseconds(started), 'dur': int((ended - started) * 1_000_000),
+            'args': dict(args or {}, trace=self.id),
+        }
+        if error is not None:
+            event['args']['error'] = error.__name__
+        self.threads[thread.ident] = thread.name
+        if self.finished:
+            self.sink(event)  # A hedged attempt that outlived its request
+        else:
+            self.events.append(event)
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'args', 'started')
+
+    def __init__(self, trace: Trace, name: str, args: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, self.started, time.perf_counter(), self.args, exc_type)
+        return False
+
+    def set(self, **args):
+        """Attach values only known once the stage has run (sizes, statuses)"""
+        self.args.update(args)
+
+
+class NullSpan:
+    """What ``span()`` hands out when the request is not traced: entering and leaving it does nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name: str, **args) -> Any:
+    """Time a stage of the current thread's traced request (a no-op unless it was sampled)"""
+    trace = _local.trace
+    if trace is None:
+        return NULL_SPAN
+    return Span(trace, name, args)
+
+
+def current_trace() -> Optional[Trace]:
+    return _local.trace
+
+
+@contextmanager
+def adopt(trace: Optional[Trace]):
+    """Record spans on another thread (e.g. a hedged upstream attempt) into ``trace``"""
+    previous = _local.trace
+    _local.trace = trace
+    try:
+        yield
+    finally:
+        _local.trace = previous
+
+
+class TraceFile(RequestLog):
+    """Chrome trace-event file (JSON array format, left open so it can be appended to and rotated).
+
+    Load it in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    kind = 'traces'
+    header = '[\n'
+    separator = ',\n'
+
+
+class Tracer:
+    """Samples ``rate`` of the chat requests and writes their spans to a trace file"""
+
+    def __init__(self, rate: float = DEFAULT_TRACE_RATE, path: str = DEFAULT_TRACE_PATH,
+                 max_bytes: int = DEFAULT_TRACE_MAX_BYTES):
+        self.rate = rate
+        self.output = TraceFile(path, max_bytes, DEFAULT_BACKUPS)
+        self._random = random.Random()
+        self._ids = itertools.count(1)
+        self._named_threads = set()
+        self.traced = 0
+
+    def configure(self, rate: Optional[float] = None, path: Optional[str] = None):
+        """Adjust tracing settings at startup"""
+        if rate is not None:
+            self.rate = rate
+        if path is not None:
+            self.output.configure(path=path)
+
+    def after_fork(self):
+        self.output.after_fork()
+        self._random = random.Random()
+        self._named_threads = set()
+
+    def begin(self, name: str, **args) -> Optional[Trace]:
+        """Start tracing the current thread's request if it is sampled; returns None otherwise"""
+        if not self.rate or not self.output.path or self._random.random() >= self.rate:
+            return None
+        trace = Trace(f"{os.getpid()}-{next(self._ids)}", name, args, self.output.log)
+        _local.trace = trace
+        return trace
+
+    def finish(self, trace: Optional[Trace], **args):
+        """Close the request's root span and queue its events for writing"""
+        if trace is None:
+            return
+        _local.trace = None
+        trace.add(trace.name, trace.started, time.perf_counter(), dict(trace.args, **args))
+        trace.finished = True
+        pid = os.getpid()
+        for tid, thread_name in list(trace.threads.items()):
+            if tid not in self._named_threads:
+                self._named_threads.add(tid)
+                self.output.log({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': thread_name}})
+        for event in trace.events:
+            self.output.log(event)
+        self.traced += 1
+
+    def close(self):
+        self.output.close()
+
+    def stats(self) -> Dict[str, Any]:
+        output = self.output.stats()
+        return {
+            'rate': self.rate,
+            'traced': self.traced,
+            'events_written': output['written'],
+            'events_dropped': output['dropped'],
+            'profiling': profiler.running,
+            'profiles': profiler.profiles,
+        }
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class SamplingProfiler:
+    """Statistical wall-clock profiler: samples every thread's Python stack at a fixed interval.
+
+    Only runs while ``profile()`` is called, in the calling thread, so it costs
+    nothing the rest of the time. Stacks are counted in the collapsed format
+    ("outer;inner;leaf count" per line) read by flamegraph.pl, inferno and speedscope.
+    """
+
+    def __init__(self, interval: float = DEFAULT_PROFILE_INTERVAL, directory: str = DEFAULT_PROFILE_DIR):
+        self.interval = interval
+        self.directory = directory
+        self.running = False
+        self.profiles = 0
+        self._lock = threading.Lock()
+        self._labels: Dict[Any, str] = {}
+
+    def configure(self, interval: Optional[float] = None, directory: Optional[str] = None):
+        if interval is not None:
+            self.interval = interval
+        if directory is not None:
+            self.directory = directory
+
+    def profile(self, seconds: float, interval: Optional[float] = None, all_threads: bool = False) -> Dict[str, Any]:
+        """Sample for ``seconds``; returns the collapsed stacks, the sample count and where they were saved"""
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy("A profile is already running")
+            self.running = True
+        try:
+            interval = max(interval or self.interval, 0.001)
+            seconds = min(seconds, PROFILE_MAX_SECONDS)
+            print(f"🔬 Profiling for {seconds:g}s every {interval * 1000:g}ms")
+            counts = Counter()
+            samples = 0
+            me = threading.get_ident()
+            ends = time.perf_counter() + seconds
+            while time.perf_counter() < ends:
+                for tid, frame in sys._current_frames().items():
+                    if tid == me:
+                        continue
+                    stack = self._stack(frame)
+                    if all_threads or any(name in REQUEST_FRAMES for name, _ in stack):
+                        counts[';'.join(label for _, label in stack)] += 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            with self._lock:
+                self.running = False
+                self.profiles += 1
+        collapsed = ''.join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        return {'collapsed': collapsed, 'samples': samples, 'path': self._save(collapsed)}
+
+    def _stack(self, frame) -> List[tuple]:
+        """(function name, label) per frame, outermost first"""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                filename = code.co_filename
+                if filename.startswith(PROJECT_DIR):
+                    filename = os.path.relpath(filename, PROJECT_DIR)
+                else:
+                    filename = '/'.join(filename.split(os.sep)[-2:])
+                label = self._labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+            stack.append((code.co_name, label))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _save(self, collapsed: str) -> Optional[str]:
+        if not self.directory:
+            return None
+        name = f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        try:
+            # A relative directory is placed in the data directory, never the served one
+            path = data_path(os.path.join(self.directory, name))
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(collapsed)
+        except OSError as e:
+            print(f"⚠️ Could not save profile: {e}")
+            return None
+        print(f"🔬 Profile saved to {path}")
+        return path
+
+# Global instances
+tracer = Tracer()
+profiler = SamplingProfiler()
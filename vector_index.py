@@ -0,0 +1,147 @@
+"""
+Dense vector index for knowledge base chunks
+Feature-hashed TF-IDF vectors in one contiguous float32 NumPy matrix, computed offline
+"""
+
+import threading
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Vector search is optional; keyword search works without NumPy
+    np = None
+
+DEFAULT_DIMENSIONS = 1024
+CHAR_NGRAM = 3
+CHAR_NGRAM_WEIGHT = 0.5
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("NumPy is required for vector search (pip install numpy)")
+
+
+class HashingVectorizer:
+    """Maps text to a signed, feature-hashed bag of word unigrams, bigrams and character trigrams"""
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _add(self, counts: Dict[int, float], feature: str, weight: float):
+        # crc32 is stable across processes, unlike hash(), so vectors can be persisted
+        h = zlib.crc32(feature.encode('utf-8'))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        counts[h % self.dimensions] += sign * weight
+
+    def features(self, tokens: Sequence[str]) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Sparse (indices, values) term frequencies with sublinear scaling"""
+        require_numpy()
+        counts: Dict[int, float] = defaultdict(float)
+        for i, token in enumerate(tokens):
+            self._add(counts, token, 1.0)
+            if i:
+                self._add(counts, f"{tokens[i - 1]} {token}", 1.0)
+            padded = f"<{token}>"
+            for j in range(len(padded) - CHAR_NGRAM + 1):
+                self._add(counts, '#' + padded[j:j + CHAR_NGRAM], CHAR_NGRAM_WEIGHT)
+        indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        # Sublinear TF keeps repeated words from dominating, preserving the hash sign
+        values = np.sign(values) * np.log1p(np.abs(values))
+        return indices, values.astype(np.float32)
+
+
+class VectorIndex:
+    """Row-normalised TF-IDF matrix of chunk vectors scored by matrix products"""
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.vectorizer = HashingVectorizer(dimensions)
+        self.features: Dict[str, Tuple['np.ndarray', 'np.ndarray']] = {}
+        # (ids, matrix, idf) swapped as one tuple so readers never see a mix of builds
+        self.snapshot: Tuple[List[str], Optional['np.ndarray'], Optional['np.ndarray']] = ([], None, None)
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    @property
+    def dimensions(self) -> int:
+        return self.vectorizer.dimensions
+
+    def add(self, item_id: str, tokens: Sequence[str]):
+        self.features[item_id] = self.vectorizer.features(tokens)
+        self._dirty = True
+
+    def remove(self, item_id: str):
+        if self.features.pop(item_id, None) is not None:
+            self._dirty = True
+
+    def build(self):
+        """(Re)build the contiguous matrix and IDF weights from the stored features"""
+        require_numpy()
+        ids = list(self.features)
+        matrix = np.zeros((len(ids), self.dimensions), dtype=np.float32)
+        for row, item_id in enumerate(ids):
+            indices, values = self.features[item_id]
+            np.add.at(matrix[row], indices, values)
+        df = np.count_nonzero(matrix, axis=0).astype(np.float32)
+        idf = np.log((1 + len(ids)) / (1 + df)).astype(np.float32) + 1
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+        self.snapshot = (ids, np.ascontiguousarray(matrix), idf)
+        self._dirty = False
+
+    def copy(self) -> 'VectorIndex':
+        """A clone sharing the stored features and current matrix until either is rebuilt"""
+        index = VectorIndex(self.dimensions)
+        index.features = dict(self.features)
+        index.snapshot = self.snapshot
+        index._dirty = self._dirty
+        return index
+
+    def load(self, ids: Sequence[str], matrix: 'np.ndarray', idf: 'np.ndarray'):
+        """Serve a prebuilt matrix (e.g. memory-mapped from an index file) instead of building one"""
+        self.features = {}
+        self.snapshot = (ids, matrix, idf)
+        self._dirty = False
+
+    def _ensure_built(self):
+        if self._dirty:
+            with self._lock:
+                if self._dirty:
+                    self.build()
+
+    def embed(self, token_lists: Sequence[Sequence[str]], idf: 'np.ndarray') -> 'np.ndarray':
+        """Query matrix (one normalised row per token list) in the index's feature space"""
+        queries = np.zeros((len(token_lists), self.dimensions), dtype=np.float32)
+        for row, tokens in enumerate(token_lists):
+            indices, values = self.vectorizer.features(tokens)
+            np.add.at(queries[row], indices, values)
+        queries *= idf
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        return queries
+
+    def query(self, tokens: Sequence[str], top_k: int = 5) -> List[Tuple[str, float]]:
+        """Top-k ids by cosine similarity: one matrix-vector product plus argpartition"""
+        return self.query_batch([tokens], top_k)[0]
+
+    def query_batch(self, token_lists: Sequence[Sequence[str]], top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        """Score many queries at once with a single matrix-matrix product"""
+        self._ensure_built()
+        ids, matrix, idf = self.snapshot
+        if not ids:
+            return [[] for _ in token_lists]
+        queries = self.embed(token_lists, idf)
+        scores = queries @ matrix.T
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row in range(len(token_lists)):
+            row_top = top[row][np.argsort(-scores[row, top[row]])]
+            results.append([(ids[i], float(scores[row, i])) for i in row_top if scores[row, i] > 0])
+        return results
+
+    def memory_bytes(self) -> int:
+        matrix = self.snapshot[1]
+        return 0 if matrix is None else int(matrix.nbytes)